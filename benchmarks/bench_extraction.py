@@ -0,0 +1,97 @@
+"""
+bench_extraction.py
+
+Description: Compares the "dom" and "script" message extraction modes on a live chat.
+Logs into WhatsApp Web, opens the given contact, scrolls to the top of the chat and then
+runs both extractors on the same rendered rows. For each mode it reports the number of
+WebDriver commands issued and the wall time, and it checks that both modes return
+identical messages.
+
+Usage:
+    python benchmarks/bench_extraction.py "Contact name" [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+
+import page_waits
+import scrape_metrics
+import whatsapp_message_scraper as scraper
+
+
+def run_extractor(name, driver):
+    """
+    Runs one extraction mode and measures it.
+
+    Args:
+        name (str): The key of the extractor in scraper.EXTRACTORS.
+        driver (WebDriver): The instrumented WebDriver instance controlling Chrome.
+
+    Returns:
+        tuple: (messages, number of WebDriver commands, wall time in seconds)
+    """
+    commands_before = sum(scrape_metrics.current.command_counts.values())
+    start = time.perf_counter()
+    messages = scraper.EXTRACTORS[name](driver)
+    elapsed = time.perf_counter() - start
+    commands = sum(scrape_metrics.current.command_counts.values()) - commands_before
+    return messages, commands, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("Usage:")[0])
+    parser.add_argument("contact", help="Name of the private chat to benchmark on.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs per mode.")
+    args = parser.parse_args()
+
+    options = Options()
+    options.add_argument("--start-maximized")
+    driver = webdriver.Chrome(options, Service())
+
+    try:
+        page_waits.configure_waits(driver)
+        scraper.QR_code(driver)
+        scraper.search_for_contact(args.contact, driver)
+        page_waits.wait_for_chat_open(driver, args.contact)
+        scraper.scroll_to_top_of_private_chat(driver)
+
+        scrape_metrics.instrument_driver(driver)
+        results = {}
+
+        for _ in range(args.repeat):
+            for name in ("dom", "script"):
+                messages, commands, elapsed = run_extractor(name, driver)
+                results.setdefault(name, []).append((messages, commands, elapsed))
+
+        print(f"\n{'mode':<8}{'messages':>10}{'commands':>12}{'cmd/msg':>10}{'seconds':>10}")
+        for name, runs in results.items():
+            messages, commands, _ = runs[-1]
+            best = min(elapsed for _, _, elapsed in runs)
+            per_message = commands / len(messages) if messages else 0
+            print(f"{name:<8}{len(messages):>10}{commands:>12}{per_message:>10.1f}{best:>10.2f}")
+
+        dom_messages = results["dom"][-1][0]
+        script_messages = results["script"][-1][0]
+        if dom_messages == script_messages:
+            print("\nBoth modes returned identical messages.")
+        else:
+            print("\n[WARN] The extraction modes returned different messages!")
+            for index, (expected, actual) in enumerate(zip(dom_messages, script_messages)):
+                if expected != actual:
+                    print(f"First difference at row {index}:\n  dom:    {expected}\n  script: {actual}")
+                    break
+
+    finally:
+        driver.quit()
+
+
+if __name__ == '__main__':
+    main()
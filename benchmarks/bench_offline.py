@@ -0,0 +1,300 @@
+"""
+bench_offline.py
+
+Description: Benchmarks the scraper against the synthetic WhatsApp Web page generated by
+fixture_generator.py, so no account, phone or network is needed. The page is served from
+a local HTTP server and driven in headless Chrome through the scraper's own functions:
+
+    - sidebar: find_contact_names on a chat list of each requested size, per sidebar
+      extraction mode
+    - chat: scrape_chat (open from the sidebar, scroll to the top through the lazy
+      loading and banners, extract) on a chat of each requested size, per extraction mode;
+      the "indexeddb" mode reads the chat from the page's seeded IndexedDB stand-in
+
+For every run it reports the wall time, the WebDriver commands issued, the browser's JS
+heap and DOM node count afterwards, and the peak Python memory, and it checks the result
+against what the page generated. Results can be saved as JSON and compared with an
+earlier run to catch regressions.
+
+Usage:
+    python benchmarks/bench_offline.py [--messages 100 10000 100000] [--chats 50 1000]
+                                       [--output results.json] [--baseline previous.json]
+"""
+
+import argparse
+import functools
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+import page_waits
+import scrape_metrics
+import whatsapp_message_scraper as scraper
+import whatsapp_selectors as sel
+from fixture_generator import generate_fixture
+
+
+# How long the page may take to render its chat list, in seconds
+PAGE_LOAD_TIMEOUT = 30
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fixture(directory):
+    """
+    Serves a directory over HTTP on a free local port, from a daemon thread.
+
+    Args:
+        directory (str): The directory holding the fixture page.
+
+    Returns:
+        tuple: (the server, the URL of index.html)
+    """
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/index.html"
+
+
+def open_fixture(driver, url, **config):
+    """
+    Loads the fixture page with the given settings and waits for its chat list.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        url (str): The URL of the fixture page.
+        **config: Settings passed to the page in its query string.
+    """
+    query = "&".join(f"{key}={value}" for key, value in config.items())
+    driver.get(f"{url}?{query}")
+    WebDriverWait(driver, PAGE_LOAD_TIMEOUT).until(
+        EC.presence_of_element_located((By.XPATH, sel.CHAT_LIST_XPATH))
+    )
+
+
+def browser_memory(driver):
+    """
+    Reads the page's memory use through the DevTools protocol.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+
+    Returns:
+        dict: {"js_heap_bytes", "dom_nodes"}
+    """
+    driver.execute_cdp_cmd("Performance.enable", {})
+    metrics = {
+        metric["name"]: metric["value"]
+        for metric in driver.execute_cdp_cmd("Performance.getMetrics", {})["metrics"]
+    }
+    return {
+        "js_heap_bytes": int(metrics.get("JSHeapUsedSize", 0)),
+        "dom_nodes": int(metrics.get("Nodes", 0)),
+    }
+
+
+def measure(driver, run):
+    """
+    Runs a benchmark step and measures its time, WebDriver commands and memory.
+
+    Args:
+        driver (WebDriver): The instrumented WebDriver instance controlling Chrome.
+        run (callable): The step to measure; its return value is passed through.
+
+    Returns:
+        tuple: (the step's result, dict of measurements)
+    """
+    commands_before = sum(scrape_metrics.current.command_counts.values())
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = run()
+    finally:
+        elapsed = time.perf_counter() - start
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    commands = sum(scrape_metrics.current.command_counts.values()) - commands_before
+
+    measurements = {
+        "seconds": elapsed,
+        "webdriver_commands": commands,
+        "python_peak_bytes": python_peak,
+    }
+    measurements.update(browser_memory(driver))
+    return result, measurements
+
+
+def bench_sidebar(driver, url, chats, mode):
+    """
+    Times a full sidebar scan.
+
+    Args:
+        driver (WebDriver): The instrumented WebDriver instance controlling Chrome.
+        url (str): The URL of the fixture page.
+        chats (int): The number of chats in the list.
+        mode (str): The sidebar extraction mode.
+
+    Returns:
+        dict: The measurements, plus whether the expected private chats were found.
+    """
+    open_fixture(driver, url, chats=chats)
+    expected = set(driver.execute_script("return window.fixture.privateChats()"))
+
+    names, result = measure(driver, lambda: scraper.find_contact_names(driver, mode))
+
+    result.update({"benchmark": "sidebar", "mode": mode, "size": chats,
+                   "correct": set(names) == expected})
+    return result
+
+
+def bench_chat(driver, url, messages, mode, fixture_settings):
+    """
+    Times scraping one chat from opening it to its extracted messages.
+
+    Args:
+        driver (WebDriver): The instrumented WebDriver instance controlling Chrome.
+        url (str): The URL of the fixture page.
+        messages (int): The number of messages in the chat.
+        mode (str): The message extraction mode.
+        fixture_settings (dict): Further settings for the page, e.g. its latency.
+
+    Returns:
+        dict: The measurements, plus whether every rendered row was extracted.
+    """
+    from_storage = mode == "indexeddb"
+    open_fixture(driver, url, chats=1, messages=messages, storage=int(from_storage),
+                 **fixture_settings)
+    contact = driver.execute_script("return window.fixture.chatName(0)")
+    if from_storage:
+        driver.execute_async_script("window.fixture.storageReady.then(arguments[0])")
+        # Stored messages have no date separator rows
+        expected_rows = driver.execute_script("return window.fixture.messageCount(0)")
+    else:
+        expected_rows = driver.execute_script("return window.fixture.rowCount(0)")
+    handle = scraper.find_contact_names(driver, "script").get(contact)
+
+    options = scraper.ScrapeOptions(extraction=mode)
+    extracted, result = measure(
+        driver, lambda: scraper.scrape_chat(contact, driver, options, handle=handle)
+    )
+
+    result.update({"benchmark": "chat", "mode": mode, "size": messages,
+                   "correct": len(extracted) == expected_rows})
+    return result
+
+
+def print_results(results, baseline=None):
+    """
+    Prints the results as a table, with the change in time against a baseline run.
+
+    Args:
+        results (list): The measurement dicts.
+        baseline (list): The measurement dicts of an earlier run, if any.
+
+    Returns:
+        float: The largest slowdown against the baseline in percent (0 without one).
+    """
+    previous = {(r["benchmark"], r["mode"], r["size"]): r for r in baseline or []}
+    worst = 0.0
+
+    print(f"\n{'benchmark':<10}{'mode':<10}{'size':>8}{'seconds':>10}{'commands':>10}"
+          f"{'JS heap MB':>12}{'DOM nodes':>11}{'py MB':>8}  ok  vs baseline")
+    for r in results:
+        change = ""
+        before = previous.get((r["benchmark"], r["mode"], r["size"]))
+        if before is not None and before["seconds"]:
+            percent = (r["seconds"] - before["seconds"]) / before["seconds"] * 100
+            worst = max(worst, percent)
+            change = f"{percent:+.1f}%"
+        print(f"{r['benchmark']:<10}{r['mode']:<10}{r['size']:>8}{r['seconds']:>10.2f}"
+              f"{r['webdriver_commands']:>10}{r['js_heap_bytes'] / 2**20:>12.1f}"
+              f"{r['dom_nodes']:>11}{r['python_peak_bytes'] / 2**20:>8.1f}"
+              f"  {'yes' if r['correct'] else 'NO '} {change}")
+
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("Usage:")[0])
+    parser.add_argument("--messages", type=int, nargs="*", default=[100, 10000, 100000],
+                        help="Chat sizes to benchmark (default: 100 10000 100000).")
+    parser.add_argument("--chats", type=int, nargs="*", default=[50, 1000],
+                        help="Chat list sizes to benchmark (default: 50 1000).")
+    parser.add_argument("--extraction", nargs="*", choices=scraper.EXTRACTION_MODES,
+                        default=["script"], help="Message extraction modes (default: script).")
+    parser.add_argument("--sidebar-extraction", nargs="*",
+                        choices=scraper.SIDEBAR_EXTRACTION_MODES,
+                        default=scraper.SIDEBAR_EXTRACTION_MODES,
+                        help="Sidebar extraction modes (default: all).")
+    parser.add_argument("--latency", type=int, default=20,
+                        help="Milliseconds the page takes to render older messages.")
+    parser.add_argument("--sync-ms", type=int, default=500,
+                        help="Milliseconds the page shows the syncing banner.")
+    parser.add_argument("--headed", action="store_true", help="Show the browser window.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare with the results of an earlier run.")
+    parser.add_argument("--fail-above", type=float, default=None, metavar="PERCENT",
+                        help="Exit with status 1 if any benchmark is this much slower "
+                             "than the baseline.")
+    args = parser.parse_args()
+
+    fixture_dir = tempfile.mkdtemp(prefix="whatsapp-fixture-")
+    generate_fixture(fixture_dir)
+    server, url = serve_fixture(fixture_dir)
+
+    driver = scraper.create_driver(headless=not args.headed)
+    scrape_metrics.instrument_driver(driver)
+    page_waits.configure_waits(driver)
+    fixture_settings = {"latency": args.latency, "syncMs": args.sync_ms}
+    results = []
+
+    try:
+        for chats in args.chats:
+            for mode in args.sidebar_extraction:
+                results.append(bench_sidebar(driver, url, chats, mode))
+
+        for messages in args.messages:
+            for mode in args.extraction:
+                results.append(bench_chat(driver, url, messages, mode, fixture_settings))
+
+    finally:
+        driver.quit()
+        server.shutdown()
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    worst = print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if not all(r["correct"] for r in results):
+        print("\n[WARN] Some benchmarks did not return what the fixture generated!")
+        sys.exit(1)
+
+    if args.fail_above is not None and worst > args.fail_above:
+        print(f"\n[WARN] Slowest benchmark regressed by {worst:.1f}% "
+              f"(limit {args.fail_above:.1f}%).")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,562 @@
+"""
+fixture_generator.py
+
+Description: Generates a static page that mimics the parts of WhatsApp Web the scraper
+depends on, so the scraper can be benchmarked and regression-tested without an account:
+
+    - a "pane-side" virtualised chat list: rows positioned with translateY, a grid with
+      aria-rowcount, private and group chats with the markers is_private_chat looks for
+    - a search box with "Search results."
+    - a chat panel with a header, and N messages with replies, media icons, date rows
+      and data-pre-plain-text
+    - lazy loading of older messages when the chat is scrolled to the top, including the
+      "Syncing older messages", "Click here to get older messages" and end-of-history
+      banners
+    - optionally (storage=1), a "model-storage" IndexedDB database with the contact,
+      chat and message stores WhatsApp Web keeps its local history in, seeded with the
+      same messages; every unstoredEvery-th chat is left out of it
+
+Messages are generated in the page from a seed, so the file stays small however many
+messages are requested. Every setting can be overridden with the page's query string,
+e.g. index.html?chats=1000&messages=100000&latency=20.
+
+Usage:
+    python benchmarks/fixture_generator.py fixture/ --chats 50 --messages 1000
+"""
+
+import argparse
+import json
+import os
+
+
+DEFAULT_CONFIG = {
+    # Number of chats in the sidebar, and every how many chats one is a group
+    "chats": 50,
+    "groupEvery": 5,
+    # Messages per chat, rows rendered when a chat opens and rows added per load
+    "messages": 1000,
+    "initial": 100,
+    "batch": 100,
+    # Milliseconds before older rows are rendered once the top is reached
+    "latency": 50,
+    # Fractions of the history (counted from the newest message) at which loading stops
+    # for a sync banner or a "Click here" button; negative values disable them
+    "syncAt": 0.5,
+    "syncMs": 1000,
+    "clickAt": 0.75,
+    # Height of a sidebar row in px
+    "rowHeight": 72,
+    # 1 to seed the IndexedDB stand-in, and every how many chats one has no stored history
+    "storage": 0,
+    "unstoredEvery": 4,
+    "seed": 1,
+}
+
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>WhatsApp Web fixture</title>
+<style>
+html, body { margin: 0; height: 100%; font-family: sans-serif; font-size: 14px; }
+#app { display: flex; height: 100vh; }
+#side { width: 420px; display: flex; flex-direction: column; border-right: 1px solid #ccc; }
+#search { padding: 8px; }
+#search [contenteditable] { border: 1px solid #aaa; min-height: 20px; padding: 4px; }
+#pane-side { flex: 1; overflow-y: auto; position: relative; }
+#main { flex: 1; display: flex; flex-direction: column; }
+#main header { height: 50px; padding: 0 12px; display: flex; align-items: center;
+               border-bottom: 1px solid #ccc; }
+[role="row"] { padding: 6px 12px; }
+</style>
+</head>
+<body>
+<div id="app">
+  <div id="side">
+    <div id="search">
+      <div contenteditable="true" role="textbox" data-tab="3"></div>
+    </div>
+    <div id="pane-side"></div>
+  </div>
+  <div id="main-wrapper" style="flex: 1; display: flex;"></div>
+</div>
+<script>
+const DEFAULTS = __CONFIG__;
+
+const CONFIG = Object.assign({}, DEFAULTS);
+for (const [key, value] of new URLSearchParams(location.search)) {
+    if (key in CONFIG) {
+        CONFIG[key] = Number(value);
+    }
+}
+
+const CHAT_LIST_ROW_CLASS = "x10l6tqk xh8yej3 x1g42fcv";
+const CHAT_CONTAINER_CLASS = "x10l6tqk x13vifvy x17qophe xyw6214 x9f619 x78zum5 xdt5ytf "
+    + "xh8yej3 x5yr21d x6ikm8r x1rife3k xjbqb8w x1ewm37j";
+const MESSAGE_LIST_CLASS = "x3psx0u xwib8y2 xkhd6sd xrmvbpv";
+const BANNER_CLASS = "x78zum5 x6s0dn4 x1r0jzty x17zd0t2";
+const LOAD_BUTTON_CLASS = "x14m1o6m x126m2zf x1b9z3ur x9f619 x1rg5ohu x1okw0bk x193iq5w "
+    + "x123j3cw xn6708d x10b6aqq x1ye3gou x13a8xbf xdod15v x2b8uid x1lq5wgf xgqcy7u "
+    + "x30kzoy x9jhf4c";
+
+const WORDS = ["hey", "sure", "tomorrow", "lunch", "meeting", "ok", "see", "you", "later",
+    "thanks", "great", "idea", "running", "late", "call", "me", "when", "free", "weekend",
+    "plans", "sounds", "good", "haha", "really", "nice", "photo", "where", "are", "now"];
+
+function random(seed) {
+    // mulberry32
+    let t = seed >>> 0;
+    return function () {
+        t = (t + 0x6D2B79F5) >>> 0;
+        let r = Math.imul(t ^ (t >>> 15), 1 | t);
+        r ^= r + Math.imul(r ^ (r >>> 7), 61 | r);
+        return ((r ^ (r >>> 14)) >>> 0) / 4294967296;
+    };
+}
+
+function escapeHtml(text) {
+    return String(text).replace(/&/g, "&amp;").replace(/</g, "&lt;")
+        .replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
+function pad(number) {
+    return String(number).padStart(2, "0");
+}
+
+function isGroup(index) {
+    return CONFIG.groupEvery > 0 && index % CONFIG.groupEvery === 1;
+}
+
+function chatName(index) {
+    if (isGroup(index)) {
+        return "Group " + String(index).padStart(4, "0");
+    }
+    // Some names carry an emoji outside the BMP, which ChromeDriver cannot type
+    return "Contact " + String(index).padStart(4, "0") + (index % 9 === 3 ? " \\u{1F600}" : "");
+}
+
+const messageCache = new Map();
+
+function messagesFor(chat) {
+    if (messageCache.has(chat)) {
+        return messageCache.get(chat);
+    }
+    const next = random(CONFIG.seed * 100003 + chat);
+    const name = chatName(chat);
+    const rows = [];
+    // Local time, like WhatsApp Web shows it, so stored timestamps render the same text
+    let time = new Date(2024, 5, 1, 8, 0).getTime();
+    let lastDay = null;
+
+    for (let i = 0; i < CONFIG.messages; i++) {
+        time += Math.floor(next() * 240 + 1) * 60000;
+        const date = new Date(time);
+        const day = pad(date.getDate()) + "/" + pad(date.getMonth() + 1) + "/"
+            + date.getFullYear();
+        if (day !== lastDay) {
+            rows.push({kind: "date", text: day});
+            lastDay = day;
+        }
+        const words = [];
+        const length = 1 + Math.floor(next() * 8);
+        for (let w = 0; w < length; w++) {
+            words.push(WORDS[Math.floor(next() * WORDS.length)]);
+        }
+        const roll = next();
+        const fromMe = next() < 0.5;
+        rows.push({
+            kind: roll < 0.06 ? "image" : roll < 0.09 ? "video" : roll < 0.12 ? "sticker" : "text",
+            id: fromMe + "_" + chat + "@c.us_" + i.toString(16).toUpperCase(),
+            sender: fromMe ? "You" : name,
+            chatName: name,
+            timestamp: time,
+            time: pad(date.getHours()) + ":" + pad(date.getMinutes()),
+            day: day,
+            text: words.join(" "),
+            reply: i > 0 && next() < 0.15,
+            replyMedia: next() < 0.2,
+        });
+    }
+    messageCache.set(chat, rows);
+    return rows;
+}
+
+function rowHtml(row) {
+    if (row.kind === "date") {
+        return '<div tabindex="-1" role="row"><div><span dir="auto">' + row.text
+            + "</span></div></div>";
+    }
+    let html = '<div tabindex="-1" role="row"><div data-id="' + row.id + '">';
+    if (row.reply) {
+        html += '<div class="_ahy0"><span dir="auto" class="x1f6kntn _ao3e">'
+            + escapeHtml(row.sender === "You" ? row.chatName : "You") + "</span>"
+            + '<span dir="auto" class="quoted-mention _ao3e">' + escapeHtml(row.text.split(" ")[0])
+            + "</span>"
+            + (row.replyMedia ? '<span data-icon="status-image"></span>' : "") + "</div>";
+    }
+    if (row.kind === "text") {
+        html += '<div class="copyable-text" data-pre-plain-text="[' + row.time + ", " + row.day
+            + "] " + escapeHtml(row.sender) + ': ">'
+            + '<span class="_ao3e selectable-text copyable-text"><span>' + escapeHtml(row.text)
+            + "</span></span></div>";
+    } else {
+        if (row.kind === "image") {
+            html += '<div aria-label="Open picture" role="button"></div>';
+        } else if (row.kind === "video") {
+            html += '<span data-icon="msg-video"></span>';
+        } else {
+            html += '<div label="Sticker with no label"></div>';
+        }
+        html += '<div class="_amk6 _amlo"><span aria-label="' + escapeHtml(row.sender) + '"></span>'
+            + '<span class="x1rg5ohu x16dsc37" dir="auto">' + row.time + "</span></div>";
+    }
+    return html + "</div></div>";
+}
+
+// ---- Sidebar -------------------------------------------------------------------------
+
+const pane = document.getElementById("pane-side");
+const grid = document.createElement("div");
+grid.setAttribute("aria-label", "Chat list");
+grid.setAttribute("role", "grid");
+grid.setAttribute("aria-rowcount", String(CONFIG.chats));
+grid.style.position = "relative";
+grid.style.height = (CONFIG.chats * CONFIG.rowHeight) + "px";
+pane.appendChild(grid);
+
+const renderedChats = new Map();
+
+function chatRow(index) {
+    const row = document.createElement("div");
+    row.className = CHAT_LIST_ROW_CLASS;
+    row.setAttribute("role", "listitem");
+    row.setAttribute("style", "z-index: " + (CONFIG.chats - index) + "; height: "
+        + CONFIG.rowHeight + "px; position: absolute; left: 0; right: 0; transform: translateY("
+        + index * CONFIG.rowHeight + "px);");
+    const name = escapeHtml(chatName(index));
+    const text = escapeHtml(WORDS[index % WORDS.length] + " " + WORDS[(index * 7) % WORDS.length]);
+    let photo = '<span data-icon="default-user"></span>';
+    let preview = '<span title="' + text + '"><span dir="auto">' + text + "</span></span>";
+    if (isGroup(index)) {
+        if (index % (CONFIG.groupEvery * 5) === 1) {
+            photo = '<span data-icon="default-group"></span>';
+            preview = "";
+        } else {
+            preview = '<span title="Alice: ' + text + '"><span class="x1rg5ohu _ao3e">Alice</span>'
+                + ': <span dir="auto">' + text + "</span></span>";
+        }
+    }
+    row.innerHTML = '<div role="gridcell" data-chat="' + index + '" style="display: flex; '
+        + 'height: 100%; cursor: pointer; border-bottom: 1px solid #eee;">'
+        + '<div class="_ak8n" style="width: 48px;">' + photo + "</div>"
+        + '<div style="flex: 1;"><div><span dir="auto" title="' + name + '">' + name
+        + '</span><div class="_ak8i">' + (index < 10 ? "0" + index + ":30" : "01/06/2024")
+        + '</div></div><div class="_ak8k">' + preview + "</div></div></div>";
+    row.addEventListener("click", () => openChat(index));
+    return row;
+}
+
+function renderSidebar() {
+    const height = CONFIG.rowHeight;
+    const first = Math.max(0, Math.floor(pane.scrollTop / height) - 2);
+    const last = Math.min(CONFIG.chats - 1, Math.ceil((pane.scrollTop + pane.clientHeight) / height) + 2);
+    for (const [index, row] of renderedChats) {
+        if (index < first || index > last) {
+            row.remove();
+            renderedChats.delete(index);
+        }
+    }
+    let changed = false;
+    for (let index = first; index <= last; index++) {
+        if (!renderedChats.has(index)) {
+            renderedChats.set(index, chatRow(index));
+            changed = true;
+        }
+    }
+    if (changed) {
+        // Keep the rows in document order, like the real list
+        for (const index of [...renderedChats.keys()].sort((a, b) => a - b)) {
+            grid.appendChild(renderedChats.get(index));
+        }
+    }
+}
+
+pane.addEventListener("scroll", renderSidebar);
+renderSidebar();
+
+// ---- Search --------------------------------------------------------------------------
+
+const searchBox = document.querySelector('#search [contenteditable]');
+let results = null;
+
+function stripNonBmp(text) {
+    return Array.from(text).filter(c => c.codePointAt(0) <= 0xFFFF).join("");
+}
+
+function showResults() {
+    const query = searchBox.textContent.trim().toLowerCase();
+    if (results) {
+        results.remove();
+        results = null;
+    }
+    grid.style.display = query ? "none" : "";
+    if (!query) {
+        return;
+    }
+    results = document.createElement("div");
+    results.setAttribute("aria-label", "Search results.");
+    let html = "";
+    for (let index = 0; index < CONFIG.chats; index++) {
+        if (stripNonBmp(chatName(index)).toLowerCase().includes(query)) {
+            html += '<div class="' + CHAT_LIST_ROW_CLASS + '" role="listitem" data-chat="' + index
+                + '" style="height: ' + CONFIG.rowHeight + 'px; cursor: pointer;">'
+                + '<span dir="auto" title="' + escapeHtml(chatName(index)) + '">'
+                + escapeHtml(chatName(index)) + "</span></div>";
+        }
+    }
+    results.innerHTML = html;
+    results.addEventListener("click", event => {
+        const item = event.target.closest("[data-chat]");
+        if (item) {
+            searchBox.textContent = "";
+            showResults();
+            openChat(Number(item.dataset.chat));
+        }
+    });
+    pane.appendChild(results);
+}
+
+searchBox.addEventListener("input", showResults);
+searchBox.addEventListener("keydown", event => {
+    if (event.key === "Enter") {
+        event.preventDefault();
+        showResults();
+    }
+});
+
+// ---- Chat panel ----------------------------------------------------------------------
+
+let chat = null;
+
+function openChat(index) {
+    const rows = messagesFor(index);
+    const wrapper = document.getElementById("main-wrapper");
+    wrapper.innerHTML = '<div id="main"><header><span dir="auto" title="'
+        + escapeHtml(chatName(index)) + '">' + escapeHtml(chatName(index)) + "</span></header>"
+        + '<div style="flex: 1; position: relative;"><div class="' + CHAT_CONTAINER_CLASS
+        + '" tabindex="0" style="position: absolute; inset: 0; overflow-y: auto;">'
+        + '<div class="' + MESSAGE_LIST_CLASS + '"></div></div></div></div>';
+
+    const scroller = wrapper.querySelector('[tabindex="0"]');
+    chat = {
+        index: index,
+        rows: rows,
+        loadedFrom: Math.max(0, rows.length - CONFIG.initial),
+        scroller: scroller,
+        list: scroller.firstChild,
+        loading: false,
+        banner: null,
+        synced: CONFIG.syncAt < 0,
+        clicked: CONFIG.clickAt < 0,
+    };
+    chat.list.innerHTML = rows.slice(chat.loadedFrom).map(rowHtml).join("");
+    scroller.scrollTop = scroller.scrollHeight;
+    scroller.addEventListener("scroll", onChatScroll);
+    onChatScroll();
+}
+
+function setBanner(html) {
+    if (chat.banner) {
+        chat.banner.remove();
+        chat.banner = null;
+    }
+    if (html) {
+        chat.banner = document.createElement("div");
+        chat.banner.className = BANNER_CLASS;
+        chat.banner.innerHTML = html;
+        chat.scroller.insertBefore(chat.banner, chat.list);
+    }
+}
+
+function loadOlder() {
+    const current = chat;
+    current.loading = true;
+    setTimeout(() => {
+        if (chat !== current) {
+            return;
+        }
+        const start = Math.max(0, current.loadedFrom - CONFIG.batch);
+        const before = current.scroller.scrollHeight;
+        current.list.insertAdjacentHTML(
+            "afterbegin", current.rows.slice(start, current.loadedFrom).map(rowHtml).join("")
+        );
+        current.loadedFrom = start;
+        current.scroller.scrollTop += current.scroller.scrollHeight - before;
+        current.loading = false;
+        onChatScroll();
+    }, CONFIG.latency);
+}
+
+function onChatScroll() {
+    if (!chat || chat.loading || chat.banner || chat.scroller.scrollTop > 0) {
+        return;
+    }
+    if (chat.loadedFrom === 0) {
+        setBanner("Use WhatsApp on your phone to see older messages.");
+        return;
+    }
+    const loadedFraction = 1 - chat.loadedFrom / chat.rows.length;
+    if (!chat.synced && loadedFraction >= CONFIG.syncAt) {
+        chat.synced = true;
+        setBanner("Syncing older messages. Click to see progress.");
+        const current = chat;
+        setTimeout(() => {
+            if (chat === current) {
+                setBanner(null);
+                loadOlder();
+            }
+        }, CONFIG.syncMs);
+        return;
+    }
+    if (!chat.clicked && loadedFraction >= CONFIG.clickAt) {
+        chat.clicked = true;
+        setBanner('<button class="' + LOAD_BUTTON_CLASS + '">'
+            + "Click here to get older messages from your phone.</button>");
+        chat.banner.querySelector("button").addEventListener("click", () => {
+            setBanner(null);
+            loadOlder();
+        });
+        return;
+    }
+    loadOlder();
+}
+
+// ---- Local storage -------------------------------------------------------------------
+
+function isStored(index) {
+    return !isGroup(index) && !(CONFIG.unstoredEvery > 0
+        && index % CONFIG.unstoredEvery === CONFIG.unstoredEvery - 1);
+}
+
+function storedMessage(row, index, rowId) {
+    const chatId = index + "@c.us";
+    const fromMe = row.sender === "You";
+    const message = {
+        id: row.id,
+        rowId: rowId,
+        t: Math.floor(row.timestamp / 1000),
+        type: row.kind === "text" ? "chat" : row.kind,
+        from: fromMe ? "me@c.us" : chatId,
+        to: fromMe ? chatId : "me@c.us",
+    };
+    if (row.kind === "text") {
+        message.body = row.text;
+    }
+    if (row.reply) {
+        const quoted = row.text.split(" ")[0];
+        message.quotedMsg = row.replyMedia ? {type: "image", caption: quoted}
+                                           : {type: "chat", body: quoted};
+        message.quotedParticipant = fromMe ? chatId : "me@c.us";
+    }
+    return message;
+}
+
+function seedStorage() {
+    return new Promise((resolve, reject) => {
+        const deleted = indexedDB.deleteDatabase("model-storage");
+        deleted.onerror = () => reject(deleted.error);
+        deleted.onsuccess = () => {
+            const open = indexedDB.open("model-storage", 1);
+            open.onupgradeneeded = () => {
+                for (const store of ["contact", "chat", "message"]) {
+                    open.result.createObjectStore(store, {keyPath: "id"});
+                }
+            };
+            open.onerror = () => reject(open.error);
+            open.onsuccess = () => {
+                const db = open.result;
+                const tx = db.transaction(["contact", "chat", "message"], "readwrite");
+                tx.objectStore("contact").put({id: "me@c.us", isMe: true, pushname: "You"});
+                let rowId = 0;
+                for (let index = 0; index < CONFIG.chats; index++) {
+                    const chatId = index + (isGroup(index) ? "@g.us" : "@c.us");
+                    if (!isGroup(index)) {
+                        tx.objectStore("contact").put({id: chatId, name: chatName(index)});
+                    }
+                    tx.objectStore("chat").put({id: chatId, name: chatName(index)});
+                    if (!isStored(index)) {
+                        continue;
+                    }
+                    // Every chat opens with the encryption notice, so it is stored in full
+                    tx.objectStore("message").put({
+                        id: "false_" + chatId + "_E2E" + index, rowId: rowId++, t: 0,
+                        type: "e2e_notification",
+                    });
+                    for (const row of messagesFor(index)) {
+                        if (row.kind !== "date") {
+                            tx.objectStore("message").put(storedMessage(row, index, rowId++));
+                        }
+                    }
+                    // The DOM rows are not needed again unless the chat is opened
+                    messageCache.delete(index);
+                }
+                tx.oncomplete = () => { db.close(); resolve(); };
+                tx.onerror = () => reject(tx.error);
+            };
+        };
+    });
+}
+
+// ---- Expectations for the benchmark --------------------------------------------------
+
+window.fixture = {
+    config: CONFIG,
+    chatName: chatName,
+    privateChats: () => [...Array(CONFIG.chats).keys()].filter(i => !isGroup(i)).map(chatName),
+    rowCount: index => messagesFor(index).length,
+    messageCount: index => messagesFor(index).filter(row => row.kind !== "date").length,
+    isStored: index => CONFIG.storage > 0 && isStored(index),
+    storageReady: CONFIG.storage > 0 ? seedStorage() : Promise.resolve(),
+};
+</script>
+</body>
+</html>
+"""
+
+
+def generate_fixture(output_dir, **config):
+    """
+    Writes the fixture page.
+
+    Args:
+        output_dir (str): The directory to write index.html to.
+        **config: Overrides of DEFAULT_CONFIG baked into the page.
+
+    Returns:
+        str: The path of the page.
+    """
+    settings = dict(DEFAULT_CONFIG)
+    settings.update({key: value for key, value in config.items() if value is not None})
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, "index.html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(PAGE_TEMPLATE.replace("__CONFIG__", json.dumps(settings)))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a WhatsApp Web fixture page.")
+    parser.add_argument("output_dir", help="Directory to write index.html to.")
+    for key, value in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--{key}", type=type(value), default=None,
+                            help=f"(default: {value})")
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in DEFAULT_CONFIG}
+    print(generate_fixture(args.output_dir, **config))
+
+
+if __name__ == '__main__':
+    main()
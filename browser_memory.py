@@ -0,0 +1,238 @@
+"""
+browser_memory.py
+
+Description: Keeps Chrome's memory in check over long runs. WhatsApp Web holds on to
+the messages and DOM of every chat that was opened, so a browser that scrapes hundreds
+of chats keeps growing until it slows to a crawl or crashes. Between chats this module
+samples:
+    - the page's JS heap (performance.memory) and DOM node count
+    - the resident memory (RSS) of the Chrome processes, read from /proc on Linux
+
+and, when a MemoryPolicy says so (by default it never does), recycles the browser:
+WhatsApp Web is reopened in a fresh tab, or the whole driver is restarted on the
+persisted Chrome profile. Every sample is attached to the chat it followed in the run's
+metrics report.
+"""
+
+import os
+from dataclasses import dataclass
+
+import scrape_metrics
+
+
+# Reads the page's side of the memory use in one round trip. performance.memory is
+# Chrome-only and rounded unless Chrome runs with --enable-precise-memory-info.
+SAMPLE_PAGE_MEMORY_JS = """
+const memory = performance.memory;
+return {
+    js_heap_bytes: memory ? memory.usedJSHeapSize : null,
+    dom_nodes: document.getElementsByTagName("*").length,
+};
+"""
+
+RECYCLE_ACTIONS = ["tab", "driver"]
+
+
+def _child_pids():
+    """
+    Maps every running process to its children, from /proc/<pid>/stat.
+
+    Returns:
+        dict: {parent pid: [child pids]}, empty where /proc is not available.
+    """
+    children = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return children
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf-8") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The process name may contain spaces and parentheses; the ppid follows the last ")"
+        parent = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(parent, []).append(int(entry))
+
+    return children
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def browser_rss(driver):
+    """
+    Returns the summed resident memory of the Chrome processes the driver started: every
+    descendant of its chromedriver process. Memory shared between processes is counted
+    once per process, so this is an upper bound.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+
+    Returns:
+        int or None: The RSS in bytes, or None if it cannot be read (no /proc, or a
+                     driver without a local chromedriver process).
+    """
+    service = getattr(driver, "service", None)
+    process = getattr(service, "process", None)
+    if process is None or not os.path.isdir("/proc"):
+        return None
+
+    children = _child_pids()
+    pending = list(children.get(process.pid, []))
+    total = 0
+    while pending:
+        pid = pending.pop()
+        total += _rss_bytes(pid)
+        pending.extend(children.get(pid, []))
+    return total
+
+
+def sample_memory(driver):
+    """
+    Samples the browser's memory use.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+
+    Returns:
+        dict: {"js_heap_bytes", "dom_nodes", "rss_bytes"}; values that cannot be read
+              are None.
+    """
+    try:
+        sample = driver.execute_script(SAMPLE_PAGE_MEMORY_JS)
+    except Exception as e:
+        print(f"[WARN] Could not read the page's memory use: {e}")
+        sample = {"js_heap_bytes": None, "dom_nodes": None}
+
+    sample["rss_bytes"] = browser_rss(driver)
+    return sample
+
+
+@dataclass
+class MemoryPolicy:
+    """
+    When a browser is recycled between chats.
+
+    Attributes:
+        max_rss_mb (float): Recycle once Chrome's resident memory exceeds this many MB.
+        max_js_heap_mb (float): Recycle once the page's JS heap exceeds this many MB.
+        recycle_every (int): Recycle after this many chats, whatever the memory use.
+        action (str): "tab" to reopen WhatsApp Web in a fresh tab, "driver" to restart
+                      Chrome on its persisted profile.
+    """
+    max_rss_mb: float = None
+    max_js_heap_mb: float = None
+    recycle_every: int = None
+    action: str = "tab"
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            max_rss_mb=args.max_browser_memory,
+            max_js_heap_mb=args.max_js_heap,
+            recycle_every=args.recycle_every,
+            action=args.recycle,
+        )
+
+    def reason(self, sample, chats_since_recycle):
+        """
+        Returns why the browser should be recycled now, if it should.
+
+        Args:
+            sample (dict): The latest sample_memory result.
+            chats_since_recycle (int): Chats scraped since the browser was last recycled.
+
+        Returns:
+            str or None: A short reason, or None to keep the browser.
+        """
+        rss = sample.get("rss_bytes")
+        if self.max_rss_mb and rss is not None and rss > self.max_rss_mb * 2**20:
+            return f"Chrome uses {rss / 2**20:.0f} MB"
+
+        heap = sample.get("js_heap_bytes")
+        if self.max_js_heap_mb and heap is not None and heap > self.max_js_heap_mb * 2**20:
+            return f"the JS heap is {heap / 2**20:.0f} MB"
+
+        if self.recycle_every and chats_since_recycle >= self.recycle_every:
+            return f"{chats_since_recycle} chats were scraped"
+
+        return None
+
+
+class MemoryManager:
+    """
+    Samples one browser's memory after every chat and recycles it as its policy says.
+    Each browser of a parallel run has its own manager, used by its own thread.
+    """
+
+    def __init__(self, policy, reopen_tab, restart_driver=None, name="Chrome"):
+        """
+        Args:
+            policy (MemoryPolicy): When to recycle.
+            reopen_tab (callable): Takes the driver and reopens WhatsApp Web in a fresh tab.
+            restart_driver (callable): Takes the driver, quits it and returns a new
+                                       logged-in one, or None if that failed. Required
+                                       for the "driver" action.
+            name (str): How the browser is referred to in messages.
+        """
+        self.policy = policy
+        self.reopen_tab = reopen_tab
+        self.restart_driver = restart_driver
+        self.name = name
+        self.chats_since_recycle = 0
+
+    def after_chat(self, driver):
+        """
+        Samples the memory, records it on the chat just scraped on this thread and
+        recycles the browser if needed.
+
+        Args:
+            driver (WebDriver): The browser that scraped the chat.
+
+        Returns:
+            WebDriver: The browser to go on with: the same one, or its replacement.
+
+        Raises:
+            RuntimeError: If the driver was restarted and the new one is not logged in.
+        """
+        metrics = scrape_metrics.current
+        self.chats_since_recycle += 1
+
+        with metrics.phase("memory_sample"):
+            sample = sample_memory(driver)
+        chat = metrics.last_chat()
+        if chat is not None:
+            chat["memory"] = sample
+
+        reason = self.policy.reason(sample, self.chats_since_recycle)
+        if reason is None:
+            return driver
+
+        action = self.policy.action
+        print(f"Recycling the {action} of {self.name}: {reason}.")
+        with metrics.phase(f"recycle_{action}"):
+            if action == "driver":
+                driver = self.restart_driver(driver)
+                if driver is None:
+                    raise RuntimeError(f"{self.name} could not be restarted logged in.")
+            else:
+                self.reopen_tab(driver)
+
+        metrics.count_recycle(action)
+        if chat is not None:
+            chat["recycled"] = action
+        self.chats_since_recycle = 0
+        return driver
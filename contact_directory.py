@@ -0,0 +1,252 @@
+"""
+contact_directory.py
+
+Description: A directory of the sidebar's chats, kept between runs, so a run no longer
+has to walk and re-classify the whole chat list. For every chat title it remembers:
+    - whether the chat is private or a group
+    - the last activity shown in its row: the day and time of the last message and a
+      hash of its preview
+    - the row's position in the sidebar
+
+A row whose activity has not changed since the previous run keeps its classification
+without probing the row again; a row with new activity is classified afresh, so a
+misclassification lasts no longer than the last message it was read from. As the sidebar
+is sorted by activity, a scan can stop once it has reached a run of unchanged rows, and
+take every chat below them from the directory.
+
+The directory also remembers the activity each chat had when it was last scraped, so a
+run can skip the chats without new messages.
+"""
+
+import hashlib
+import json
+import os
+import re
+from datetime import date, timedelta
+
+
+DEFAULT_DIRECTORY_PATH = "contact_directory.json"
+
+# Number of consecutive unchanged rows after which the rest of the sidebar is taken
+# from the directory. More than the 3 chats WhatsApp lets you pin above the others.
+SETTLED_STREAK = 10
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def activity_day(shown, today):
+    """
+    Converts the time shown in a sidebar row into the day of the last message. The row
+    shows the time for today, "Yesterday", the weekday within the last week and the
+    date (DD/MM/YYYY) before that, so the same message is shown differently from day
+    to day.
+
+    Args:
+        shown (str or None): The text shown in the row.
+        today (date): The day of the run.
+
+    Returns:
+        tuple: (day, time): the day as YYYY-MM-DD, or the shown text if it cannot be
+               read, and the time (HH:MM) if the row shows one, else None.
+    """
+    shown = (shown or "").strip()
+    if not shown:
+        return None, None
+
+    if re.fullmatch(r"\d{1,2}:\d{2}(\s?[APap]\.?[Mm]\.?)?", shown):
+        return today.isoformat(), shown
+
+    if shown.lower() == "yesterday":
+        return (today - timedelta(days=1)).isoformat(), None
+
+    if shown.lower() in WEEKDAYS:
+        days_ago = (today.weekday() - WEEKDAYS.index(shown.lower())) % 7 or 7
+        return (today - timedelta(days=days_ago)).isoformat(), None
+
+    date_match = re.fullmatch(r"(\d{1,2})/(\d{1,2})/(\d{4})", shown)
+    if date_match:
+        day, month, year = (int(part) for part in date_match.groups())
+        try:
+            return date(year, month, day).isoformat(), None
+        except ValueError:
+            pass
+
+    return shown, None
+
+
+def make_activity(shown_time, preview, today):
+    """
+    Builds the activity of a sidebar row.
+
+    Args:
+        shown_time (str or None): The time of the last message shown in the row.
+        preview (str or None): The row's preview of the last message.
+        today (date): The day of the run.
+
+    Returns:
+        dict: {"day", "time", "preview"}, the preview as a short hash.
+    """
+    day, time_shown = activity_day(shown_time, today)
+    return {
+        "day": day,
+        "time": time_shown,
+        "preview": hashlib.sha1((preview or "").encode("utf-8")).hexdigest()[:16],
+    }
+
+
+def same_activity(previous, current):
+    """
+    Returns whether or not two activities show the same last message. Times are only
+    compared when both rows showed one, i.e. both were seen on the day of the message.
+
+    Args:
+        previous (dict or None): The remembered activity.
+        current (dict): The activity shown now.
+
+    Returns:
+        bool: True if nothing happened in the chat in between.
+    """
+    if previous is None or previous["day"] is None or current["day"] is None:
+        return False
+    if previous["day"] != current["day"] or previous["preview"] != current["preview"]:
+        return False
+    if previous["time"] is not None and current["time"] is not None:
+        return previous["time"] == current["time"]
+    return True
+
+
+class ContactDirectory:
+    """
+    The chats of the sidebar, persisted as JSON. Used by the single thread that scans the
+    sidebar and by the thread that writes the output.
+
+    Which chats changed is only known for the current run, so the directory is meant to
+    be loaded, scanned into, committed to and saved once per run.
+    """
+
+    def __init__(self, path=DEFAULT_DIRECTORY_PATH, today=None):
+        self.path = path
+        self.today = today or date.today()
+        self.entries = {}
+        self.changed = set()
+        self._seen = set()
+        self._offset = 0
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def observe(self, title, shown_time, preview, position, classify):
+        """
+        Records a sidebar row and returns its classification, reusing the remembered
+        one if the row shows no new activity.
+
+        Args:
+            title (str): The chat's title.
+            shown_time (str or None): The time of the last message shown in the row.
+            preview (str or None): The row's preview of the last message.
+            position (int): The translateY of the row in px.
+            classify (callable): Returns True if the row is a private chat. Only called
+                                 for new and changed rows.
+
+        Returns:
+            bool: True if the chat is private.
+        """
+        activity = make_activity(shown_time, preview, self.today)
+        entry = self.entries.get(title)
+        first_sighting = title not in self._seen
+        self._seen.add(title)
+
+        if entry is not None and same_activity(entry["activity"], activity):
+            private = entry["private"]
+            if first_sighting:
+                # Every chat below this one has moved by as much, see end_scan()
+                self._offset = position - entry["position"]
+        else:
+            private = classify()
+            self.changed.add(title)
+            entry = self.entries.setdefault(title, {"scraped": None})
+
+        entry.update(private=private, activity=activity, position=position)
+        return private
+
+    def settled(self, titles):
+        """
+        Returns whether or not a scan can stop, as the last rows it read all show no
+        new activity. Chats are sorted by activity, so no chat below them has any.
+
+        Args:
+            titles (list): The titles of the rows read so far, in sidebar order.
+
+        Returns:
+            bool: True if the last SETTLED_STREAK rows are unchanged.
+        """
+        tail = titles[-SETTLED_STREAK:]
+        return (len(tail) == SETTLED_STREAK
+                and all(title in self.entries and title not in self.changed
+                        for title in tail))
+
+    def end_scan(self, complete):
+        """
+        Finishes a scan of the sidebar.
+
+        Args:
+            complete (bool): True if the whole sidebar was read, in which case the chats
+                             that are no longer in it are forgotten. Otherwise the scan
+                             stopped at settled rows.
+
+        Returns:
+            list: (title, position) of every private chat in the directory that was not
+                  read, at its remembered position moved by as much as the last
+                  unchanged row had moved. Empty after a complete scan.
+        """
+        if complete:
+            for title in set(self.entries) - self._seen:
+                del self.entries[title]
+            return []
+
+        unread = []
+        for title, entry in self.entries.items():
+            if title in self._seen:
+                continue
+            entry["position"] += self._offset
+            if entry["private"]:
+                unread.append((title, entry["position"]))
+        return sorted(unread, key=lambda chat: chat[1])
+
+    def has_new_activity(self, title):
+        """
+        Returns whether or not a chat shows activity it did not have when it was last
+        scraped.
+
+        Args:
+            title (str): The chat's title.
+
+        Returns:
+            bool: True if the chat was never scraped or changed since.
+        """
+        entry = self.entries.get(title)
+        return entry is None or not same_activity(entry["scraped"], entry["activity"])
+
+    def commit(self, title):
+        """
+        Remembers that a chat was scraped with the activity it showed in this run's
+        scan. Only call this once its messages were written.
+
+        Args:
+            title (str): The chat's title.
+        """
+        entry = self.entries.get(title)
+        if entry is not None:
+            entry["scraped"] = entry["activity"]
+
+    def save(self):
+        """
+        Writes the directory atomically, so a crash never leaves a truncated file.
+        """
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,305 @@
+"""
+html_snapshot_parser.py
+
+Description: Parses WhatsApp Web HTML offline with lxml instead of live Selenium queries.
+The scraper uses it as its "html" backend: it grabs the outerHTML of the message list or
+the sidebar once and parses it in-process. It also works from the command line on saved
+.html snapshots, so archived chats can be re-parsed in bulk without a browser.
+
+The same XPath selectors as the Selenium code path are used (see whatsapp_selectors.py),
+and each message is returned in the scraper's 8-field format.
+
+Usage:
+    python html_snapshot_parser.py messages snapshots/ -o whatsapp_messages.json
+    python html_snapshot_parser.py sidebar sidebar.html
+
+Dependencies:
+    - lxml
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+
+from lxml import html as lxml_html
+
+import whatsapp_selectors as sel
+
+
+def _first(node, xpath):
+    """
+    Returns the first node matching the XPath expression, or None if there is none.
+
+    Args:
+        node (lxml.html.HtmlElement): The node the expression is evaluated from.
+        xpath (str): The XPath expression.
+
+    Returns:
+        lxml.html.HtmlElement or None: The first matching node.
+    """
+    matches = node.xpath(xpath)
+    return matches[0] if matches else None
+
+
+def element_text(node):
+    """
+    Returns the text of an element normalised the way WebElement.text reports it:
+    line breaks for <br>, non-breaking spaces as spaces, and each line trimmed.
+
+    Args:
+        node (lxml.html.HtmlElement): The element to read.
+
+    Returns:
+        str: The normalised text.
+    """
+    parts = []
+    for piece in node.xpath('.//text() | .//br'):
+        parts.append("\n" if not isinstance(piece, str) else str(piece))
+
+    lines = "".join(parts).replace("\u00a0", " ").split("\n")
+    return "\n".join(re.sub(r'[ \t]+', ' ', line).strip() for line in lines).strip()
+
+
+def parse_message_row(message_div):
+    """
+    Extracts the fields of a single message row from parsed HTML.
+
+    Args:
+        message_div (lxml.html.HtmlElement): The element with role="row" that holds one message.
+
+    Returns:
+        list: [reply_sender, reply_message, reply_media,
+               message_information, messages_text, image, sticker, video]
+    """
+    reply_sender = None
+    reply_message = None
+    reply_media = False
+    message_information = None
+    image = False
+    sticker = False
+    video = False
+    messages_text = None
+
+    # Handle replies
+    reply_div = _first(message_div, sel.REPLY_DIV_XPATH)
+    if reply_div is not None:
+        reply_sender_span = _first(reply_div, sel.REPLY_SENDER_XPATH)
+        if reply_sender_span is not None:
+            reply_sender = element_text(reply_sender_span)
+
+        reply_text_span = _first(reply_div, sel.REPLY_TEXT_XPATH)
+        if reply_text_span is not None:
+            reply_message = element_text(reply_text_span)
+
+        if (_first(reply_div, sel.REPLY_IMAGE_XPATH) is not None
+                or _first(reply_div, sel.REPLY_VIDEO_XPATH) is not None):
+            reply_media = True
+
+    # Handle messages with text
+    message_information_div = _first(message_div, sel.COPYABLE_TEXT_XPATH)
+    if message_information_div is not None:
+        message_information = message_information_div.get("data-pre-plain-text")
+
+        text_span = _first(message_div, sel.MESSAGE_TEXT_XPATH)
+        if text_span is not None:
+            messages_text = element_text(text_span)
+
+    else:
+        # Handle media with no text
+        message_information_div = _first(message_div, sel.MEDIA_INFO_XPATH)
+        if message_information_div is not None:
+            name_of_sender_span = _first(message_information_div, sel.MEDIA_SENDER_XPATH)
+            name_of_sender = None
+            if name_of_sender_span is not None:
+                name_of_sender = name_of_sender_span.get("aria-label")
+
+            time_of_message_div = _first(message_information_div, sel.MEDIA_TIME_XPATH)
+            if time_of_message_div is not None:
+                time_of_message = element_text(time_of_message_div)
+            else:
+                time_of_message = "Unknown time"
+
+            message_information = f"[{time_of_message}, None] {name_of_sender}:"
+
+    # Determine media types
+    if _first(message_div, sel.MEDIA_DOWNLOAD_XPATH) is not None:
+        if _first(message_div, sel.OPEN_PICTURE_XPATH) is not None:
+            image = True
+        else:
+            sticker = True
+
+    elif _first(message_div, sel.OPEN_PICTURE_XPATH) is not None:
+        image = True
+
+    elif _first(message_div, sel.STICKER_XPATH) is not None:
+        sticker = True
+
+    elif _first(message_div, sel.VIDEO_XPATH) is not None:
+        video = True
+
+    return [reply_sender, reply_message,
+            reply_media, message_information,
+            messages_text, image, sticker, video]
+
+
+def parse_messages_html(html):
+    """
+    Parses every message row in a chat snapshot.
+
+    The snapshot can be a whole saved page or just the outerHTML of the message list.
+
+    Args:
+        html (str): The HTML to parse.
+
+    Returns:
+        list: The parsed messages, one 8-field list per row.
+    """
+    root = lxml_html.fromstring(html)
+    container = _first(root, sel.MESSAGE_LIST_XPATH)
+    if container is None:
+        container = root
+
+    return [parse_message_row(row) for row in container.xpath(sel.MESSAGE_ROW_XPATH)]
+
+
+def is_private_chat(chat_name_div):
+    """
+    Returns wether or not a sidebar row from parsed HTML is a private or group chat.
+    Mirrors is_private_chat in whatsapp_message_scraper.py.
+
+    Args:
+        chat_name_div (lxml.html.HtmlElement): The sidebar row of the chat.
+
+    Returns:
+        bool: True if the chat is a private chat, False otherwise.
+    """
+    veiwable_msg_span = _first(chat_name_div, sel.CHAT_PREVIEW_XPATH)
+    profile_photo = _first(chat_name_div, sel.PROFILE_PHOTO_XPATH)
+
+    if veiwable_msg_span is None:
+        return True
+
+    preview_text_span = _first(veiwable_msg_span, sel.PREVIEW_TEXT_XPATH)
+    if preview_text_span is not None:
+        if not element_text(preview_text_span):
+            return True
+        if _first(veiwable_msg_span, sel.PREVIEW_AUTHOR_XPATH) is not None:
+            # this is the element <You> or <+27 724 ...> before the message
+            return False
+        return True
+
+    if profile_photo is not None and _first(profile_photo, sel.DEFAULT_GROUP_ICON_XPATH) is not None:
+        return False
+
+    for xpath in sel.GROUP_PREVIEW_XPATHS:
+        if _first(veiwable_msg_span, xpath) is not None:
+            return False
+
+    return True
+
+
+def _row_text(chat_name_div, xpath):
+    node = _first(chat_name_div, xpath)
+    return element_text(node) if node is not None else None
+
+
+def parse_sidebar_html(html, directory=None):
+    """
+    Parses the rows of a sidebar (chat list) snapshot.
+
+    Args:
+        html (str): The HTML to parse, e.g. the outerHTML of the "pane-side" element.
+        directory (ContactDirectory): If given, rows without new activity keep the
+                                      classification remembered in it, and every row
+                                      is recorded in it.
+
+    Returns:
+        list: One (translateY in px, chat name, is private) tuple per row, in document order.
+              Rows without a translateY position are skipped.
+    """
+    root = lxml_html.fromstring(html)
+    rows = []
+
+    for chat_name_div in root.xpath(sel.SIDEBAR_ROW_XPATH):
+        string_match = re.search(r'translateY\((\d+)px\)', chat_name_div.get("style") or "")
+        if not string_match:
+            continue
+
+        name_span = _first(chat_name_div, sel.CHAT_TITLE_XPATH)
+        chat_name = name_span.get("title") if name_span is not None else None
+        position = int(string_match.group(1))
+        if directory is not None and chat_name:
+            private = directory.observe(
+                chat_name, _row_text(chat_name_div, sel.PREVIEW_TIME_XPATH),
+                _row_text(chat_name_div, sel.CHAT_PREVIEW_XPATH), position,
+                lambda: is_private_chat(chat_name_div)
+            )
+        else:
+            private = is_private_chat(chat_name_div)
+        rows.append((position, chat_name, private))
+
+    return rows
+
+
+def _expand_paths(paths):
+    """
+    Expands directories and glob patterns into a sorted list of .html files.
+
+    Args:
+        paths (list): File names, directories or glob patterns.
+
+    Returns:
+        list: The matching file names.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.html"))))
+        else:
+            files.extend(sorted(glob.glob(path)) or [path])
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse saved WhatsApp Web HTML snapshots.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    messages_parser = subparsers.add_parser(
+        "messages", help="Parse chat snapshots into the scraper's nested message list."
+    )
+    messages_parser.add_argument("paths", nargs="+", help="Snapshot files, directories or globs.")
+    messages_parser.add_argument("-o", "--output", default="whatsapp_messages.json",
+                                 help="Where to write the nested message list.")
+
+    sidebar_parser = subparsers.add_parser(
+        "sidebar", help="List the private chats found in sidebar snapshots."
+    )
+    sidebar_parser.add_argument("paths", nargs="+", help="Snapshot files, directories or globs.")
+
+    args = parser.parse_args()
+
+    if args.command == "messages":
+        messages = []
+        for path in _expand_paths(args.paths):
+            with open(path, encoding="utf-8") as f:
+                chat_messages = parse_messages_html(f.read())
+            print(f"{path}: {len(chat_messages)} messages")
+            messages.append(chat_messages)
+
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(messages, f, indent=2, ensure_ascii=False)
+
+    else:
+        names = set()
+        for path in _expand_paths(args.paths):
+            with open(path, encoding="utf-8") as f:
+                names.update(name for _, name, private in parse_sidebar_html(f.read())
+                             if private and name)
+        for name in sorted(names):
+            print(name)
+
+
+if __name__ == '__main__':
+    main()
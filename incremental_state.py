@@ -0,0 +1,138 @@
+"""
+incremental_state.py
+
+Description: Keeps a high-water mark per contact between runs so nightly re-scrapes only
+scroll back until the last archived message and only extract what came after it.
+
+A mark identifies the newest message extracted in the previous run by its data-id and,
+for rows without one, by its data-pre-plain-text plus a hash of its text.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+
+def text_hash(text):
+    """
+    Returns a short, stable hash of a message's text.
+
+    Args:
+        text (str or None): The message text.
+
+    Returns:
+        str: The first 16 hex digits of the SHA-1 of the text.
+    """
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+def make_mark(message_ids, messages):
+    """
+    Builds the high-water mark for a chat from its newest identifiable message.
+
+    Args:
+        message_ids (list): The data-id of each message row (None when a row has none).
+        messages (list): The parsed 8-field messages, in the same order as message_ids.
+
+    Returns:
+        dict or None: {"data_id", "message_information", "text_hash"}, or None if no row
+                      can be identified.
+    """
+    for message_id, message in zip(reversed(message_ids), reversed(messages)):
+        if message_id is None and message[3] is None:
+            continue
+        return {
+            "data_id": message_id,
+            "message_information": message[3],
+            "text_hash": text_hash(message[4]),
+        }
+    return None
+
+
+def matches_mark(mark, message_id, message_information, text):
+    """
+    Returns whether or not a message is the one a high-water mark points at.
+
+    Args:
+        mark (dict): The high-water mark.
+        message_id (str or None): The data-id of the message row.
+        message_information (str or None): Its data-pre-plain-text.
+        text (str or None): Its text.
+
+    Returns:
+        bool: True if the message is the marked one.
+    """
+    if mark.get("data_id") is not None and message_id is not None:
+        return message_id == mark["data_id"]
+
+    return (message_information is not None
+            and message_information == mark.get("message_information")
+            and text_hash(text) == mark.get("text_hash"))
+
+
+def find_mark_index(mark, message_ids, messages):
+    """
+    Finds the position of the marked message among the extracted messages.
+
+    Args:
+        mark (dict): The high-water mark.
+        message_ids (list): The data-id of each message row.
+        messages (list): The parsed 8-field messages, in the same order as message_ids.
+
+    Returns:
+        int: The index of the marked message, or -1 if it is not among them.
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        if matches_mark(mark, message_ids[index], messages[index][3], messages[index][4]):
+            return index
+    return -1
+
+
+class IncrementalState:
+    """
+    The per-contact high-water marks, persisted as JSON. Safe to share between the
+    worker threads of a parallel run.
+
+    New marks are staged with update() and only become part of the saved state once the
+    caller has written the chat's messages and calls commit(), so a crash can never save
+    a mark for messages that did not reach the output.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.marks = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.marks = json.load(f)
+
+    def get(self, contact):
+        with self._lock:
+            return self.marks.get(contact)
+
+    def update(self, contact, mark):
+        if mark is not None:
+            with self._lock:
+                self._pending[contact] = mark
+
+    def commit(self, contact):
+        with self._lock:
+            if contact in self._pending:
+                self.marks[contact] = self._pending.pop(contact)
+
+    def save(self):
+        """
+        Writes the marks atomically, so a crash never leaves a truncated state file.
+        """
+        with self._lock:
+            marks = dict(self.marks)
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(marks, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,362 @@
+"""
+media_pipeline.py
+
+Description: Saves the images, stickers and videos of the scraped chats, which the
+extractors otherwise only flag. While a chat is open, the media of its rows are fetched
+from their blob: URLs inside the page and hashed there with SHA-256, a slice of bounded
+size at a time. Only the files of a slice that are not saved yet are moved over the
+WebDriver connection before the next slice is fetched, and a bounded pool of threads
+decodes and writes them, so disk writes never hold up the scraping of the next chat.
+
+Files are content-addressed, MEDIA_DIR/<first two hex digits>/<sha256>.<extension>, so
+media forwarded between chats is stored once. Every message with media gets the
+file's path relative to MEDIA_DIR (MessageRecord.media, the "media" field of the
+records output), and MEDIA_DIR/manifest.jsonl maps every such message to its file:
+    {"chat", "message_id", "information", "sha256", "path", "type", "size"}
+A file that could not be written gets entries with an "error" instead, and is fetched
+again for the next message that shows it. The entries of further copies of a file that is
+being written are only added once it is.
+
+Media WhatsApp Web has not downloaded (the download icon is shown) are not fetched, and a
+video is saved as its preview image unless the video itself was loaded.
+"""
+
+import base64
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from selenium.webdriver.common.by import By
+
+import whatsapp_selectors as sel
+
+
+MEDIA_MANIFEST_NAME = "manifest.jsonl"
+
+DEFAULT_MEDIA_WORKERS = 4
+
+# Bytes of media fetched in the page and then moved from it per slice of a chat's rows
+MEDIA_TRANSFER_BATCH_BYTES = 8 * 2**20
+
+MEDIA_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "video/mp4": "mp4",
+    "video/webm": "webm",
+}
+
+MEDIA_SCRIPT_SELECTORS = {
+    "row": sel.MESSAGE_ROW_XPATH,
+    "reply": sel.REPLY_DIV_XPATH,
+    "media": sel.MEDIA_BLOB_XPATH,
+}
+
+# Fetches and hashes the media of the rows at the indexes arguments[2] of the message list
+# arguments[0], one row at a time, and stops after the row that brings the fetched bytes to
+# arguments[3]. The bytes stay in the page until COLLECT_MEDIA_JS collects them. Resolves
+# one {sha256, type, size} per row it got to, {error} if the fetch failed or null if the
+# row has no loaded media. Quoted media in the reply block are not the message's own.
+HASH_MEDIA_JS = """
+const list = arguments[0], xp = arguments[1], indexes = arguments[2], budget = arguments[3];
+const done = arguments[arguments.length - 1];
+const store = window.__scrapedMedia = window.__scrapedMedia || new Map();
+
+function nodes(node, xpath) {
+    const snapshot = document.evaluate(
+        xpath, node, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    const found = [];
+    for (let i = 0; i < snapshot.snapshotLength; i++) {
+        found.push(snapshot.snapshotItem(i));
+    }
+    return found;
+}
+
+function hex(buffer) {
+    return Array.from(new Uint8Array(buffer), b => b.toString(16).padStart(2, "0")).join("");
+}
+
+const rows = nodes(list, xp.row);
+
+async function hashRow(index) {
+    const row = rows[index];
+    if (!row) {
+        return null;
+    }
+    const reply = nodes(row, xp.reply)[0];
+    const media = nodes(row, xp.media).filter(node => !reply || !reply.contains(node));
+    if (!media.length) {
+        return null;
+    }
+    try {
+        const blob = await (await fetch(media[media.length - 1].src)).blob();
+        const buffer = await blob.arrayBuffer();
+        const sha256 = hex(await crypto.subtle.digest("SHA-256", buffer));
+        store.set(sha256, buffer);
+        return {sha256: sha256, type: blob.type, size: buffer.byteLength};
+    } catch (e) {
+        return {error: String(e)};
+    }
+}
+
+(async () => {
+    const hashed = [];
+    let fetched = 0;
+    for (const index of indexes) {
+        const media = await hashRow(index);
+        hashed.push(media);
+        if (media && media.size) {
+            fetched += media.size;
+            if (fetched >= budget) {
+                break;
+            }
+        }
+    }
+    return hashed;
+})().then(done);
+"""
+
+# Returns the base64 of the fetched media with the hashes arguments[0], and drops them from
+# the page.
+COLLECT_MEDIA_JS = """
+const store = window.__scrapedMedia || new Map();
+const collected = {};
+for (const sha256 of arguments[0]) {
+    const bytes = new Uint8Array(store.get(sha256) || new ArrayBuffer(0));
+    let binary = "";
+    for (let i = 0; i < bytes.length; i += 0x8000) {
+        binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+    }
+    collected[sha256] = btoa(binary);
+    store.delete(sha256);
+}
+return collected;
+"""
+
+# Drops every fetched file still held by the page, e.g. the duplicates not collected
+RELEASE_MEDIA_JS = "window.__scrapedMedia = new Map();"
+
+
+def media_path(sha256, mime_type):
+    """
+    Returns where a file is stored, relative to the media directory.
+
+    Args:
+        sha256 (str): The hex SHA-256 of its content.
+        mime_type (str): Its MIME type, as reported by the page.
+
+    Returns:
+        str: <first two hex digits>/<sha256>.<extension>
+    """
+    extension = MEDIA_EXTENSIONS.get((mime_type or "").split(";")[0], "bin")
+    return f"{sha256[:2]}/{sha256}.{extension}"
+
+
+class MediaPipeline:
+    """
+    Fetches the media of the open chat and saves them in a content-addressed directory.
+    fetch_chat() is safe to call from the worker threads of a parallel run, each with its
+    own browser; the files are written by a shared pool of threads.
+    """
+
+    def __init__(self, directory, workers=DEFAULT_MEDIA_WORKERS):
+        """
+        Args:
+            directory (str): Where the files and the manifest are written.
+            workers (int): The number of threads writing files. At most four files per
+                           thread wait to be written; further fetches wait for them.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="media")
+        self._pending = threading.BoundedSemaphore(workers * 4)
+        self._lock = threading.Lock()
+        self._known = set()
+        # The manifest entries of further copies of each file being written
+        self._saving = {}
+        self._manifest = open(os.path.join(directory, MEDIA_MANIFEST_NAME), "a",
+                              encoding="utf-8")
+        self.saved = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    def _is_new(self, sha256, path):
+        with self._lock:
+            if sha256 in self._known:
+                return False
+            self._known.add(sha256)
+            if os.path.exists(os.path.join(self.directory, path)):
+                return False
+            self._saving[sha256] = []
+            return True
+
+    def _record_copy(self, entry):
+        """
+        Records a message whose file is already saved, or else is being saved, in which
+        case its manifest entry waits for the outcome.
+        """
+        with self._lock:
+            copies = self._saving.get(entry["sha256"])
+            if copies is not None:
+                copies.append(entry)
+                return
+        self._write_manifest(entry)
+
+    def _finish(self, sha256, error=None):
+        """
+        Writes the waiting manifest entries of a file's copies once it was saved, or with
+        the error if it was not. A file that was not saved is fetched again next time.
+        """
+        with self._lock:
+            copies = self._saving.pop(sha256, [])
+            if error is not None:
+                self._known.discard(sha256)
+        for entry in copies:
+            self._write_manifest(entry if error is None else {**entry, "error": error})
+
+    def _write_manifest(self, entry):
+        with self._lock:
+            self._manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._manifest.flush()
+
+    def _save(self, encoded, entry):
+        """
+        Writes one file atomically and records it in the manifest. Runs on the pool.
+        """
+        try:
+            path = os.path.join(self.directory, entry["path"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "wb") as f:
+                f.write(base64.b64decode(encoded))
+            os.replace(temporary_path, path)
+            self._write_manifest(entry)
+            with self._lock:
+                self.saved += 1
+            self._finish(entry["sha256"])
+        except Exception as e:
+            print(f"[WARN] Could not save the media of '{entry['chat']}': {e}")
+            # The messages already point at the path, so the failure is recorded, and the
+            # next message with the same file fetches it again instead of skipping it
+            with self._lock:
+                self.failed += 1
+            self._write_manifest({**entry, "error": str(e)})
+            self._finish(entry["sha256"], str(e))
+        finally:
+            self._pending.release()
+
+    def fetch_chat(self, driver, contact, messages, message_ids, first_row=0):
+        """
+        Fetches the media of the open chat's messages and queues the new files for
+        writing. Returns once their bytes have left the page, not once they are written.
+
+        Args:
+            driver (WebDriver): The browser with the chat open.
+            contact (str): The name of the chat.
+            messages (list): The chat's 8-field messages.
+            message_ids (list): The data-id of each message.
+            first_row (int): The message list row of the first message, when the earlier
+                             rows were left out (incremental runs).
+
+        Returns:
+            list: Per message, the path of its file relative to the media directory, or
+                  None if it has no media or they could not be fetched.
+        """
+        references = [None] * len(messages)
+        indexes = [index for index, message in enumerate(messages) if any(message[5:8])]
+        if not indexes:
+            return references
+
+        message_list = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+        position = 0
+        while position < len(indexes):
+            # One byte-budgeted slice per round trip, collected before the next one is
+            # fetched, so the page holds about one batch of files at a time
+            fetched = driver.execute_async_script(
+                HASH_MEDIA_JS, message_list, MEDIA_SCRIPT_SELECTORS,
+                [first_row + index for index in indexes[position:]],
+                MEDIA_TRANSFER_BATCH_BYTES
+            )
+            if not fetched:
+                break
+            hashed = indexes[position:position + len(fetched)]
+            position += len(fetched)
+
+            batch = []
+            for index, media in zip(hashed, fetched):
+                if media is None:
+                    continue
+                if "error" in media:
+                    print(f"[WARN] Could not fetch a media file of '{contact}': "
+                          f"{media['error']}")
+                    with self._lock:
+                        self.failed += 1
+                    continue
+
+                entry = {
+                    "chat": contact,
+                    "message_id": message_ids[index] if message_ids else None,
+                    "information": messages[index][3],
+                    "sha256": media["sha256"],
+                    "path": media_path(media["sha256"], media["type"]),
+                    "type": media["type"],
+                    "size": media["size"],
+                }
+                references[index] = entry["path"]
+
+                if not self._is_new(entry["sha256"], entry["path"]):
+                    self._record_copy(entry)
+                    with self._lock:
+                        self.duplicates += 1
+                    continue
+                batch.append(entry)
+
+            self._collect(driver, batch)
+
+        return references
+
+    def _collect(self, driver, batch):
+        """
+        Moves the fetched files of one slice out of the page and queues them for writing,
+        then drops everything else the page still holds, e.g. the duplicates.
+
+        Args:
+            driver (WebDriver): The browser with the chat open.
+            batch (list): The manifest entries of the new files.
+        """
+        queued = 0
+        try:
+            if batch:
+                collected = driver.execute_script(
+                    COLLECT_MEDIA_JS, [entry["sha256"] for entry in batch]
+                )
+                for entry in batch:
+                    # Waits while the pool is behind, so memory stays bounded
+                    self._pending.acquire()
+                    self._pool.submit(self._save, collected[entry["sha256"]], entry)
+                    queued += 1
+            driver.execute_script(RELEASE_MEDIA_JS)
+        except Exception:
+            # Let a later chat fetch the files that never left the page
+            for entry in batch[queued:]:
+                self._finish(entry["sha256"], "not fetched from the page")
+            raise
+
+    def close(self):
+        """
+        Waits for the queued files to be written and closes the manifest.
+        """
+        self._pool.shutdown(wait=True)
+        self._manifest.close()
+        print(f"Saved {self.saved} media files to {self.directory} ({self.duplicates} "
+              f"already saved, {self.failed} failed).")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
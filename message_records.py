@@ -0,0 +1,236 @@
+"""
+message_records.py
+
+Description: A compact, typed form of a scraped message. The extractors produce the
+original 8-field list
+
+    [reply_sender, reply_message, reply_media, message_information, messages_text,
+     image, sticker, video]
+
+in which the time and the sender are buried in the data-pre-plain-text string
+("[HH:MM, DD/MM/YYYY] Name: ") or in its media form ("[HH:MM, None] Name:"). A
+MessageRecord holds them pre-parsed instead: a timestamp in seconds, interned sender
+ids and the booleans packed into one int. The original list, and so the JSON output,
+can always be rebuilt exactly with to_list().
+
+Timestamps are the wall-clock time shown by WhatsApp Web, counted as if it were UTC, so
+they convert back to the same text on any machine.
+"""
+
+import calendar
+import re
+import threading
+import time
+
+
+FLAG_REPLY_MEDIA = 1
+FLAG_IMAGE = 2
+FLAG_STICKER = 4
+FLAG_VIDEO = 8
+# The information came in the "[HH:MM, None] Name:" form of media without text
+FLAG_MEDIA_INFORMATION = 16
+# The message showed no date; it was taken from the previous dated message
+FLAG_DATE_INFERRED = 32
+
+_INFORMATION_RE = re.compile(
+    r'^\[(\d{1,2}):(\d{2}), (\d{1,2})/(\d{1,2})/(\d{4})\] (.*): $', re.S
+)
+_MEDIA_INFORMATION_RE = re.compile(r'^\[(\d{1,2}):(\d{2}), None\] (.*):$', re.S)
+
+
+class SenderTable:
+    """
+    Interns sender names: every name is stored once and messages refer to it by id.
+    Safe to share between the worker threads of a parallel run.
+    """
+
+    def __init__(self):
+        self.names = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def intern(self, name):
+        """
+        Returns the id of a name, adding the name if it is new.
+
+        Args:
+            name (str or None): The sender name.
+
+        Returns:
+            int or None: Its id, or None for None.
+        """
+        if name is None:
+            return None
+        with self._lock:
+            sender_id = self._ids.get(name)
+            if sender_id is None:
+                sender_id = len(self.names)
+                self.names.append(name)
+                self._ids[name] = sender_id
+            return sender_id
+
+    def name(self, sender_id):
+        return None if sender_id is None else self.names[sender_id]
+
+
+class MessageRecord:
+    """
+    One message. Reply context, media type and the form of the original information
+    string are bits of flags (see the FLAG_* constants).
+    """
+
+    __slots__ = ("timestamp", "sender_id", "flags", "text",
+                 "reply_sender_id", "reply_text", "raw_information", "media", "message_id")
+
+    def __init__(self, timestamp=None, sender_id=None, flags=0, text=None,
+                 reply_sender_id=None, reply_text=None, raw_information=None, media=None,
+                 message_id=None):
+        self.timestamp = timestamp
+        self.sender_id = sender_id
+        self.flags = flags
+        self.text = text
+        self.reply_sender_id = reply_sender_id
+        self.reply_text = reply_text
+        # Only kept when the information string cannot be rebuilt from the fields above
+        self.raw_information = raw_information
+        # The saved media file, relative to the media directory (see media_pipeline.py)
+        self.media = media
+        # The data-id of the row WhatsApp Web rendered the message as, if it was read
+        self.message_id = message_id
+
+    @property
+    def sender(self):
+        return senders.name(self.sender_id)
+
+    @property
+    def reply_sender(self):
+        return senders.name(self.reply_sender_id)
+
+    @property
+    def image(self):
+        return bool(self.flags & FLAG_IMAGE)
+
+    @property
+    def sticker(self):
+        return bool(self.flags & FLAG_STICKER)
+
+    @property
+    def video(self):
+        return bool(self.flags & FLAG_VIDEO)
+
+    @property
+    def reply_media(self):
+        return bool(self.flags & FLAG_REPLY_MEDIA)
+
+    def information(self):
+        """
+        Rebuilds the message_information string the message was scraped with.
+
+        Returns:
+            str or None: "[HH:MM, DD/MM/YYYY] Name: ", "[HH:MM, None] Name:" or None.
+        """
+        if self.raw_information is not None:
+            return self.raw_information
+        if self.timestamp is None:
+            return None
+
+        shown = time.gmtime(self.timestamp)
+        if self.flags & FLAG_MEDIA_INFORMATION:
+            return f"[{shown.tm_hour:02d}:{shown.tm_min:02d}, None] {self.sender}:"
+        return (f"[{shown.tm_hour:02d}:{shown.tm_min:02d}, {shown.tm_mday:02d}/"
+                f"{shown.tm_mon:02d}/{shown.tm_year}] {self.sender}: ")
+
+    def to_list(self):
+        """
+        Returns the message in the scraper's original 8-field format.
+
+        Returns:
+            list: [reply_sender, reply_message, reply_media, message_information,
+                   messages_text, image, sticker, video]
+        """
+        return [self.reply_sender, self.reply_text, self.reply_media, self.information(),
+                self.text, self.image, self.sticker, self.video]
+
+
+def parse_information(message_information):
+    """
+    Splits a message_information string into its time and sender.
+
+    Args:
+        message_information (str or None): The string from data-pre-plain-text, or its
+                                           "[HH:MM, None] Name:" form for media.
+
+    Returns:
+        tuple or None: (seconds since the epoch of the date or None if the string has no
+                        date, seconds since midnight, sender name, is the media form),
+                       or None if the string has neither form.
+    """
+    if message_information is None:
+        return None
+
+    match = _INFORMATION_RE.match(message_information)
+    if match:
+        hour, minute, day, month, year, sender = match.groups()
+        try:
+            date = calendar.timegm((int(year), int(month), int(day), 0, 0, 0))
+        except ValueError:
+            return None
+        # timegm normalises impossible days such as 31/02 instead of rejecting them
+        if time.gmtime(date).tm_mday != int(day):
+            return None
+        return date, int(hour) * 3600 + int(minute) * 60, sender, False
+
+    match = _MEDIA_INFORMATION_RE.match(message_information)
+    if match:
+        hour, minute, sender = match.groups()
+        return None, int(hour) * 3600 + int(minute) * 60, sender, True
+
+    return None
+
+
+def from_lists(messages):
+    """
+    Converts one chat's 8-field messages, oldest first, into records. Media messages
+    only show a time, so they are dated with the previous message that showed a date.
+
+    Args:
+        messages (list): The chat's messages as 8-field lists.
+
+    Returns:
+        list: One MessageRecord per message.
+    """
+    records = []
+    last_date = None
+
+    for reply_sender, reply_text, reply_media, information, text, image, sticker, video \
+            in messages:
+        flags = ((FLAG_REPLY_MEDIA if reply_media else 0) | (FLAG_IMAGE if image else 0)
+                 | (FLAG_STICKER if sticker else 0) | (FLAG_VIDEO if video else 0))
+        timestamp = None
+        sender_id = None
+
+        parsed = parse_information(information)
+        if parsed is not None:
+            date, seconds, sender, media_form = parsed
+            if media_form:
+                flags |= FLAG_MEDIA_INFORMATION
+                date = last_date
+                if date is not None:
+                    flags |= FLAG_DATE_INFERRED
+            else:
+                last_date = date
+            if date is not None:
+                timestamp = date + seconds
+            sender_id = senders.intern(sender)
+
+        record = MessageRecord(timestamp, sender_id, flags, text,
+                               senders.intern(reply_sender), reply_text)
+        if record.information() != information:
+            record.raw_information = information
+        records.append(record)
+
+    return records
+
+
+# The sender names of the whole run
+senders = SenderTable()
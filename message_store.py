@@ -0,0 +1,276 @@
+"""
+message_store.py
+
+Description: A persistent SQLite archive of the scraped messages, used as the "sqlite"
+output format. Unlike the file outputs, which every run overwrites, the store keeps
+every message ever scraped: each message has a unique key within its chat, so a
+repeated, incremental or bounded run updates the messages it already has instead of
+adding them twice. The key is the message's WhatsApp data-id (see message_key). Every
+chat is written in one transaction.
+
+The messages table is indexed on (chat, timestamp) and on (sender, timestamp), so
+reading a chat, a sender or a date range stays fast however many nightly runs the
+archive holds. Timestamps are the shown wall-clock time in seconds since the epoch,
+read as UTC (see message_records.py).
+
+Usage:
+    python whatsapp_message_scraper.py --output-format sqlite [--output messages.sqlite]
+    python message_store.py messages.sqlite chats
+    python message_store.py messages.sqlite export -o march.jsonl --chat "Name" \\
+        --since 2024-03-01 --until 2024-04-01 [--sender "Name"] [--format records]
+"""
+
+import argparse
+import calendar
+import hashlib
+import sqlite3
+import time
+
+import message_records
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL REFERENCES chats (id),
+    message_key TEXT NOT NULL,
+    timestamp INTEGER,
+    sender TEXT,
+    text TEXT,
+    reply_sender TEXT,
+    reply_text TEXT,
+    flags INTEGER NOT NULL,
+    information TEXT,
+    first_seen INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL,
+    UNIQUE (chat_id, message_key)
+);
+CREATE INDEX IF NOT EXISTS messages_by_chat_time ON messages (chat_id, timestamp);
+CREATE INDEX IF NOT EXISTS messages_by_sender_time ON messages (sender, timestamp);
+"""
+
+UPSERT_MESSAGE_SQL = """
+INSERT INTO messages (chat_id, message_key, timestamp, sender, text, reply_sender,
+                      reply_text, flags, information, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (chat_id, message_key) DO UPDATE SET last_seen = excluded.last_seen
+"""
+
+DEFAULT_STORE_PATH = "whatsapp_messages.sqlite"
+
+
+def message_key(message, occurrence=0):
+    """
+    Returns the key of a message within its chat: the data-id WhatsApp Web rendered it
+    with, which stays the same however the chat was scraped. Messages read without an id
+    are keyed by a hash of everything shown about them and how many identical id-less
+    messages came before them in the chat, so two "ok"s sent in the same minute are both
+    kept.
+
+    Args:
+        message (MessageRecord): The message.
+        occurrence (int): The number of identical id-less messages before it in the chat.
+
+    Returns:
+        str: The key.
+    """
+    if message.message_id is not None:
+        return message.message_id
+
+    shown = "\x1f".join(str(field) for field in (
+        message.timestamp, message.sender, message.text, message.reply_sender,
+        message.reply_text, message.flags, message.raw_information,
+    ))
+    return f"sha1:{hashlib.sha1(shown.encode('utf-8')).hexdigest()[:20]}:{occurrence}"
+
+
+def parse_date(text):
+    """
+    Converts a YYYY-MM-DD date into the store's timestamps (midnight, read as UTC).
+
+    Args:
+        text (str): The date.
+
+    Returns:
+        int: Seconds since the epoch.
+    """
+    return calendar.timegm(time.strptime(text, "%Y-%m-%d"))
+
+
+class MessageStore:
+    """
+    The SQLite archive. Usable as a writer of the scraper (write_chat/close) and for
+    queries.
+    """
+
+    streaming = True
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._run_started = int(time.time())
+
+    def _chat_id(self, contact):
+        self._connection.execute("INSERT OR IGNORE INTO chats (name) VALUES (?)", (contact,))
+        return self._connection.execute(
+            "SELECT id FROM chats WHERE name = ?", (contact,)
+        ).fetchone()[0]
+
+    def write_chat(self, contact, messages):
+        """
+        Upserts one chat's messages in a single transaction.
+
+        Args:
+            contact (str): The name of the chat.
+            messages (list): Its MessageRecords, oldest first.
+        """
+        occurrences = {}
+        rows = []
+        for message in messages:
+            occurrence = 0
+            if message.message_id is None:
+                shown = (message.timestamp, message.sender_id, message.text,
+                         message.reply_sender_id, message.reply_text, message.flags,
+                         message.raw_information)
+                occurrence = occurrences.get(shown, 0)
+                occurrences[shown] = occurrence + 1
+            rows.append((
+                message_key(message, occurrence), message.timestamp, message.sender,
+                message.text, message.reply_sender, message.reply_text, message.flags,
+                message.raw_information, self._run_started, self._run_started,
+            ))
+
+        with self._connection:
+            chat_id = self._chat_id(contact)
+            self._connection.executemany(
+                UPSERT_MESSAGE_SQL, [(chat_id, *row) for row in rows]
+            )
+
+    def chats(self):
+        """
+        Lists the archived chats.
+
+        Returns:
+            list: (name, number of messages, first timestamp, last timestamp) per chat.
+        """
+        return self._connection.execute("""
+            SELECT chats.name, COUNT(messages.id), MIN(messages.timestamp),
+                   MAX(messages.timestamp)
+            FROM chats LEFT JOIN messages ON messages.chat_id = chats.id
+            GROUP BY chats.id ORDER BY chats.name
+        """).fetchall()
+
+    def query(self, chat=None, sender=None, since=None, until=None):
+        """
+        Yields the archived messages matching all the given filters, chat by chat. Within
+        a chat they come in the order they were first archived, which is the order they
+        were shown in: media messages are dated from the message before them, so their
+        timestamps are not always in order.
+
+        Args:
+            chat (str): Only this chat.
+            sender (str): Only messages from this sender.
+            since (int): Only messages at or after this timestamp.
+            until (int): Only messages before this timestamp.
+
+        Yields:
+            tuple: (chat name, list of MessageRecords, oldest first)
+        """
+        conditions, parameters = [], []
+        if chat is not None:
+            conditions.append("chats.name = ?")
+            parameters.append(chat)
+        if sender is not None:
+            conditions.append("messages.sender = ?")
+            parameters.append(sender)
+        if since is not None:
+            conditions.append("messages.timestamp >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("messages.timestamp < ?")
+            parameters.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        cursor = self._connection.execute(f"""
+            SELECT chats.name, messages.timestamp, messages.sender, messages.flags,
+                   messages.text, messages.reply_sender, messages.reply_text,
+                   messages.information
+            FROM messages JOIN chats ON chats.id = messages.chat_id
+            {where}
+            ORDER BY messages.chat_id, messages.id
+        """, parameters)
+
+        current, records = None, []
+        senders = message_records.senders
+        for name, timestamp, sender, flags, text, reply_sender, reply_text, information \
+                in cursor:
+            if name != current and records:
+                yield current, records
+                records = []
+            current = name
+            records.append(message_records.MessageRecord(
+                timestamp, senders.intern(sender), flags, text, senders.intern(reply_sender),
+                reply_text, information
+            ))
+        if records:
+            yield current, records
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the SQLite message archive.")
+    parser.add_argument("store", help="The archive written with --output-format sqlite.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("chats", help="List the chats with their message counts.")
+
+    export_parser = subparsers.add_parser(
+        "export", help="Export messages in one of the scraper's output formats."
+    )
+    export_parser.add_argument("--chat", help="Only this chat.")
+    export_parser.add_argument("--sender", help="Only messages from this sender.")
+    export_parser.add_argument("--since", type=parse_date, metavar="YYYY-MM-DD",
+                               help="Only messages on or after this day.")
+    export_parser.add_argument("--until", type=parse_date, metavar="YYYY-MM-DD",
+                               help="Only messages before this day.")
+    export_parser.add_argument("--format", choices=["json", "jsonl", "records"],
+                               default="records", help="Output format (default: records).")
+    export_parser.add_argument("-o", "--output", required=True,
+                               help="Output file; .gz and .zst are compressed.")
+    args = parser.parse_args()
+
+    with MessageStore(args.store) as store:
+        if args.command == "chats":
+            for name, count, first, last in store.chats():
+                span = ""
+                if first is not None:
+                    span = (f"  {time.strftime('%Y-%m-%d', time.gmtime(first))} .. "
+                            f"{time.strftime('%Y-%m-%d', time.gmtime(last))}")
+                print(f"{count:>8}  {name}{span}")
+            return
+
+        from message_writers import open_writer
+
+        chats = store.query(args.chat, args.sender, args.since, args.until)
+        with open_writer(args.output, args.format) as writer:
+            for contact, messages in chats:
+                writer.write_chat(contact, messages)
+
+
+if __name__ == '__main__':
+    main()
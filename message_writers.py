@@ -0,0 +1,343 @@
+"""
+message_writers.py
+
+Description: Output writers for the scraped messages. Every writer receives the messages
+one chat at a time, as MessageRecords, through write_chat(contact, messages):
+
+    - JsonWriter keeps the original format, a single nested list written when the run ends.
+    - JsonLinesWriter streams one JSON record per message and flushes and fsyncs the file
+      after every chat, so memory stays at one chat and a crashed run still leaves usable
+      output behind.
+    - RecordsWriter streams like JsonLinesWriter, but with the timestamp and sender
+      already parsed out of the message information.
+    - ColumnarWriter writes a Parquet or Arrow file with one row group per chat, for
+      training jobs that memory-map the archive and only load some columns.
+    - MessageStore (see message_store.py) upserts into a persistent SQLite archive that
+      grows across runs without duplicates.
+
+Files ending in .gz are gzip-compressed and files ending in .zst are zstd-compressed
+(this needs the optional zstandard package). Columnar files need the optional pyarrow
+package.
+"""
+
+import gzip
+import json
+import os
+import zlib
+
+import message_records
+from message_store import DEFAULT_STORE_PATH, MessageStore
+
+
+class _OutputFile:
+    """
+    A binary output file, optionally compressed, that can be made durable on demand.
+    Compressed streams are flushed so that everything written so far can be decompressed
+    even if the process dies before close().
+    """
+
+    def __init__(self, path):
+        self._raw = open(path, "wb")
+
+        if path.endswith(".gz"):
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb")
+            self._flush_stream = lambda: self._stream.flush(zlib.Z_SYNC_FLUSH)
+        elif path.endswith(".zst"):
+            try:
+                import zstandard
+            except ImportError:
+                self._raw.close()
+                raise RuntimeError("Writing .zst files requires the zstandard package "
+                                   "(pip install zstandard).")
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+            self._flush_stream = lambda: self._stream.flush(zstandard.FLUSH_FRAME)
+        else:
+            self._stream = self._raw
+            self._flush_stream = lambda: None
+
+    def write(self, text):
+        self._stream.write(text.encode("utf-8"))
+
+    def sync(self):
+        """
+        Pushes everything written so far through the compressor and onto the disk.
+        """
+        self._flush_stream()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+
+    def close(self):
+        if self._stream is not self._raw:
+            self._stream.close()
+        if not self._raw.closed:
+            self._raw.close()
+
+
+class JsonWriter:
+    """
+    Writes all chats as one nested list, the scraper's original output format:
+    a list of chats, each a list of 8-field messages. Nothing is written until close().
+    The chats are kept as compact records until then and converted one at a time, with
+    the same result as json.dumps(chats, indent=2).
+    """
+
+    streaming = False
+
+    def __init__(self, path):
+        self.path = path
+        self._chats = []
+
+    def write_chat(self, contact, messages):
+        self._chats.append(messages)
+
+    def close(self):
+        output = _OutputFile(self.path)
+        try:
+            if not self._chats:
+                output.write("[]")
+            else:
+                output.write("[\n")
+                for index, messages in enumerate(self._chats):
+                    chat = json.dumps(
+                        [message.to_list() for message in messages], indent=2, ensure_ascii=False
+                    )
+                    separator = "" if index == 0 else ",\n"
+                    output.write(separator + "  " + chat.replace("\n", "\n  "))
+                output.write("\n]")
+            output.sync()
+        finally:
+            output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JsonLinesWriter:
+    """
+    Streams one JSON object per line: {"chat": <contact name>, "message": <8-field list>}.
+    The file is flushed and fsynced after each chat.
+    """
+
+    streaming = True
+
+    def __init__(self, path):
+        self.path = path
+        self._output = _OutputFile(path)
+
+    def write_chat(self, contact, messages):
+        for message in messages:
+            record = {"chat": contact, "message": message.to_list()}
+            self._output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._output.sync()
+
+    def close(self):
+        self._output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordsWriter(JsonLinesWriter):
+    """
+    Streams one typed JSON object per line:
+        {"chat", "timestamp", "sender", "text", "reply_sender", "reply_text",
+         "reply_media", "image", "sticker", "video", "date_inferred"}
+    "timestamp" is the shown wall-clock time in seconds since the epoch (as if it were
+    UTC), or null if the message showed none. "information" is only present when the
+    original message information could not be parsed, and "media" when the message's
+    media file was saved (the path relative to the media directory).
+    """
+
+    def write_chat(self, contact, messages):
+        for message in messages:
+            record = {
+                "chat": contact,
+                "timestamp": message.timestamp,
+                "sender": message.sender,
+                "text": message.text,
+                "reply_sender": message.reply_sender,
+                "reply_text": message.reply_text,
+                "reply_media": message.reply_media,
+                "image": message.image,
+                "sticker": message.sticker,
+                "video": message.video,
+                "date_inferred": bool(message.flags & message_records.FLAG_DATE_INFERRED),
+            }
+            if message.raw_information is not None:
+                record["information"] = message.raw_information
+            if message.media is not None:
+                record["media"] = message.media
+            self._output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._output.sync()
+
+
+class ColumnarWriter:
+    """
+    Writes the messages as a table with the columns
+
+        chat_id, chat, timestamp, sender, text, reply_sender, reply_text,
+        reply_media, image, sticker, video, date_inferred, information
+
+    where chat, sender and reply_sender are dictionary-encoded and timestamp is the
+    shown wall-clock time (see message_records). Every chat is one row group (Parquet)
+    or record batch (Arrow), so readers can skip chats and date ranges by their
+    statistics and read only the columns they need. Files ending in .arrow or .feather
+    are written in the Arrow IPC file format, which can be memory-mapped; anything else
+    is written as Parquet. The file is only complete once close() writes its footer.
+    """
+
+    streaming = False
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError("Columnar export requires the pyarrow package "
+                               "(pip install pyarrow).")
+        self.path = path
+        self._pa = pyarrow
+        self._chats = []
+        self._schema = pyarrow.schema([
+            ("chat_id", pyarrow.int32()),
+            ("chat", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ("timestamp", pyarrow.timestamp("s")),
+            ("sender", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ("text", pyarrow.string()),
+            ("reply_sender", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ("reply_text", pyarrow.string()),
+            ("reply_media", pyarrow.bool_()),
+            ("image", pyarrow.bool_()),
+            ("sticker", pyarrow.bool_()),
+            ("video", pyarrow.bool_()),
+            ("date_inferred", pyarrow.bool_()),
+            ("information", pyarrow.string()),
+        ])
+
+        if path.endswith((".arrow", ".feather")):
+            # The dictionaries only ever grow, so each batch adds a delta to them
+            self._writer = pyarrow.ipc.new_file(
+                path, self._schema,
+                options=pyarrow.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            )
+        else:
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write_chat(self, contact, messages):
+        pa = self._pa
+        chat_id = len(self._chats)
+        self._chats.append(contact)
+        if not messages:
+            return
+
+        # The sender ids index the run's sender table directly, so no names are copied
+        names = pa.array(message_records.senders.names, type=pa.string())
+
+        def senders(ids):
+            return pa.DictionaryArray.from_arrays(pa.array(ids, type=pa.int32()), names)
+
+        chat_ids = pa.array([chat_id] * len(messages), type=pa.int32())
+        batch = pa.record_batch([
+            chat_ids,
+            pa.DictionaryArray.from_arrays(chat_ids, pa.array(self._chats, type=pa.string())),
+            pa.array([message.timestamp for message in messages], type=pa.timestamp("s")),
+            senders([message.sender_id for message in messages]),
+            pa.array([message.text for message in messages], type=pa.string()),
+            senders([message.reply_sender_id for message in messages]),
+            pa.array([message.reply_text for message in messages], type=pa.string()),
+            pa.array([message.reply_media for message in messages]),
+            pa.array([message.image for message in messages]),
+            pa.array([message.sticker for message in messages]),
+            pa.array([message.video for message in messages]),
+            pa.array([bool(message.flags & message_records.FLAG_DATE_INFERRED)
+                      for message in messages]),
+            pa.array([message.raw_information for message in messages], type=pa.string()),
+        ], schema=self._schema)
+
+        if isinstance(self._writer, pa.ipc.RecordBatchFileWriter):
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write_table(pa.Table.from_batches([batch]), row_group_size=len(messages))
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TeeWriter:
+    """
+    Hands every chat to several writers, e.g. the JSON output and a columnar export.
+    """
+
+    def __init__(self, writers):
+        self.writers = writers
+        self.streaming = all(writer.streaming for writer in writers)
+
+    def write_chat(self, contact, messages):
+        for writer in self.writers:
+            writer.write_chat(contact, messages)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+WRITERS = {
+    "json": JsonWriter,
+    "jsonl": JsonLinesWriter,
+    "records": RecordsWriter,
+    "sqlite": MessageStore,
+}
+
+DEFAULT_OUTPUT_PATHS = {
+    "json": "whatsapp_messages.json",
+    "jsonl": "whatsapp_messages.jsonl",
+    "records": "whatsapp_messages.records.jsonl",
+    "sqlite": DEFAULT_STORE_PATH,
+}
+
+
+def open_writer(path, output_format, columnar_path=None):
+    """
+    Creates the writer for an output format.
+
+    Args:
+        path (str or None): The output file. None selects the default name for the format.
+        output_format (str): "json", "jsonl", "records" or "sqlite".
+        columnar_path (str or None): If given, every chat is also exported to this
+                                     Parquet or Arrow file (see ColumnarWriter).
+
+    Returns:
+        JsonWriter, JsonLinesWriter, RecordsWriter, MessageStore or TeeWriter: The writer,
+        usable as a context manager.
+    """
+    if path is None:
+        path = DEFAULT_OUTPUT_PATHS[output_format]
+    if columnar_path is None:
+        return WRITERS[output_format](path)
+
+    # Opened first, so a missing pyarrow fails the run before any output is created
+    columnar = ColumnarWriter(columnar_path)
+    try:
+        writer = WRITERS[output_format](path)
+    except Exception:
+        columnar.close()
+        raise
+    return TeeWriter([writer, columnar])
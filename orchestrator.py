@@ -0,0 +1,380 @@
+"""
+orchestrator.py
+
+Description: Scrapes several WhatsApp accounts in one go. Every account of a job file is
+scraped by its own whatsapp_message_scraper.py process, in its own Chrome profile and
+its own output directory, so the accounts share nothing but the machine. As many
+accounts run at once as the machine's CPUs and available memory allow for their
+browsers. Every line a scraper prints is shown prefixed with its account and kept in
+the account's scraper.log, and once all accounts are done their metrics reports are
+combined into one fleet report.
+
+The job file is JSON:
+    {
+        "args": ["--headless", "--output-format", "sqlite"],
+        "accounts": [
+            {"name": "personal", "user_data_dir": "~/.whatsapp/personal"},
+            {"name": "work", "user_data_dir": "~/.whatsapp/work", "args": ["--workers", "2"]}
+        ]
+    }
+"args" at the top are passed to every scraper, followed by the account's own. Scrapers
+run --unattended, so every profile must have been logged in once by running the scraper
+with its --user-data-dir by hand.
+
+Usage:
+    python orchestrator.py accounts.json [--output-dir accounts] [--max-browsers N]
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+
+
+SCRAPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "whatsapp_message_scraper.py")
+
+DEFAULT_OUTPUT_DIR = "accounts"
+METRICS_REPORT_NAME = "metrics.json"
+LOG_NAME = "scraper.log"
+FLEET_REPORT_NAME = "fleet_report.json"
+
+# CPUs kept free for every browser a scraper runs
+CPUS_PER_BROWSER = 1
+
+# Memory kept free for every browser a scraper runs without --max-browser-memory, in MB
+MEMORY_PER_BROWSER = 3072
+
+# Seconds between two progress lines
+STATUS_INTERVAL = 60
+
+# Lines with which a scraper starts reading a chat
+CHAT_STARTED_RE = re.compile(
+    r"^(Beginning to read messages from chat with |Reading messages from chat with "
+    r"|Read \d+ messages of )"
+)
+
+
+def available_memory_mb():
+    """
+    Returns the memory available for new processes, from /proc/meminfo.
+
+    Returns:
+        float or None: MemAvailable in MB, or None where it cannot be read.
+    """
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _option_value(args, option, default):
+    """
+    Returns the value of a scraper option in an argument list, given as "--option value"
+    or "--option=value". The last one wins, as with argparse.
+    """
+    value = default
+    for index, arg in enumerate(args):
+        if arg == option and index + 1 < len(args):
+            value = args[index + 1]
+        elif arg.startswith(f"{option}="):
+            value = arg.split("=", 1)[1]
+    return value
+
+
+@dataclass
+class AccountJob:
+    """
+    One account to scrape.
+
+    Attributes:
+        name (str): The account's name, used for its output directory and log prefix.
+        user_data_dir (str): The logged-in Chrome profile of the account.
+        args (list): Scraper options, the job file's common ones first.
+    """
+    name: str
+    user_data_dir: str
+    args: list = field(default_factory=list)
+
+    @property
+    def browsers(self):
+        return max(1, int(_option_value(self.args, "--workers", 1)))
+
+    @property
+    def memory_mb(self):
+        """
+        The memory its browsers may use: each is recycled at --max-browser-memory, or
+        assumed to stay within MEMORY_PER_BROWSER without it.
+        """
+        per_browser = float(_option_value(self.args, "--max-browser-memory", 0))
+        return self.browsers * (per_browser or MEMORY_PER_BROWSER)
+
+    def command(self):
+        return [
+            sys.executable, "-u", SCRAPER_PATH, *self.args,
+            "--user-data-dir", os.path.abspath(os.path.expanduser(self.user_data_dir)),
+            "--unattended", "--metrics-report", METRICS_REPORT_NAME,
+        ]
+
+
+def load_jobs(path):
+    """
+    Reads a job file (see the module description).
+
+    Args:
+        path (str): The job file.
+
+    Returns:
+        list: One AccountJob per account, in the order of the file.
+
+    Raises:
+        ValueError: If an account has no name or profile, or two share a name.
+    """
+    with open(path, encoding="utf-8") as f:
+        job_file = json.load(f)
+
+    common_args = job_file.get("args", [])
+    jobs = []
+    for account in job_file.get("accounts", []):
+        if not account.get("name") or not account.get("user_data_dir"):
+            raise ValueError(f"Every account needs a name and a user_data_dir: {account}")
+        jobs.append(AccountJob(
+            account["name"], account["user_data_dir"],
+            [*common_args, *account.get("args", [])]
+        ))
+
+    names = [re.sub(r'[^\w\-]', '_', job.name) for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Account names must be unique.")
+    return jobs
+
+
+class AccountRun:
+    """
+    A scraper process of one account, and the progress read from its output.
+    """
+
+    def __init__(self, job, output_dir, print_lock):
+        self.job = job
+        self.directory = os.path.join(output_dir, re.sub(r'[^\w\-]', '_', job.name))
+        os.makedirs(self.directory, exist_ok=True)
+        # A failed run must not be reported with the metrics of an earlier one
+        if os.path.exists(os.path.join(self.directory, METRICS_REPORT_NAME)):
+            os.remove(os.path.join(self.directory, METRICS_REPORT_NAME))
+        self.chats_started = 0
+        self.started = time.time()
+        self.finished = None
+        self._print_lock = print_lock
+
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+        self.process = subprocess.Popen(
+            job.command(), cwd=self.directory, env=env, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+            encoding="utf-8", errors="replace",
+        )
+        self._reader = threading.Thread(target=self._read_output, daemon=True)
+        self._reader.start()
+
+    def _read_output(self):
+        with open(os.path.join(self.directory, LOG_NAME), "a", encoding="utf-8") as log:
+            for line in self.process.stdout:
+                log.write(line)
+                line = line.rstrip("\n")
+                if CHAT_STARTED_RE.match(line):
+                    self.chats_started += 1
+                with self._print_lock:
+                    print(f"[{self.job.name}] {line}", flush=True)
+
+    def poll(self):
+        """
+        Returns whether or not the scraper has exited, once all its output was read.
+        """
+        if self.process.poll() is None:
+            return False
+        self._reader.join()
+        if self.finished is None:
+            self.finished = time.time()
+        return True
+
+    def report(self):
+        """
+        Returns the account's part of the fleet report.
+
+        Returns:
+            dict: Its name, directory, exit code, seconds and metrics report (None if
+                  the scraper did not write one).
+        """
+        metrics = None
+        path = os.path.join(self.directory, METRICS_REPORT_NAME)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                metrics = json.load(f)
+            metrics.pop("per_chat", None)
+        return {
+            "account": self.job.name,
+            "directory": self.directory,
+            "exit_code": self.process.returncode,
+            "seconds": (self.finished or time.time()) - self.started,
+            "metrics": metrics,
+        }
+
+
+def browser_budget(max_browsers=None):
+    """
+    Returns how many browsers may run at once and how much memory they may use.
+
+    Args:
+        max_browsers (int): A further cap on the browsers, or None.
+
+    Returns:
+        tuple: (browsers, memory in MB or None if unknown).
+    """
+    browsers = max(1, (os.cpu_count() or 1) // CPUS_PER_BROWSER)
+    if max_browsers is not None:
+        browsers = min(browsers, max_browsers)
+    return browsers, available_memory_mb()
+
+
+def run_fleet(jobs, output_dir, max_browsers=None):
+    """
+    Runs the scrapers of all accounts, starting them in order as soon as their browsers
+    fit in the budget. An account that needs more than the whole budget runs alone.
+
+    Args:
+        jobs (list): The AccountJobs.
+        output_dir (str): The directory holding one directory per account.
+        max_browsers (int): A further cap on the browsers running at once.
+
+    Returns:
+        list: The finished AccountRuns, in the order they were started.
+    """
+    browsers, memory_mb = browser_budget(max_browsers)
+    memory_text = f"{memory_mb:.0f} MB" if memory_mb is not None else "unknown memory"
+    print(f"Scraping {len(jobs)} accounts with up to {browsers} browsers and {memory_text}.")
+
+    print_lock = threading.Lock()
+    pending = list(jobs)
+    running = []
+    finished = []
+    last_status = time.time()
+
+    try:
+        while pending or running:
+            for run in [run for run in running if run.poll()]:
+                running.remove(run)
+                finished.append(run)
+                with print_lock:
+                    print(f"[{run.job.name}] Finished with exit code {run.process.returncode} "
+                          f"after {run.finished - run.started:.0f}s.", flush=True)
+
+            while pending:
+                job = pending[0]
+                used_browsers = sum(run.job.browsers for run in running)
+                used_memory = sum(run.job.memory_mb for run in running)
+                fits = (used_browsers + job.browsers <= browsers
+                        and (memory_mb is None or used_memory + job.memory_mb <= memory_mb))
+                if running and not fits:
+                    break
+                running.append(AccountRun(pending.pop(0), output_dir, print_lock))
+
+            if running and time.time() - last_status >= STATUS_INTERVAL:
+                last_status = time.time()
+                with print_lock:
+                    print(f"Progress: {len(finished)}/{len(jobs)} accounts done; "
+                          + ", ".join(f"{run.job.name}: {run.chats_started} chats"
+                                      for run in running), flush=True)
+
+            time.sleep(0.5)
+
+    finally:
+        # An interrupted orchestrator leaves no scraper behind
+        for run in running:
+            run.process.terminate()
+        for run in running:
+            run.process.wait()
+            run.poll()
+            finished.append(run)
+
+    return finished
+
+
+def fleet_report(runs):
+    """
+    Combines the accounts' reports.
+
+    Args:
+        runs (list): The finished AccountRuns.
+
+    Returns:
+        dict: The totals over all accounts and every account's report.
+    """
+    accounts = [run.report() for run in runs]
+    reports = [account["metrics"] for account in accounts if account["metrics"]]
+    return {
+        "accounts": len(accounts),
+        "failed": [account["account"] for account in accounts if account["exit_code"] != 0],
+        "chats": sum(report["chats"] for report in reports),
+        "messages": sum(report["messages"] for report in reports),
+        "scraper_seconds": sum(report["run_seconds"] for report in reports),
+        "peak_rss_bytes": max((report["peak_rss_bytes"] for report in reports), default=0),
+        "per_account": accounts,
+    }
+
+
+def print_fleet_summary(report):
+    print(f"\nScraped {report['messages']} messages from {report['chats']} chats of "
+          f"{report['accounts']} accounts.")
+    for account in report["per_account"]:
+        metrics = account["metrics"]
+        if metrics is None:
+            print(f"  {account['account']:<20} exit code {account['exit_code']}, no metrics")
+            continue
+        print(f"  {account['account']:<20} {metrics['messages']:>8} messages "
+              f"{metrics['chats']:>5} chats {account['seconds']:>8.0f}s "
+              f"exit code {account['exit_code']}")
+    if report["failed"]:
+        print(f"[WARN] Failed accounts: {', '.join(report['failed'])}. See their {LOG_NAME}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Scrape several WhatsApp accounts, each in its own scraper process."
+    )
+    parser.add_argument("jobs", help="The job file listing the accounts (JSON).")
+    parser.add_argument(
+        "--output-dir", default=DEFAULT_OUTPUT_DIR,
+        help="Every account's output, log and metrics are written to a directory named "
+             f"after it in here (default: {DEFAULT_OUTPUT_DIR})."
+    )
+    parser.add_argument(
+        "--max-browsers", type=int, default=None, metavar="N",
+        help="Run at most N browsers at once, in addition to the limits of the CPUs "
+             "and available memory."
+    )
+    args = parser.parse_args()
+
+    jobs = load_jobs(args.jobs)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    runs = run_fleet(jobs, args.output_dir, args.max_browsers)
+
+    report = fleet_report(runs)
+    with open(os.path.join(args.output_dir, FLEET_REPORT_NAME), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print_fleet_summary(report)
+
+    if report["failed"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
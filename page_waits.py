@@ -0,0 +1,295 @@
+"""
+page_waits.py
+
+Description: Waits that block only until the relevant DOM change happens, instead of
+fixed time.sleep calls. Each wait has its own timeout, and every timeout is capped by a
+configurable ceiling (see configure_waits). The in-page waits use a MutationObserver
+through execute_async_script, so waiting costs a single WebDriver round trip.
+"""
+
+import re
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+import whatsapp_selectors as sel
+
+
+# Upper bound in seconds for any single wait
+DEFAULT_WAIT_CEILING = 30
+
+# Default timeouts in seconds. Waits that normally succeed return as soon as they do,
+# so their timeouts only matter on slow syncs; waits that normally time out (the bottom
+# of the sidebar) keep the length of the sleeps they replace. SCROLL_STEP_TIMEOUT is only
+# the first wait for older messages; later waits follow the observed load latency.
+CHAT_OPEN_TIMEOUT = 30
+SEARCH_TIMEOUT = 10
+SCROLL_STEP_TIMEOUT = 2
+SIDEBAR_RENDER_TIMEOUT = 0.5
+SIDEBAR_ROW_TIMEOUT = 2
+BUTTON_CLICK_TIMEOUT = 5
+SYNC_POLL_TIMEOUT = 10
+
+# Interval in seconds between checks of the polled (non-observer) conditions
+POLL_FREQUENCY = 0.1
+
+_wait_ceiling = DEFAULT_WAIT_CEILING
+
+
+# Resolves true after the first mutation below arguments[0] has been rendered, or false
+# after arguments[1] milliseconds. arguments[2] says whether attribute changes count.
+WAIT_FOR_MUTATION_JS = """
+const target = arguments[0], timeoutMs = arguments[1], attributes = arguments[2];
+const done = arguments[arguments.length - 1];
+let finished = false, observer = null, timer = null;
+
+function finish(value) {
+    if (finished) {
+        return;
+    }
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(value);
+}
+
+observer = new MutationObserver(
+    () => requestAnimationFrame(() => requestAnimationFrame(() => finish(true)))
+);
+observer.observe(target, {childList: true, subtree: true, attributes: attributes});
+timer = setTimeout(() => finish(false), timeoutMs);
+"""
+
+# Jumps arguments[0] (the chat) to the top and waits for WhatsApp to render older rows
+# into arguments[1] (the message list), for at most arguments[2] ms. Resolves straight
+# away if the top shows a banner that needs handling: one whose text is in arguments[4],
+# or the paused-sync icon (arguments[5]). Resolves {status: "banner", "grew" or
+# "timeout", banner: the banner's text or null, rows: the number of rendered rows,
+# seconds: how long it waited}.
+JUMP_TO_TOP_AND_WAIT_JS = """
+const scroller = arguments[0], list = arguments[1], timeoutMs = arguments[2];
+const bannerXpath = arguments[3], stoppingTexts = arguments[4], pausedXpath = arguments[5];
+const done = arguments[arguments.length - 1];
+const started = performance.now();
+const rowsBefore = list.childElementCount, heightBefore = scroller.scrollHeight;
+let finished = false, observer = null, timer = null;
+
+function banner() {
+    const node = document.evaluate(
+        bannerXpath, scroller, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    return node ? node.innerText.trim() : null;
+}
+
+function needsHandling() {
+    const text = banner();
+    return text !== null && (stoppingTexts.includes(text) || document.evaluate(
+        pausedXpath, scroller, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue !== null);
+}
+
+function finish(status) {
+    if (finished) {
+        return;
+    }
+    finished = true;
+    if (observer) {
+        observer.disconnect();
+    }
+    clearTimeout(timer);
+    done({status: status, banner: banner(), rows: list.childElementCount,
+          seconds: (performance.now() - started) / 1000});
+}
+
+scroller.scrollTop = 0;
+if (needsHandling()) {
+    finish("banner");
+    return;
+}
+observer = new MutationObserver(() => requestAnimationFrame(() => requestAnimationFrame(() => {
+    if (needsHandling()) {
+        finish("banner");
+    } else if (list.childElementCount !== rowsBefore || scroller.scrollHeight !== heightBefore) {
+        finish("grew");
+    }
+})));
+observer.observe(scroller, {childList: true, subtree: true});
+timer = setTimeout(() => finish("timeout"), timeoutMs);
+"""
+
+# Returns the title of the open chat's header, or null if no chat is open
+CHAT_HEADER_TITLE_JS = """
+const span = document.evaluate(
+    arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+).singleNodeValue;
+if (!span || !document.evaluate(
+        arguments[1], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue) {
+    return null;
+}
+return span.getAttribute("title") || span.textContent;
+"""
+
+
+def configure_waits(driver, ceiling=DEFAULT_WAIT_CEILING):
+    """
+    Sets the ceiling for every wait and gives in-page waits enough script time to finish.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        ceiling (float): The longest any single wait may block, in seconds.
+    """
+    global _wait_ceiling
+    _wait_ceiling = ceiling
+    driver.set_script_timeout(ceiling + 5)
+
+
+def bounded(timeout):
+    """
+    Returns the timeout capped by the configured ceiling.
+
+    Args:
+        timeout (float): The requested timeout in seconds.
+
+    Returns:
+        float: The timeout to use.
+    """
+    return max(0, min(timeout, _wait_ceiling))
+
+
+def _loose_name(name):
+    """
+    Reduces a chat name to its word characters, so names compare equal whether or not
+    emojis were rendered as text or as images.
+
+    Args:
+        name (str): The chat name.
+
+    Returns:
+        str: The reduced name.
+    """
+    return re.sub(r'[\W_]', '', name or "").casefold()
+
+
+def wait_for_mutation(driver, element, timeout, attributes=False):
+    """
+    Blocks until something below the element changes, or until the timeout.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        element (WebElement): The element to observe.
+        timeout (float): The longest to wait, in seconds.
+        attributes (bool): Whether attribute changes count, not just added/removed nodes.
+
+    Returns:
+        bool: True if a change happened, False if the wait timed out.
+    """
+    try:
+        return driver.execute_async_script(
+            WAIT_FOR_MUTATION_JS, element, int(bounded(timeout) * 1000), attributes
+        )
+    except TimeoutException:
+        return False
+
+
+def jump_to_top_and_wait(driver, scroller, message_list, stopping_texts, timeout):
+    """
+    Jumps a chat to the top and blocks until older rows are rendered, a banner that
+    needs handling is shown, or the timeout passes.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        scroller (WebElement): The scrollable chat container.
+        message_list (WebElement): The chat's message list.
+        stopping_texts (list): Banner texts that end the wait straight away.
+        timeout (float): The longest to wait for older rows, in seconds.
+
+    Returns:
+        dict: {"status": "grew", "banner" or "timeout", "banner": the text of the banner
+               at the top or None, "rows": the number of rendered rows, "seconds": how
+               long the wait took}
+    """
+    try:
+        return driver.execute_async_script(
+            JUMP_TO_TOP_AND_WAIT_JS, scroller, message_list, int(bounded(timeout) * 1000),
+            sel.CHAT_BANNER_XPATH, stopping_texts, sel.SYNC_PAUSED_XPATH
+        )
+    except TimeoutException:
+        return {"status": "timeout", "banner": None, "rows": None, "seconds": timeout}
+
+
+def wait_for_chat_open(driver, contact, timeout=CHAT_OPEN_TIMEOUT, exact=False):
+    """
+    Blocks until the chat header shows the contact and its message list is rendered.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        contact (str): The name of the chat that should be open.
+        timeout (float): The longest to wait, in seconds.
+        exact (bool): Whether the header title must equal the name, emojis included.
+                      Otherwise names that only differ in emojis and punctuation match.
+
+    Returns:
+        bool: True if the chat opened, False if the wait timed out.
+    """
+    expected = _loose_name(contact)
+
+    def header_matches(driver):
+        title = driver.execute_script(
+            CHAT_HEADER_TITLE_JS, sel.CHAT_HEADER_TITLE_XPATH, sel.MESSAGE_LIST_XPATH
+        )
+        if title is None or exact:
+            return title == contact
+        return title == contact or _loose_name(title) == expected
+
+    try:
+        WebDriverWait(driver, bounded(timeout), poll_frequency=POLL_FREQUENCY).until(
+            header_matches
+        )
+        return True
+    except TimeoutException:
+        print(f"[WARN] Chat with '{contact}' did not open in time.")
+        return False
+
+
+def wait_for_element_text(driver, element, expected, timeout=SEARCH_TIMEOUT):
+    """
+    Blocks until an element's text equals the expected text, e.g. until typed keys landed.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        element (WebElement): The element to read.
+        expected (str): The text to wait for.
+        timeout (float): The longest to wait, in seconds.
+
+    Returns:
+        bool: True if the text matched, False if the wait timed out.
+    """
+    try:
+        WebDriverWait(driver, bounded(timeout), poll_frequency=POLL_FREQUENCY).until(
+            lambda driver: element.text.strip() == expected.strip()
+        )
+        return True
+    except TimeoutException:
+        return False
+
+
+def wait_for_script_result(driver, script, *args, timeout=SEARCH_TIMEOUT):
+    """
+    Runs a script repeatedly until it returns something truthy.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        script (str): The JavaScript to run.
+        *args: The arguments handed to the script.
+        timeout (float): The longest to wait, in seconds.
+
+    Returns:
+        any: The first truthy result, or None if the wait timed out.
+    """
+    try:
+        return WebDriverWait(driver, bounded(timeout), poll_frequency=POLL_FREQUENCY).until(
+            lambda driver: driver.execute_script(script, *args)
+        )
+    except TimeoutException:
+        return None
@@ -0,0 +1,282 @@
+"""
+scrape_metrics.py
+
+Description: Instrumentation of a scraper run. Records:
+    - wall time per phase (login, sidebar, search, scroll, sync waits, extraction, ...)
+      for the whole run and for every chat
+    - the WebDriver commands issued, by command name
+    - failed _has_element lookups, by XPath
+    - messages scraped and messages per second
+    - the browser's memory after every chat and how often it was recycled (see
+      browser_memory.py)
+
+The scraper records into the module-level `current` instance. At the end of a run the
+numbers can be written as a JSON report and as a Prometheus textfile.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+class RunMetrics:
+    """
+    Thread-safe counters and timers for one scraper run. Phases and commands recorded
+    while a chat is active on the same thread are also attributed to that chat.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.phase_seconds = defaultdict(float)
+        self.phase_counts = Counter()
+        self.command_counts = Counter()
+        self.command_seconds = defaultdict(float)
+        self.failed_lookups = Counter()
+        self.chats = []
+        self.recycles = Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _current_chat(self):
+        return getattr(self._local, "chat", None)
+
+    def last_chat(self):
+        """
+        Returns the record of the chat most recently finished on this thread, so
+        measurements taken after it, such as its memory, can be added to it.
+
+        Returns:
+            dict or None: The chat's record, see chat().
+        """
+        return getattr(self._local, "last_chat", None)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the enclosed block as the named phase.
+
+        Args:
+            name (str): The phase, e.g. "scroll" or "sync_wait".
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_time(name, time.perf_counter() - started)
+
+    def add_phase_time(self, name, seconds):
+        with self._lock:
+            self.phase_seconds[name] += seconds
+            self.phase_counts[name] += 1
+            chat = self._current_chat()
+            if chat is not None:
+                chat["phases"][name] = chat["phases"].get(name, 0) + seconds
+
+    @contextmanager
+    def chat(self, contact):
+        """
+        Attributes everything recorded on this thread inside the block to one chat.
+
+        Args:
+            contact (str): The name of the chat.
+
+        Yields:
+            dict: The chat's record; set its "messages" entry to the number scraped, or
+                  its "deferred" entry if the chat was set aside to be retried later.
+        """
+        record = {"contact": contact, "seconds": 0, "messages": 0,
+                  "webdriver_commands": 0, "phases": {}}
+        self._local.chat = record
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - started
+            self._local.chat = None
+            self._local.last_chat = record
+            with self._lock:
+                self.chats.append(record)
+
+    def count_command(self, command, seconds):
+        with self._lock:
+            self.command_counts[command] += 1
+            self.command_seconds[command] += seconds
+            chat = self._current_chat()
+            if chat is not None:
+                chat["webdriver_commands"] += 1
+
+    def failed_lookup(self, xpath):
+        with self._lock:
+            self.failed_lookups[xpath] += 1
+
+    def count_recycle(self, action):
+        with self._lock:
+            self.recycles[action] += 1
+
+    def report(self):
+        """
+        Returns the run's numbers as a JSON-serialisable dict, with the most expensive
+        phases, commands and lookups first.
+
+        Returns:
+            dict: The report.
+        """
+        with self._lock:
+            run_seconds = time.time() - self.started
+            messages = sum(chat["messages"] for chat in self.chats)
+            chat_seconds = sum(chat["seconds"] for chat in self.chats)
+            deferred = sum(1 for chat in self.chats if chat.get("deferred"))
+            memory = [chat["memory"] for chat in self.chats if "memory" in chat]
+
+            return {
+                "run_seconds": run_seconds,
+                "chats": len(self.chats) - deferred,
+                "deferred_attempts": deferred,
+                "messages": messages,
+                "messages_per_second": messages / run_seconds if run_seconds else 0,
+                "messages_per_chat_second": messages / chat_seconds if chat_seconds else 0,
+                "sync_wait_seconds": self.phase_seconds.get("sync_wait", 0),
+                "peak_rss_bytes": max(
+                    (sample["rss_bytes"] or 0 for sample in memory), default=0
+                ),
+                "peak_js_heap_bytes": max(
+                    (sample["js_heap_bytes"] or 0 for sample in memory), default=0
+                ),
+                "recycles": dict(self.recycles),
+                "phases": {
+                    name: {"seconds": seconds, "count": self.phase_counts[name]}
+                    for name, seconds in sorted(
+                        self.phase_seconds.items(), key=lambda item: -item[1]
+                    )
+                },
+                "webdriver_commands": {
+                    "total": sum(self.command_counts.values()),
+                    "by_command": {
+                        command: {"count": count, "seconds": self.command_seconds[command]}
+                        for command, count in self.command_counts.most_common()
+                    },
+                },
+                "failed_lookups": dict(self.failed_lookups.most_common()),
+                "per_chat": list(self.chats),
+            }
+
+    def write_json(self, path):
+        """
+        Writes the report as JSON.
+
+        Args:
+            path (str): The file to write.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+
+    def write_prometheus(self, path):
+        """
+        Writes the run totals in the Prometheus text format, for node_exporter's textfile
+        collector. The file is replaced atomically.
+
+        Args:
+            path (str): The .prom file to write.
+        """
+        report = self.report()
+        lines = []
+
+        def metric(name, help_text, metric_type, samples):
+            lines.append(f"# HELP whatsapp_scraper_{name} {help_text}")
+            lines.append(f"# TYPE whatsapp_scraper_{name} {metric_type}")
+            for labels, value in samples:
+                label_text = ",".join(
+                    f'{key}="{_escape_label(str(label))}"' for key, label in labels.items()
+                )
+                lines.append(
+                    f"whatsapp_scraper_{name}{{{label_text}}} {value}" if label_text
+                    else f"whatsapp_scraper_{name} {value}"
+                )
+
+        metric("run_seconds", "Wall time of the run.", "gauge",
+               [({}, report["run_seconds"])])
+        metric("chats_total", "Chats scraped.", "counter", [({}, report["chats"])])
+        metric("messages_total", "Messages scraped.", "counter", [({}, report["messages"])])
+        metric("deferred_attempts_total", "Chats set aside while still syncing.", "counter",
+               [({}, report["deferred_attempts"])])
+        metric("messages_per_second", "Messages scraped per second of the run.", "gauge",
+               [({}, report["messages_per_second"])])
+        metric("sync_wait_seconds_total", "Time spent waiting for WhatsApp to sync.", "counter",
+               [({}, report["sync_wait_seconds"])])
+        metric("peak_rss_bytes", "Largest resident memory of Chrome seen between chats.",
+               "gauge", [({}, report["peak_rss_bytes"])])
+        metric("peak_js_heap_bytes", "Largest JS heap of WhatsApp Web seen between chats.",
+               "gauge", [({}, report["peak_js_heap_bytes"])])
+        metric("recycles_total", "Times a browser was recycled to free memory.", "counter",
+               [({"action": action}, count) for action, count in report["recycles"].items()])
+        metric("phase_seconds_total", "Wall time per phase.", "counter",
+               [({"phase": name}, phase["seconds"]) for name, phase in report["phases"].items()])
+        metric("webdriver_commands_total", "WebDriver commands issued.", "counter",
+               [({"command": command}, stats["count"])
+                for command, stats in report["webdriver_commands"]["by_command"].items()])
+        metric("webdriver_command_seconds_total", "Time spent in WebDriver commands.", "counter",
+               [({"command": command}, stats["seconds"])
+                for command, stats in report["webdriver_commands"]["by_command"].items()])
+        metric("failed_lookups_total", "Failed element lookups.", "counter",
+               [({"xpath": xpath}, count) for xpath, count in report["failed_lookups"].items()])
+
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, path)
+
+    def print_summary(self, top=5):
+        """
+        Prints where the time went: the slowest phases, the most used WebDriver commands
+        and the XPaths that failed most often.
+
+        Args:
+            top (int): How many entries of each list to print.
+        """
+        report = self.report()
+        print(f"\nScraped {report['messages']} messages from {report['chats']} chats in "
+              f"{report['run_seconds']:.1f}s ({report['messages_per_second']:.1f} messages/s, "
+              f"{report['webdriver_commands']['total']} WebDriver commands).")
+        if report["peak_rss_bytes"]:
+            recycles = sum(report["recycles"].values())
+            print(f"  Chrome peaked at {report['peak_rss_bytes'] / 2**20:.0f} MB and was "
+                  f"recycled {recycles} times.")
+
+        for name, phase in list(report["phases"].items())[:top]:
+            print(f"  phase {name:<16}{phase['seconds']:>10.1f}s  x{phase['count']}")
+        for command, stats in list(report["webdriver_commands"]["by_command"].items())[:top]:
+            print(f"  command {command:<26}{stats['count']:>8}  {stats['seconds']:.1f}s")
+        for xpath, count in list(report["failed_lookups"].items())[:top]:
+            print(f"  failed lookup x{count:<7} {xpath}")
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def instrument_driver(driver, metrics=None):
+    """
+    Counts and times every WebDriver command the driver sends. Every Selenium call
+    (find_element, get_attribute, execute_script, ...) is one command, i.e. one HTTP
+    round trip to chromedriver.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance to instrument.
+        metrics (RunMetrics): Where to record; the module's current instance if None.
+    """
+    execute = driver.command_executor.execute
+
+    def timed_execute(command, params):
+        started = time.perf_counter()
+        try:
+            return execute(command, params)
+        finally:
+            (metrics or current).count_command(command, time.perf_counter() - started)
+
+    driver.command_executor.execute = timed_execute
+
+
+current = RunMetrics()
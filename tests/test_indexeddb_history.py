@@ -0,0 +1,43 @@
+"""
+test_indexeddb_history.py
+
+Description: Checks when the recent part of a chat kept in WhatsApp Web's local storage
+is enough for a scrape, so the "indexeddb" extraction never silently drops older history.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import incremental_state
+import message_store
+import whatsapp_message_scraper as scraper
+
+
+# The last three messages of a longer chat, as read from local storage
+IDS = ["false_1@c.us_A", "true_1@c.us_B", "false_1@c.us_C"]
+MESSAGES = [
+    [None, None, False, "[09:00, 01/03/2024] Bob: ", "morning", False, False, False],
+    [None, None, False, "[09:05, 02/03/2024] You: ", "hi", False, False, False],
+    [None, None, False, "[10:00, 03/03/2024] Bob: ", "ok", False, False, False],
+]
+
+
+def test_partial_history_is_not_enough_for_a_full_scrape():
+    assert not scraper.stored_history_suffices(IDS, MESSAGES, None, scraper.ScrapeOptions())
+
+
+def test_partial_history_holding_the_mark_is_enough():
+    mark = incremental_state.make_mark(IDS[:2], MESSAGES[:2])
+    assert scraper.stored_history_suffices(IDS, MESSAGES, mark, scraper.ScrapeOptions())
+
+
+def test_partial_history_covering_the_window_is_enough():
+    inside = scraper.ScrapeOptions(since=message_store.parse_date("2024-03-02"))
+    reaching_back = scraper.ScrapeOptions(since=message_store.parse_date("2024-03-01"))
+    newest = scraper.ScrapeOptions(max_messages=2)
+
+    assert scraper.stored_history_suffices(IDS, MESSAGES, None, inside)
+    assert not scraper.stored_history_suffices(IDS, MESSAGES, None, reaching_back)
+    assert scraper.stored_history_suffices(IDS, MESSAGES, None, newest)
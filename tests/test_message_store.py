@@ -0,0 +1,84 @@
+"""
+test_message_store.py
+
+Description: Checks that the SQLite archive keeps exactly one row per message however a
+chat is scraped: incremental, full and bounded runs over the same chat must not lose or
+duplicate messages.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import message_records
+from message_store import MessageStore
+
+
+# (data-id, 8-field message) of one chat, oldest first. The first and third messages
+# show the same text in the same minute, and the last is a media message without a date.
+CHAT = [
+    ("true_1@c.us_A", [None, None, False, "[10:00, 01/03/2024] Bob: ", "ok",
+                       False, False, False]),
+    ("true_1@c.us_B", [None, None, False, "[10:00, 01/03/2024] Bob: ", "on my way",
+                       False, False, False]),
+    ("true_1@c.us_C", [None, None, False, "[10:00, 01/03/2024] Bob: ", "ok",
+                       False, False, False]),
+    ("true_1@c.us_D", [None, None, False, "[10:01, None] Bob:", None,
+                       True, False, False]),
+]
+
+
+def scraped(first, last):
+    """Returns the records scrape_chat yields for CHAT[first:last] with keep_ids."""
+    window = CHAT[first:last]
+    records = message_records.from_lists([message for _, message in window])
+    for record, (message_id, _) in zip(records, window):
+        record.message_id = message_id
+    return records
+
+
+def count_rows(store):
+    return store._connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+def test_rows_are_stable_across_incremental_full_and_bounded_runs(tmp_path):
+    with MessageStore(str(tmp_path / "messages.sqlite")) as store:
+        # First incremental run, then one that only sees the newer messages
+        store.write_chat("Bob", scraped(0, 2))
+        store.write_chat("Bob", scraped(2, 4))
+        assert count_rows(store) == 4
+
+        # A full run renumbers nothing
+        store.write_chat("Bob", scraped(0, 4))
+        assert count_rows(store) == 4
+
+        # A bounded run starting at the media message cannot date it
+        bounded = scraped(3, 4)
+        assert bounded[0].timestamp is None
+        store.write_chat("Bob", bounded)
+        assert count_rows(store) == 4
+
+        [(_, messages)] = store.query(chat="Bob")
+        assert [message.text for message in messages] == ["ok", "on my way", "ok", None]
+
+
+def test_messages_without_id_are_keyed_by_content(tmp_path):
+    records = message_records.from_lists([message for _, message in CHAT[:2]])
+
+    with MessageStore(str(tmp_path / "messages.sqlite")) as store:
+        store.write_chat("Bob", records)
+        store.write_chat("Bob", records)
+        assert count_rows(store) == 2
+
+
+def test_identical_messages_without_id_are_all_kept(tmp_path):
+    # Two "ok"s in the same minute, around a different message
+    records = message_records.from_lists([message for _, message in CHAT[:3]])
+
+    with MessageStore(str(tmp_path / "messages.sqlite")) as store:
+        store.write_chat("Bob", records)
+        assert count_rows(store) == 3
+
+        store.write_chat("Bob", records)
+        assert count_rows(store) == 3
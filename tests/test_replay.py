@@ -0,0 +1,65 @@
+"""
+test_replay.py
+
+Description: Replays a small WebDriver trace at zero latency on the virtual clock of
+webdriver_trace.py, with a chat that is still syncing and has to be set aside. The
+scheduler's backoff must pass in virtual time instead of hanging the replay.
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from selenium.webdriver.remote.command import Command
+
+import webdriver_trace
+import whatsapp_message_scraper as scraper
+
+
+SESSION_ID = "replayed-session"
+
+
+def write_trace(path, titles):
+    """Writes a trace in which the page title is read once per entry of titles."""
+    recorder = webdriver_trace.TraceRecorder(path, SESSION_ID, {"browserName": "chrome"})
+    for title in titles:
+        recorder.record(Command.GET_TITLE, {"sessionId": SESSION_ID}, {"value": title}, 0.5)
+    recorder.close()
+
+
+def scrape_chat_from_title(contact, driver, options=None, state=None, handle=None,
+                           defer_sync=False):
+    """Stands in for scrape_chat: the page title tells whether the chat is still syncing."""
+    if driver.title == "syncing" and defer_sync:
+        return None
+    return []
+
+
+def test_zero_latency_replay_retries_a_deferred_chat(tmp_path, monkeypatch):
+    trace_path = str(tmp_path / "trace.jsonl")
+    # Alice is still syncing at first, Bob is not, and Alice is done on her retry
+    write_trace(trace_path, ["syncing", "ready", "ready"])
+    monkeypatch.setattr(scraper, "scrape_chat", scrape_chat_from_title)
+
+    clock = webdriver_trace.VirtualClock()
+    driver = webdriver_trace.replay_driver(trace_path, latency="zero", clock=clock)
+    scraped = []
+
+    def run():
+        with clock.installed():
+            started = clock.monotonic()
+            for contact, _ in scraper.iter_chat_messages(["Alice", "Bob"], driver):
+                scraped.append(contact)
+            scraped.append(clock.monotonic() - started)
+
+    replay = threading.Thread(target=run, daemon=True)
+    replay.start()
+    replay.join(timeout=10)
+
+    assert not replay.is_alive(), "the replay hung waiting for the deferred chat"
+    *contacts, elapsed = scraped
+    assert contacts == ["Bob", "Alice"]
+    assert elapsed >= scraper.SYNC_RETRY_DELAY
+    assert driver.command_executor.stats["matched"] == 3
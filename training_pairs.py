@@ -0,0 +1,539 @@
+"""
+training_pairs.py
+
+Description: Turns a scraper export into (context, reply) training examples for a model
+of your messaging style. The export is streamed chat by chat, so memory stays at a few
+chats however many messages it holds, and the chats are processed on a pool of worker
+processes. For every chat:
+
+    - message_information is parsed into sender and time (see message_records.py)
+    - consecutive messages of one sender are merged into turns, unless they are more
+      than --turn-gap minutes apart
+    - every turn of yours that answers someone else becomes the reply of a pair. Its
+      context is the turns before it, or, if it quotes a message from further back (the
+      reply fields), the turns leading up to the quoted message. Context never reaches
+      across a silence of more than --session-gap hours.
+
+Each pair is written as one JSON line:
+    {"chat", "timestamp", "context": [{"sender", "from_me", "text"}, ...],
+     "quoted": {"sender", "from_me", "text"} or null, "reply"}
+
+All three output formats of the scraper can be read (json, jsonl and records), also
+when gzip- or zstd-compressed.
+
+Usage:
+    python training_pairs.py whatsapp_messages.json -o pairs.jsonl [--me "Your Name"]
+"""
+
+import argparse
+import gzip
+import io
+import json
+import multiprocessing
+import os
+from collections import Counter, deque
+
+import message_records
+
+
+DEFAULT_OUTPUT_PATH = "training_pairs.jsonl"
+
+# Turns of context per pair, and the gaps that split turns and conversations
+DEFAULT_CONTEXT_TURNS = 6
+DEFAULT_TURN_GAP_MINUTES = 10
+DEFAULT_SESSION_GAP_HOURS = 6
+
+# Characters read from the export at a time while streaming a JSON array
+READ_CHUNK_SIZE = 1 << 20
+
+# Chats handed to the pool ahead of the one being written, per worker
+CHATS_IN_FLIGHT_PER_WORKER = 4
+
+# Text that stands in for media without a caption
+MEDIA_PLACEHOLDERS = {"image": "<image>", "video": "<video>", "sticker": "<sticker>"}
+
+# How WhatsApp Web names your own messages when they are quoted
+QUOTED_SELF_NAME = "You"
+
+
+def open_text(path):
+    """
+    Opens an export for reading as text, decompressing .gz and .zst files.
+
+    Args:
+        path (str): The export file.
+
+    Returns:
+        file: A text stream.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Reading .zst files requires the zstandard package "
+                               "(pip install zstandard).")
+        raw = open(path, "rb")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True),
+                                encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def iter_json_array(stream):
+    """
+    Yields the elements of a top-level JSON array one at a time, without reading the
+    whole array into memory.
+
+    Args:
+        stream (file): A text stream positioned before the array.
+
+    Yields:
+        object: Every element of the array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    while True:
+        more = stream.read(READ_CHUNK_SIZE)
+        buffer = (buffer + more).lstrip()
+        if buffer or not more:
+            break
+    if not buffer.startswith("["):
+        raise ValueError("The export is not a JSON array.")
+    position = 1
+    chunk_size = READ_CHUNK_SIZE
+    at_end = False
+
+    while True:
+        # Skip whitespace and the comma between elements
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) or at_end:
+                break
+            buffer, position = stream.read(chunk_size), 0
+            at_end = not buffer
+
+        if position >= len(buffer) or buffer[position] == "]":
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if at_end:
+                raise
+            # The element goes on past the buffer; read a bigger piece of it
+            more = stream.read(chunk_size)
+            at_end = not more
+            buffer = buffer[position:] + more
+            position = 0
+            chunk_size *= 2
+            continue
+
+        yield element
+        buffer, position = buffer[end:], 0
+        chunk_size = READ_CHUNK_SIZE
+
+
+def iter_export_chats(path):
+    """
+    Streams an export chat by chat, whatever its format.
+
+    Args:
+        path (str): The export: a nested JSON list ("json"), or JSON lines in the
+                    "jsonl" or "records" format.
+
+    Yields:
+        tuple: (chat name, or its index in a nested list without names, format of the
+                messages: "lists" or "records", the chat's messages)
+    """
+    with open_text(path) as stream:
+        first = stream.read(1)
+        while first.isspace():
+            first = stream.read(1)
+
+        if first == "[":
+            stream = _Prepend(first, stream)
+            for index, messages in enumerate(iter_json_array(stream)):
+                yield index, "lists", messages
+            return
+
+        chat, kind, messages = None, None, []
+        for line in _Prepend(first, stream):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["chat"] != chat and messages:
+                yield chat, kind, messages
+                messages = []
+            chat = record["chat"]
+            if "message" in record:
+                kind = "lists"
+                messages.append(record["message"])
+            else:
+                kind = "records"
+                messages.append(record)
+        if messages:
+            yield chat, kind, messages
+
+
+class _Prepend:
+    """
+    A text stream with some already consumed text put back in front of it.
+    """
+
+    def __init__(self, text, stream):
+        self._text = text
+        self._stream = stream
+
+    def read(self, size=-1):
+        text, self._text = self._text, ""
+        if size is None or size < 0:
+            return text + self._stream.read()
+        return text + self._stream.read(max(0, size - len(text)))
+
+    def __iter__(self):
+        first_line = self._text + self._stream.readline()
+        self._text = ""
+        if first_line:
+            yield first_line
+        yield from self._stream
+
+
+def normalise_messages(kind, messages):
+    """
+    Brings the messages of a chat into one form, whatever the export format.
+
+    Args:
+        kind (str): "lists" for 8-field lists, "records" for records-format objects.
+        messages (list): The chat's messages, oldest first.
+
+    Returns:
+        list: (timestamp or None, sender or None, text or None, reply_sender,
+               reply_text) tuples; media without a caption gets a placeholder text.
+    """
+    normalised = []
+
+    if kind == "lists":
+        for record in message_records.from_lists(messages):
+            normalised.append((record.timestamp, record.sender,
+                               _text_or_media(record.text, record.image, record.video,
+                                              record.sticker),
+                               record.reply_sender, record.reply_text))
+    else:
+        for message in messages:
+            normalised.append((message.get("timestamp"), message.get("sender"),
+                               _text_or_media(message.get("text"), message.get("image"),
+                                              message.get("video"), message.get("sticker")),
+                               message.get("reply_sender"), message.get("reply_text")))
+
+    return normalised
+
+
+def _text_or_media(text, image, video, sticker):
+    if text:
+        return text
+    if image:
+        return MEDIA_PLACEHOLDERS["image"]
+    if video:
+        return MEDIA_PLACEHOLDERS["video"]
+    if sticker:
+        return MEDIA_PLACEHOLDERS["sticker"]
+    return None
+
+
+def build_turns(messages, turn_gap):
+    """
+    Merges consecutive messages of one sender into turns.
+
+    Args:
+        messages (list): The chat's messages, see normalise_messages.
+        turn_gap (float): Seconds of silence after which the same sender starts a new turn.
+
+    Returns:
+        list: Turns as dicts {"sender", "start", "end", "texts", "quotes"}, where quotes
+              holds the (reply_sender, reply_text) of the turn's replies.
+    """
+    turns = []
+
+    for timestamp, sender, text, reply_sender, reply_text in messages:
+        if sender is None or text is None:
+            continue
+
+        previous = turns[-1] if turns else None
+        same_turn = (
+            previous is not None and previous["sender"] == sender
+            and (timestamp is None or previous["end"] is None
+                 or timestamp - previous["end"] <= turn_gap)
+        )
+        if not same_turn:
+            previous = {"sender": sender, "start": timestamp, "end": timestamp,
+                        "texts": [], "quotes": []}
+            turns.append(previous)
+
+        previous["texts"].append(text)
+        if timestamp is not None:
+            previous["end"] = timestamp
+        if reply_text:
+            previous["quotes"].append((reply_sender, reply_text))
+
+    return turns
+
+
+def find_quoted_turn(turns, index, quote, me):
+    """
+    Finds the earlier turn that holds a quoted message.
+
+    Args:
+        turns (list): The chat's turns.
+        index (int): The turn that quotes it.
+        quote (tuple): (reply_sender, reply_text) as scraped. WhatsApp shows only the
+                       start of long quoted messages.
+        me (str): Your sender name.
+
+    Returns:
+        int or None: The index of the quoted turn, or None if it is not found.
+    """
+    reply_sender, reply_text = quote
+    sender = me if reply_sender == QUOTED_SELF_NAME else reply_sender
+    quoted = reply_text.rstrip(". …")
+
+    for candidate in range(index - 1, -1, -1):
+        turn = turns[candidate]
+        if sender is not None and turn["sender"] != sender:
+            continue
+        if any(text.startswith(quoted) for text in turn["texts"]):
+            return candidate
+    return None
+
+
+def _context_before(turns, end, context_turns, session_gap):
+    """
+    Returns the turns up to and including turns[end], at most context_turns of them and
+    none from before a silence longer than session_gap.
+    """
+    start = end
+    while start > 0 and end - start + 1 < context_turns:
+        before, after = turns[start - 1], turns[start]
+        if (before["end"] is not None and after["start"] is not None
+                and after["start"] - before["end"] > session_gap):
+            break
+        start -= 1
+    return turns[start:end + 1]
+
+
+def _is_within_session(earlier, later, session_gap):
+    return (earlier["end"] is None or later["start"] is None
+            or later["start"] - earlier["end"] <= session_gap)
+
+
+def build_pairs(chat, turns, me, context_turns, session_gap):
+    """
+    Makes a training pair of every turn of yours that follows someone else's turn.
+
+    Args:
+        chat (str or int): The chat's name or index.
+        turns (list): The chat's turns, see build_turns.
+        me (str): Your sender name.
+        context_turns (int): The most turns of context per pair.
+        session_gap (float): Seconds of silence that end a conversation.
+
+    Returns:
+        list: The pairs as dicts.
+    """
+    def shown(turn):
+        return {"sender": turn["sender"], "from_me": turn["sender"] == me,
+                "text": "\n".join(turn["texts"])}
+
+    pairs = []
+    for index, turn in enumerate(turns):
+        if turn["sender"] != me or index == 0:
+            continue
+
+        quoted = None
+        anchor = index - 1
+        if turn["quotes"]:
+            quoted_index = find_quoted_turn(turns, index, turn["quotes"][0], me)
+            if quoted_index is not None:
+                quoted = quoted_index
+                # A quote from further back than the usual context moves the context there
+                if quoted_index < index - context_turns:
+                    anchor = quoted_index
+
+        if quoted is None and (turns[anchor]["sender"] == me
+                               or not _is_within_session(turns[anchor], turn, session_gap)):
+            continue
+        context = _context_before(turns, anchor, context_turns, session_gap)
+        if all(previous["sender"] == me for previous in context):
+            continue
+
+        quote = None
+        if quoted is not None:
+            quote = {"sender": turns[quoted]["sender"], "from_me": turns[quoted]["sender"] == me,
+                     "text": turn["quotes"][0][1]}
+
+        pairs.append({
+            "chat": chat,
+            "timestamp": turn["start"],
+            "context": [shown(previous) for previous in context],
+            "quoted": quote,
+            "reply": "\n".join(turn["texts"]),
+        })
+
+    return pairs
+
+
+def chat_senders(task):
+    """
+    Returns the senders of one chat. Runs in a worker process.
+
+    Args:
+        task (tuple): (chat, kind, messages), see iter_export_chats.
+
+    Returns:
+        set: The sender names.
+    """
+    _, kind, messages = task
+    return {sender for _, sender, _, _, _ in normalise_messages(kind, messages)
+            if sender is not None}
+
+
+def chat_pairs(task):
+    """
+    Builds the training pairs of one chat. Runs in a worker process.
+
+    Args:
+        task (tuple): (chat, kind, messages, settings), where settings holds "me",
+                      "context_turns", "turn_gap" and "session_gap".
+
+    Returns:
+        list: One JSON line per pair.
+    """
+    chat, kind, messages, settings = task
+    turns = build_turns(normalise_messages(kind, messages), settings["turn_gap"])
+    pairs = build_pairs(chat, turns, settings["me"], settings["context_turns"],
+                        settings["session_gap"])
+    return [json.dumps(pair, ensure_ascii=False) for pair in pairs]
+
+
+def bounded_imap(pool, function, tasks, in_flight):
+    """
+    Like pool.imap, but reads at most in_flight tasks ahead of the results, so a large
+    export is never queued up in memory.
+
+    Args:
+        pool (multiprocessing.Pool): The worker pool.
+        function (callable): The function to run on every task.
+        tasks (iterable): The tasks, read lazily.
+        in_flight (int): The most tasks submitted but not yet returned.
+
+    Yields:
+        object: The results, in the order of the tasks.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def find_own_name(path, pool, in_flight):
+    """
+    Guesses your sender name: every private chat is between you and one contact, so it
+    is the sender found in the most chats.
+
+    Args:
+        path (str): The export.
+        pool (multiprocessing.Pool): The worker pool.
+        in_flight (int): See bounded_imap.
+
+    Returns:
+        str or None: The name, or None if the export has no senders.
+    """
+    chats_per_sender = Counter()
+    for senders in bounded_imap(pool, chat_senders, iter_export_chats(path), in_flight):
+        chats_per_sender.update(senders)
+
+    if not chats_per_sender:
+        return None
+    return chats_per_sender.most_common(1)[0][0]
+
+
+def write_pairs(path, output_path, me=None, workers=None, context_turns=DEFAULT_CONTEXT_TURNS,
+                turn_gap=DEFAULT_TURN_GAP_MINUTES * 60,
+                session_gap=DEFAULT_SESSION_GAP_HOURS * 3600):
+    """
+    Converts an export into training pairs.
+
+    Args:
+        path (str): The export.
+        output_path (str): The JSON lines file to write the pairs to; .gz compresses it.
+        me (str): Your sender name; guessed from the export if None.
+        workers (int): Worker processes; one per CPU if None.
+        context_turns (int): The most turns of context per pair.
+        turn_gap (float): Seconds after which the same sender starts a new turn.
+        session_gap (float): Seconds of silence that end a conversation.
+
+    Returns:
+        tuple: (chats read, pairs written)
+    """
+    workers = workers or os.cpu_count() or 1
+    in_flight = workers * CHATS_IN_FLIGHT_PER_WORKER
+    chats = pairs = 0
+
+    with multiprocessing.Pool(workers) as pool:
+        if me is None:
+            me = find_own_name(path, pool, in_flight)
+            print(f"Taking '{me}' as your name; set it with --me if that is wrong.")
+
+        settings = {"me": me, "context_turns": context_turns, "turn_gap": turn_gap,
+                    "session_gap": session_gap}
+        tasks = ((chat, kind, messages, settings)
+                 for chat, kind, messages in iter_export_chats(path))
+
+        opener = gzip.open if output_path.endswith(".gz") else open
+        with opener(output_path, "wt", encoding="utf-8") as output:
+            for lines in bounded_imap(pool, chat_pairs, tasks, in_flight):
+                chats += 1
+                pairs += len(lines)
+                if lines:
+                    output.write("\n".join(lines) + "\n")
+
+    return chats, pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Turn a scraper export into (context, reply) training pairs."
+    )
+    parser.add_argument("export", help="The export: json, jsonl or records, optionally .gz/.zst.")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT_PATH,
+                        help=f"Where to write the pairs (default: {DEFAULT_OUTPUT_PATH}).")
+    parser.add_argument("--me", default=None,
+                        help="Your sender name (default: the sender found in the most chats).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes (default: one per CPU).")
+    parser.add_argument("--context-turns", type=int, default=DEFAULT_CONTEXT_TURNS,
+                        help=f"Turns of context per pair (default: {DEFAULT_CONTEXT_TURNS}).")
+    parser.add_argument("--turn-gap", type=float, default=DEFAULT_TURN_GAP_MINUTES,
+                        metavar="MINUTES",
+                        help="Minutes after which the same sender starts a new turn "
+                             f"(default: {DEFAULT_TURN_GAP_MINUTES}).")
+    parser.add_argument("--session-gap", type=float, default=DEFAULT_SESSION_GAP_HOURS,
+                        metavar="HOURS",
+                        help="Hours of silence after which earlier turns are no longer "
+                             f"context (default: {DEFAULT_SESSION_GAP_HOURS}).")
+    args = parser.parse_args()
+
+    chats, pairs = write_pairs(
+        args.export, args.output, me=args.me, workers=args.workers,
+        context_turns=args.context_turns, turn_gap=args.turn_gap * 60,
+        session_gap=args.session_gap * 3600
+    )
+    print(f"Wrote {pairs} training pairs from {chats} chats to {args.output}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""
+webdriver_trace.py
+
+Description: Records every WebDriver command a scraper run sends (find_element,
+execute_script, get_attribute, clicks, ...) together with chromedriver's responses and
+timings, and replays such a trace without a browser. Slow runs on a real account can
+then be reproduced exactly and the scraper's own logic profiled offline.
+
+A trace is a JSON lines file:
+    {"type": "session", "session_id": ..., "capabilities": ...}
+    {"type": "script", "sha1": ..., "source": ...}       (once per distinct script)
+    {"type": "command", "command": ..., "params": ..., "response": ..., "seconds": ...}
+
+Replay serves the recorded responses in order. It either waits the recorded time of
+every command ("recorded" latency) or runs at zero latency on a virtual clock, so the
+scraper's waits and timeouts behave as they did while recording and only the Python
+side of the run is measured.
+
+Usage:
+    python whatsapp_message_scraper.py --record-trace trace.jsonl ...
+    python webdriver_trace.py trace.jsonl [--latency zero] [--profile replay.prof] -- ...
+"""
+
+import argparse
+import copy
+import cProfile
+import hashlib
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.webdriver import WebDriver
+
+
+# How many recorded commands replay may skip to find the one the scraper asked for
+REPLAY_LOOKAHEAD = 50
+
+
+def trace_path_for_worker(path, worker_id):
+    """
+    Returns the trace file of a browser. The main browser (worker 1) records to the path
+    itself, worker N to "<name>.workerN<ext>".
+
+    Args:
+        path (str): The trace path given on the command line.
+        worker_id (int): The number of the browser, starting at 1.
+
+    Returns:
+        str: The trace file of that browser.
+    """
+    if worker_id == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{worker_id}{ext}"
+
+
+def _script_sha1(script):
+    return hashlib.sha1(script.encode("utf-8")).hexdigest()
+
+
+def _stored_params(params, scripts=None):
+    """
+    Returns the params as stored in a trace: scripts are replaced by their SHA-1, so
+    every distinct script is written once and commands compare cheaply.
+
+    Args:
+        params (dict or None): The params of a WebDriver command.
+        scripts (dict): If given, receives {sha1: source} for the replaced scripts.
+
+    Returns:
+        dict or None: The params to store.
+    """
+    if not params or "script" not in params:
+        return params
+
+    stored = dict(params)
+    sha1 = _script_sha1(params["script"])
+    if scripts is not None:
+        scripts[sha1] = params["script"]
+    stored["script"] = {"sha1": sha1}
+    return stored
+
+
+def _command_key(command, params):
+    return command, json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+
+class TraceRecorder:
+    """
+    Writes the commands of one WebDriver session to a trace file.
+    """
+
+    def __init__(self, path, session_id, capabilities):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8", buffering=1)
+        self._scripts = set()
+        self._lock = threading.Lock()
+        self._write({"type": "session", "session_id": session_id, "capabilities": capabilities})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def record(self, command, params, response, seconds, error=None):
+        """
+        Appends one command to the trace.
+
+        Args:
+            command (str): The WebDriver command, e.g. "findElement".
+            params (dict): Its params, with elements already replaced by references.
+            response (dict): chromedriver's response, before Selenium unwraps it.
+            seconds (float): How long the round trip took.
+            error (str): The exception raised instead of a response, if any.
+        """
+        scripts = {}
+        stored = _stored_params(params, scripts)
+        record = {"type": "command", "command": command, "params": stored,
+                  "response": response, "seconds": seconds}
+        if error is not None:
+            record["error"] = error
+
+        # Serialised straight away: Selenium unwraps the response in place afterwards
+        with self._lock:
+            if self._file.closed:
+                return
+            for sha1, source in scripts.items():
+                if sha1 not in self._scripts:
+                    self._scripts.add(sha1)
+                    self._write({"type": "script", "sha1": sha1, "source": source})
+            self._write(record)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def record_driver(driver, path):
+    """
+    Records every command the driver sends from now on to a trace file. The file is
+    closed when the driver quits.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance to record.
+        path (str): The trace file to write.
+
+    Returns:
+        TraceRecorder: The recorder.
+    """
+    recorder = TraceRecorder(path, driver.session_id, driver.capabilities)
+    execute = driver.command_executor.execute
+
+    def recording_execute(command, params):
+        started = time.perf_counter()
+        try:
+            response = execute(command, params)
+        except Exception as e:
+            recorder.record(command, params, None, time.perf_counter() - started, error=repr(e))
+            raise
+        recorder.record(command, params, response, time.perf_counter() - started)
+        if command == Command.QUIT:
+            recorder.close()
+        return response
+
+    driver.command_executor.execute = recording_execute
+    return recorder
+
+
+def load_trace(path):
+    """
+    Reads a trace file.
+
+    Args:
+        path (str): The trace file.
+
+    Returns:
+        tuple: (the session record, the list of command records)
+    """
+    session = None
+    scripts = {}
+    commands = []
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["type"] == "session":
+                session = record
+            elif record["type"] == "script":
+                scripts[record["sha1"]] = record["source"]
+            else:
+                record["key"] = _command_key(record["command"], record["params"])
+                commands.append(record)
+
+    if session is None:
+        raise ValueError(f"{path} is not a WebDriver trace (no session record).")
+
+    return session, commands
+
+
+class VirtualClock:
+    """
+    A clock that only moves when someone sleeps or a replayed command "takes" time.
+    While installed it replaces time.monotonic and time.sleep, so WebDriverWait and the
+    scraper's other timeouts expire after the same number of polls as while recording,
+    without actually waiting.
+    """
+
+    def __init__(self):
+        self._now = time.monotonic()
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self._now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self._now += max(0, seconds)
+
+    advance = sleep
+
+    @contextmanager
+    def installed(self):
+        real_monotonic, real_sleep = time.monotonic, time.sleep
+        time.monotonic, time.sleep = self.monotonic, self.sleep
+        try:
+            yield self
+        finally:
+            time.monotonic, time.sleep = real_monotonic, real_sleep
+
+
+class ReplayCommandExecutor:
+    """
+    Stands in for Selenium's RemoteConnection and answers commands from a trace.
+
+    Commands are matched in order on their name and params. If the scraper asks for
+    something else than the next recorded command, e.g. because a wait polled fewer
+    times, up to REPLAY_LOOKAHEAD recorded commands are skipped to find it; if it polls
+    more often, the last response is served again.
+    """
+
+    def __init__(self, path, latency="recorded", clock=None):
+        self.path = path
+        self.session, self.commands = load_trace(path)
+        self.latency = latency
+        self.clock = clock
+        self.position = 0
+        self.stats = Counter()
+        self._last = None
+
+    def _find(self, key):
+        end = min(len(self.commands), self.position + REPLAY_LOOKAHEAD + 1)
+        for index in range(self.position, end):
+            if self.commands[index]["key"] == key:
+                return index
+        return None
+
+    def execute(self, command, params):
+        if command == Command.NEW_SESSION:
+            return {"value": {"sessionId": self.session["session_id"],
+                              "capabilities": self.session["capabilities"]}}
+
+        key = _command_key(command, _stored_params(params))
+        index = self._find(key)
+
+        if index is not None:
+            self.stats["skipped"] += index - self.position
+            self.stats["matched"] += 1
+            self.position = index + 1
+            record = self.commands[index]
+        elif self._last is not None and self._last["key"] == key:
+            self.stats["repeated"] += 1
+            record = self._last
+        elif command == Command.QUIT:
+            return {"value": None}
+        else:
+            raise WebDriverException(
+                f"Replay of {self.path} diverged at recorded command {self.position}: "
+                f"the scraper sent {command} {key[1][:200]}"
+            )
+
+        self._last = record
+        if self.latency == "recorded":
+            time.sleep(record["seconds"])
+        elif self.clock is not None:
+            self.clock.advance(record["seconds"])
+
+        if "error" in record:
+            raise WebDriverException(f"Recorded error: {record['error']}")
+
+        return copy.deepcopy(record["response"])
+
+    def close(self):
+        pass
+
+
+def replay_driver(path, latency="recorded", clock=None):
+    """
+    Creates a WebDriver that answers every command from a trace, without a browser.
+
+    Args:
+        path (str): The trace file.
+        latency (str): "recorded" to take as long as every command took while recording,
+                       "zero" to answer straight away.
+        clock (VirtualClock): With zero latency, the clock to advance by each command's
+                              recorded time.
+
+    Returns:
+        WebDriver: The replaying driver.
+    """
+    executor = ReplayCommandExecutor(path, latency=latency, clock=clock)
+    return WebDriver(command_executor=executor, options=Options())
+
+
+def replay_run(trace_path, scraper_args, latency="recorded"):
+    """
+    Runs the scraper's main() with every browser replaced by a replay of its trace.
+
+    Args:
+        trace_path (str): The trace of the main browser; workers' traces are found with
+                          trace_path_for_worker.
+        scraper_args (list): The command line options the scraper was recorded with.
+        latency (str): "recorded" or "zero".
+
+    Returns:
+        list: The replay executor of every browser, to report on.
+    """
+    import whatsapp_message_scraper as scraper
+
+    clock = VirtualClock() if latency == "zero" else None
+    executors = []
+
+    def create_replay_driver(*args, **kwargs):
+        path = trace_path_for_worker(trace_path, len(executors) + 1)
+        driver = replay_driver(path, latency=latency, clock=clock)
+        executors.append(driver.command_executor)
+        return driver
+
+    scraper.create_driver = create_replay_driver
+    sys.argv = ["whatsapp_message_scraper.py", *scraper_args]
+
+    if clock is not None:
+        with clock.installed():
+            scraper.main()
+    else:
+        scraper.main()
+
+    return executors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded WebDriver trace through the scraper without a browser."
+    )
+    parser.add_argument("trace", help="The trace recorded with --record-trace.")
+    parser.add_argument(
+        "--latency", choices=["recorded", "zero"], default="recorded",
+        help="'recorded' reproduces the time every command took; 'zero' answers straight "
+             "away on a virtual clock to isolate the scraper's Python overhead."
+    )
+    parser.add_argument("--profile", metavar="PATH", default=None,
+                        help="Profile the replay with cProfile and save the stats to PATH.")
+    parser.add_argument("--top", type=int, default=25,
+                        help="Number of functions to print from the profile.")
+    parser.add_argument("scraper_args", nargs=argparse.REMAINDER,
+                        help="The scraper options used while recording, after '--'.")
+    args = parser.parse_args()
+
+    scraper_args = args.scraper_args
+    if scraper_args[:1] == ["--"]:
+        scraper_args = scraper_args[1:]
+    # The recording option would overwrite the trace being replayed
+    if "--record-trace" in scraper_args:
+        index = scraper_args.index("--record-trace")
+        del scraper_args[index:index + 2]
+
+    profiler = cProfile.Profile() if args.profile is not None else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        executors = replay_run(args.trace, scraper_args, latency=args.latency)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+
+    for executor in executors:
+        stats = executor.stats
+        print(f"Replayed {executor.path}: {stats['matched']} of {len(executor.commands)} "
+              f"commands matched, {stats['skipped']} skipped, {stats['repeated']} repeated.")
+
+    if profiler is not None:
+        pstats.Stats(args.profile).sort_stats("cumulative").print_stats(args.top)
+
+
+if __name__ == '__main__':
+    main()
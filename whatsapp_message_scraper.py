@@ -9,6 +9,7 @@ chats, scrolls through message history, and exports messages to a JSON file for
 Dependencies:
     - selenium
     - numpy
+    - lxml
     - json
     - re
     - time
@@ -28,8 +29,28 @@ from datetime import datetime
 from selenium.common.exceptions import StaleElementReferenceException
 import re
 import numpy as np
-import json
-from selenium.common.exceptions import TimeoutException
+import argparse
+from dataclasses import dataclass
+from selenium.common.exceptions import TimeoutException, WebDriverException
+import os
+import sys
+import hashlib
+import heapq
+import queue
+import threading
+from collections import deque
+import whatsapp_selectors as sel
+import html_snapshot_parser
+from message_writers import WRITERS, open_writer
+import incremental_state
+import message_records
+import page_waits
+import scrape_metrics
+import webdriver_trace
+import browser_memory
+import contact_directory
+import media_pipeline
+import message_store
 
 
 STARTING_MESSAGE = """Hello!! I'm a scraper that uses Selenium to save your messages.
@@ -38,6 +59,612 @@ This scraper will find all the chats you have with your contacts and then save t
 No group messages will be saved, as the purpose of this scraper is to archive personal conversations.
 """
 
+WHATSAPP_URL = "https://web.whatsapp.com"
+
+# Seconds to wait for WhatsApp Web to show either the chat list or the QR code
+LOGIN_CHECK_TIMEOUT = 60
+
+# Seconds the user has to scan the QR code, and how often it is re-saved when headless
+QR_CODE_TIMEOUT = 120
+QR_SCREENSHOT_INTERVAL = 5
+
+# Window size used when running headless
+DEFAULT_WINDOW_SIZE = "1920,1080"
+
+# Number of message rows parsed per execute_script call in the "script" extraction mode
+SCRIPT_BATCH_SIZE = 500
+
+# A chat that is still syncing is parked and retried after SYNC_RETRY_DELAY seconds,
+# doubling per retry up to SYNC_RETRY_MAX_DELAY. After DEFAULT_SYNC_RETRIES retries it is
+# scraped waiting for the sync to finish.
+SYNC_RETRY_DELAY = 30
+SYNC_RETRY_MAX_DELAY = 300
+DEFAULT_SYNC_RETRIES = 5
+# While only parked chats are left, the scheduler sleeps in steps of this many seconds
+SYNC_RETRY_POLL_INTERVAL = 1
+
+# Banners WhatsApp shows at the top of a chat while it cannot load older messages
+SYNCING_BANNER = "Syncing older messages. Click to see progress."
+LOAD_OLDER_BANNER = "Click here to get older messages from your phone."
+END_OF_HISTORY_BANNER = "Use WhatsApp on your phone to see older messages."
+
+# The wait for older messages after jumping to the top of a chat is
+# SCROLL_TIMEOUT_FACTOR times the average time loads have taken, between
+# SCROLL_MIN_TIMEOUT and SCROLL_MAX_TIMEOUT seconds. Without the end-of-history banner,
+# the top is assumed after SCROLL_STABLE_READINGS waits in a row that loaded nothing.
+SCROLL_TIMEOUT_FACTOR = 4
+SCROLL_MIN_TIMEOUT = 0.5
+SCROLL_MAX_TIMEOUT = 5
+SCROLL_STABLE_READINGS = 3
+
+# Scrolling gives up after this many banners in a row were handled (a button clicked or a
+# sync waited for) without older messages loading, e.g. when a button does nothing
+MAX_BANNER_ACTIONS = 5
+
+# Selectors handed to EXTRACT_MESSAGES_JS so both extraction modes evaluate the same XPaths
+MESSAGE_SCRIPT_SELECTORS = {
+    "row": sel.MESSAGE_ROW_XPATH,
+    "replyDiv": sel.REPLY_DIV_XPATH,
+    "replySender": sel.REPLY_SENDER_XPATH,
+    "replyText": sel.REPLY_TEXT_XPATH,
+    "replyImage": sel.REPLY_IMAGE_XPATH,
+    "replyVideo": sel.REPLY_VIDEO_XPATH,
+    "copyableText": sel.COPYABLE_TEXT_XPATH,
+    "messageText": sel.MESSAGE_TEXT_XPATH,
+    "mediaInfo": sel.MEDIA_INFO_XPATH,
+    "mediaSender": sel.MEDIA_SENDER_XPATH,
+    "mediaTime": sel.MEDIA_TIME_XPATH,
+    "mediaDownload": sel.MEDIA_DOWNLOAD_XPATH,
+    "openPicture": sel.OPEN_PICTURE_XPATH,
+    "sticker": sel.STICKER_XPATH,
+    "video": sel.VIDEO_XPATH,
+    "messageId": sel.MESSAGE_ID_XPATH,
+}
+
+# In-page version of parse_message_row, shared by the scripts below.
+# visibleText normalises whitespace the same way WebElement.text does.
+MESSAGE_ROW_PARSER_JS = """
+function first(node, xpath) {
+    return document.evaluate(
+        xpath, node, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+}
+
+function visibleText(node) {
+    return (node.innerText || "")
+        .replace(/\\u00a0/g, " ")
+        .split("\\n")
+        .map(line => line.replace(/[ \\t]+/g, " ").trim())
+        .join("\\n")
+        .trim();
+}
+
+function parseRow(row) {
+    let replySender = null, replyMessage = null, replyMedia = false;
+    let information = null, text = null;
+    let image = false, sticker = false, video = false;
+
+    const replyDiv = first(row, xp.replyDiv);
+    if (replyDiv) {
+        replySender = visibleText(first(replyDiv, xp.replySender));
+        const replyText = first(replyDiv, xp.replyText);
+        if (replyText) {
+            replyMessage = visibleText(replyText);
+        }
+        if (first(replyDiv, xp.replyImage) || first(replyDiv, xp.replyVideo)) {
+            replyMedia = true;
+        }
+    }
+
+    const copyable = first(row, xp.copyableText);
+    if (copyable) {
+        information = copyable.getAttribute("data-pre-plain-text");
+        const textSpan = first(row, xp.messageText);
+        text = textSpan ? visibleText(textSpan) : null;
+    } else {
+        const mediaInfo = first(row, xp.mediaInfo);
+        if (mediaInfo) {
+            const senderSpan = first(mediaInfo, xp.mediaSender);
+            const sender = senderSpan ? senderSpan.getAttribute("aria-label") : null;
+            const timeSpan = first(mediaInfo, xp.mediaTime);
+            const time = timeSpan ? visibleText(timeSpan) : "Unknown time";
+            information = "[" + time + ", None] " + (sender === null ? "None" : sender) + ":";
+        }
+    }
+
+    if (first(row, xp.mediaDownload)) {
+        if (first(row, xp.openPicture)) {
+            image = true;
+        } else {
+            sticker = true;
+        }
+    } else if (first(row, xp.openPicture)) {
+        image = true;
+    } else if (first(row, xp.sticker)) {
+        sticker = true;
+    } else if (first(row, xp.video)) {
+        video = true;
+    }
+
+    return [replySender, replyMessage, replyMedia, information, text, image, sticker, video];
+}
+"""
+
+# Arguments: the message list element, the selectors above, the index of the first row
+# to parse and the number of rows to parse.
+EXTRACT_MESSAGES_JS = MESSAGE_ROW_PARSER_JS + """
+const container = arguments[0], xp = arguments[1], start = arguments[2], limit = arguments[3];
+const rows = document.evaluate(
+    xp.row, container, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+);
+const records = [];
+const end = Math.min(rows.snapshotLength, start + limit);
+for (let i = start; i < end; i++) {
+    records.push(parseRow(rows.snapshotItem(i)));
+}
+return {total: rows.snapshotLength, records: records};
+"""
+
+# Parses the rows that have not been harvested yet and marks them as harvested.
+# Arguments: the message list element, the selectors above, the scrollable chat
+# container and whether to prune harvested rows that are below the visible area.
+# Each record says whether it was rendered below an already harvested row.
+HARVEST_MESSAGES_JS = MESSAGE_ROW_PARSER_JS + """
+const container = arguments[0], xp = arguments[1], scroller = arguments[2], prune = arguments[3];
+const rows = document.evaluate(
+    xp.row, container, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+);
+const records = [];
+let belowHarvested = false;
+for (let i = 0; i < rows.snapshotLength; i++) {
+    const row = rows.snapshotItem(i);
+    if (row.hasAttribute("data-scraper-harvested")) {
+        belowHarvested = true;
+        continue;
+    }
+    const idNode = first(row, xp.messageId);
+    records.push({
+        id: idNode ? idNode.getAttribute("data-id") : null,
+        fields: parseRow(row),
+        below: belowHarvested,
+    });
+    row.setAttribute("data-scraper-harvested", "1");
+}
+if (prune) {
+    // Scrolling goes up, so rows under the visible area are never needed again
+    const bottom = scroller.getBoundingClientRect().bottom;
+    for (let i = 0; i < rows.snapshotLength; i++) {
+        const row = rows.snapshotItem(i);
+        if (row.hasAttribute("data-scraper-harvested") && !row.hasAttribute("data-scraper-pruned")
+                && row.getBoundingClientRect().top > bottom) {
+            row.replaceChildren();
+            row.setAttribute("data-scraper-pruned", "1");
+        }
+    }
+}
+return records;
+"""
+
+# Returns the data-id of every message row (null for rows without one), in row order
+MESSAGE_IDS_JS = """
+const container = arguments[0], rowXpath = arguments[1], idXpath = arguments[2];
+const rows = document.evaluate(
+    rowXpath, container, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+);
+const ids = [];
+for (let i = 0; i < rows.snapshotLength; i++) {
+    const node = document.evaluate(
+        idXpath, rows.snapshotItem(i), null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    ids.push(node ? node.getAttribute("data-id") : null);
+}
+return ids;
+"""
+
+# Checks whether a high-water mark is rendered. Returns true when its data-id is found,
+# otherwise the text of every row whose data-pre-plain-text matches, for hashing in Python,
+# normalised by visibleText like the extractors' text the mark was made from.
+FIND_MARK_JS = MESSAGE_ROW_PARSER_JS + """
+const container = arguments[0], mark = arguments[1], xp = arguments[2];
+if (mark.data_id && container.querySelector('[data-id="' + CSS.escape(mark.data_id) + '"]')) {
+    return true;
+}
+if (!mark.message_information) {
+    return [];
+}
+const texts = [];
+const rows = document.evaluate(
+    xp.row, container, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+);
+for (let i = 0; i < rows.snapshotLength; i++) {
+    const row = rows.snapshotItem(i);
+    const info = document.evaluate(
+        xp.copyableText, row, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    if (!info || info.getAttribute("data-pre-plain-text") !== mark.message_information) {
+        continue;
+    }
+    const textSpan = document.evaluate(
+        xp.messageText, row, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    texts.push(textSpan ? visibleText(textSpan) : null);
+}
+return texts;
+"""
+
+# Returns the shown time of a message row from its data-pre-plain-text, in seconds since
+# the epoch read as UTC like message_records.py does, or null for rows that show no date.
+ROW_TIME_PARSER_JS = """
+function rowTime(row, xp) {
+    const info = document.evaluate(
+        xp.copyableText, row, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    const match = info && /^\\[(\\d{1,2}):(\\d{2}), (\\d{1,2})\\/(\\d{1,2})\\/(\\d{4})\\]/.exec(
+        info.getAttribute("data-pre-plain-text") || ""
+    );
+    if (!match) {
+        return null;
+    }
+    return Date.UTC(+match[5], +match[4] - 1, +match[3], +match[1], +match[2]) / 1000;
+}
+"""
+
+# Reads how far the loaded rows of the open chat reach, for the bounded scrape modes:
+# the number of rows, the time of the oldest dated row and the number of rows up to the
+# newest one dated before arguments[2] (all rows if it is null). Rows are searched from
+# the bottom for the latter, so it stays cheap while the chat grows upwards.
+CHAT_BOUNDS_JS = ROW_TIME_PARSER_JS + """
+const container = arguments[0], xp = arguments[1], until = arguments[2];
+const rows = document.evaluate(
+    xp.row, container, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+);
+let oldest = null;
+for (let i = 0; i < rows.snapshotLength && oldest === null; i++) {
+    oldest = rowTime(rows.snapshotItem(i), xp);
+}
+let before = rows.snapshotLength;
+if (until !== null) {
+    before = 0;
+    for (let i = rows.snapshotLength - 1; i >= 0; i--) {
+        const time = rowTime(rows.snapshotItem(i), xp);
+        if (time !== null && time < until) {
+            before = i + 1;
+            break;
+        }
+    }
+}
+return {rows: rows.snapshotLength, oldest: oldest, before: before};
+"""
+
+# Returns the time of every row of the open chat (see ROW_TIME_PARSER_JS)
+ROW_TIMES_JS = ROW_TIME_PARSER_JS + """
+const container = arguments[0], xp = arguments[1];
+const rows = document.evaluate(
+    xp.row, container, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+);
+const times = [];
+for (let i = 0; i < rows.snapshotLength; i++) {
+    times.push(rowTime(rows.snapshotItem(i), xp));
+}
+return times;
+"""
+
+# Name of the IndexedDB database in which WhatsApp Web keeps its local copy of the chats
+INDEXEDDB_NAME = "model-storage"
+
+# Message types that are shown as message rows; notifications, protocol messages etc.
+# are skipped, as they are in the DOM
+INDEXEDDB_MESSAGE_TYPES = ["chat", "image", "video", "sticker", "gif", "ptt", "audio",
+                           "document", "location", "vcard"]
+
+# WhatsApp Web only keeps the recent part of long chats locally. A stored chat is complete
+# if it starts with the end-to-end encryption notice that opens every chat.
+INDEXEDDB_HISTORY_START_TYPE = "e2e_notification"
+
+# Reads one private chat from WhatsApp Web's IndexedDB in bulk and maps every stored
+# message onto the 8 fields of the DOM extractors, with times formatted the way the page
+# shows them. Resolves to {ids, messages, complete}, complete being whether the stored
+# messages go back to the start of the chat, or null if the database, the contact or its
+# messages are not stored.
+INDEXEDDB_CHAT_JS = """
+const name = arguments[0], dbName = arguments[1], types = arguments[2];
+const startType = arguments[3];
+const done = arguments[arguments.length - 1];
+
+const request = req => new Promise((resolve, reject) => {
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+});
+const pad = n => String(n).padStart(2, "0");
+const digits = text => String(text || "").replace(/\\D/g, "");
+
+async function read() {
+    // Opening without a version would create a missing database; abort that instead
+    const open = indexedDB.open(dbName);
+    open.onupgradeneeded = () => open.transaction.abort();
+    let db;
+    try {
+        db = await request(open);
+    } catch (e) {
+        return null;
+    }
+    try {
+        const storeNames = Array.from(db.objectStoreNames);
+        if (!storeNames.includes("message") || !storeNames.includes("contact")) {
+            return null;
+        }
+        const tx = db.transaction(storeNames.filter(
+            store => ["message", "contact", "chat"].includes(store)
+        ), "readonly");
+
+        const contacts = await request(tx.objectStore("contact").getAll());
+        const isPrivate = c => String(c.id).endsWith("@c.us") && !c.isMe;
+        const contact = contacts.find(c => isPrivate(c) && c.name === name)
+            || contacts.find(c => isPrivate(c) && c.pushname === name)
+            || (digits(name) && contacts.find(
+                c => isPrivate(c) && digits(String(c.id).split("@")[0]) === digits(name)
+            ));
+        if (!contact) {
+            return null;
+        }
+        const chatId = String(contact.id);
+        if (storeNames.includes("chat")
+                && !(await request(tx.objectStore("chat").get(chatId)))) {
+            return null;
+        }
+        const me = contacts.find(c => c.isMe);
+        const myName = me ? (me.pushname || me.name || "You") : "You";
+
+        // Message keys are "<fromMe>_<chat id>_<message id>", so a chat is two key ranges
+        const store = tx.objectStore("message");
+        let stored = [];
+        if (store.keyPath === "id") {
+            for (const fromMe of ["false_", "true_"]) {
+                const prefix = fromMe + chatId + "_";
+                stored = stored.concat(await request(
+                    store.getAll(IDBKeyRange.bound(prefix, prefix + "\\uffff"))
+                ));
+            }
+        } else {
+            stored = (await request(store.getAll())).filter(
+                m => String(m.id).includes("_" + chatId + "_")
+            );
+        }
+        stored.sort((a, b) => (a.t - b.t) || ((a.rowId || 0) - (b.rowId || 0)));
+        const complete = stored.length > 0 && stored[0].type === startType;
+        stored = stored.filter(m => types.includes(m.type));
+
+        const ids = [], messages = [];
+        for (const m of stored) {
+            const sender = String(m.id).startsWith("true_") ? myName : name;
+            // Local time, as in the page: WhatsApp Web renders data-pre-plain-text in the
+            // browser's time zone, so both modes read the same wall-clock timestamps
+            const shown = new Date(m.t * 1000);
+            const time = pad(shown.getHours()) + ":" + pad(shown.getMinutes());
+            const text = m.type === "chat" ? (m.body || null) : (m.caption || null);
+            const information = text !== null
+                ? "[" + time + ", " + pad(shown.getDate()) + "/" + pad(shown.getMonth() + 1)
+                  + "/" + shown.getFullYear() + "] " + sender + ": "
+                : "[" + time + ", None] " + sender + ":";
+
+            let replySender = null, replyMessage = null, replyMedia = false;
+            const quoted = m.quotedMsg;
+            if (quoted) {
+                replySender = m.quotedParticipant === chatId ? name : "You";
+                replyMessage = quoted.body || quoted.caption || null;
+                replyMedia = quoted.type === "image" || quoted.type === "video";
+            }
+
+            ids.push(String(m.id));
+            messages.push([replySender, replyMessage, replyMedia, information, text,
+                           m.type === "image", m.type === "sticker",
+                           m.type === "video" || m.type === "gif"]);
+        }
+        return messages.length ? {ids: ids, messages: messages, complete: complete} : null;
+    } finally {
+        db.close();
+    }
+}
+
+read().then(done, e => done({error: String(e)}));
+"""
+
+SEARCH_RESULT_SELECTORS = {
+    "results": sel.SEARCH_RESULTS_XPATH,
+    "row": sel.SEARCH_RESULT_ROW_XPATH,
+    "title": sel.SEARCH_RESULT_TITLE_XPATH,
+}
+
+# Returns the search result row whose title matches arguments[1] once non-BMP
+# characters are removed, or null if it has not been rendered yet
+FIND_SEARCH_RESULT_JS = """
+const xp = arguments[0], name = arguments[1];
+const results = document.evaluate(
+    xp.results, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+).singleNodeValue;
+if (!results) {
+    return null;
+}
+const rows = document.evaluate(
+    xp.row, results, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+);
+for (let i = 0; i < rows.snapshotLength; i++) {
+    const row = rows.snapshotItem(i);
+    const span = document.evaluate(
+        xp.title, row, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    if (!span) {
+        continue;
+    }
+    const title = Array.from(span.getAttribute("title") || "")
+        .filter(c => c.codePointAt(0) <= 0xFFFF).join("");
+    if (title === name) {
+        return row;
+    }
+}
+return null;
+"""
+
+# Fallback height in px of a sidebar row, used until two adjacent rows have been seen
+SIDEBAR_ROW_HEIGHT = 72
+
+SIDEBAR_SCRIPT_SELECTORS = {
+    "row": sel.SIDEBAR_ROW_XPATH,
+    "title": sel.CHAT_TITLE_XPATH,
+    "time": sel.PREVIEW_TIME_XPATH,
+    "preview": sel.CHAT_PREVIEW_XPATH,
+    "photo": sel.PROFILE_PHOTO_XPATH,
+    "previewText": sel.PREVIEW_TEXT_XPATH,
+    "previewAuthor": sel.PREVIEW_AUTHOR_XPATH,
+    "groupIcon": sel.DEFAULT_GROUP_ICON_XPATH,
+    "groupPreviews": list(sel.GROUP_PREVIEW_XPATHS),
+}
+
+# One tick of the geometry-driven sidebar scan. Scrolls the side panel (arguments[0]) to
+# arguments[2] px unless it is null, waits for the virtualised list to re-render (at most
+# arguments[3] ms) and returns every rendered row's translateY, title, shown time and
+# preview text and the in-page version of is_private_chat, together with the panel's
+# scroll geometry.
+SIDEBAR_TICK_JS = """
+const pane = arguments[0], xp = arguments[1], target = arguments[2], timeoutMs = arguments[3];
+const done = arguments[arguments.length - 1];
+
+function first(node, xpath) {
+    return document.evaluate(
+        xpath, node, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+}
+
+function isPrivate(row) {
+    const preview = first(row, xp.preview);
+    const photo = first(row, xp.photo);
+    if (!preview) {
+        return true;
+    }
+    const previewText = first(preview, xp.previewText);
+    if (previewText) {
+        if (!(previewText.innerText || "").trim()) {
+            return true;
+        }
+        // this is the element <You> or <+27 724 ...> before the message
+        return !first(preview, xp.previewAuthor);
+    }
+    if (photo && first(photo, xp.groupIcon)) {
+        return false;
+    }
+    return !xp.groupPreviews.some(xpath => first(preview, xpath));
+}
+
+function read() {
+    const rows = document.evaluate(
+        xp.row, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    const chats = [];
+    for (let i = 0; i < rows.snapshotLength; i++) {
+        const row = rows.snapshotItem(i);
+        const match = /translateY\((\d+)px\)/.exec(row.getAttribute("style") || "");
+        if (!match) {
+            continue;
+        }
+        const title = first(row, xp.title);
+        const time = first(row, xp.time);
+        const preview = first(row, xp.preview);
+        chats.push({
+            y: parseInt(match[1], 10),
+            title: title ? title.getAttribute("title") : null,
+            time: time ? time.innerText : null,
+            preview: preview ? preview.innerText : null,
+            private: isPrivate(row),
+        });
+    }
+    done({
+        rows: chats,
+        scrollTop: pane.scrollTop,
+        clientHeight: pane.clientHeight,
+        scrollHeight: pane.scrollHeight,
+    });
+}
+
+const previous = pane.scrollTop;
+if (target === null) {
+    read();
+    return;
+}
+pane.scrollTop = target;
+if (pane.scrollTop === previous) {
+    read();
+    return;
+}
+let finished = false, timer = null;
+const observer = new MutationObserver(() => requestAnimationFrame(() => requestAnimationFrame(finish)));
+function finish() {
+    if (finished) {
+        return;
+    }
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    read();
+}
+observer.observe(pane, {childList: true, subtree: true, attributes: true});
+timer = setTimeout(finish, timeoutMs);
+"""
+
+# Finds the sidebar row of the chat titled arguments[2], scrolling the side panel
+# (arguments[0]) so that translateY arguments[3] px, where the row was last seen, is in
+# view. Waits at most arguments[4] ms for the row to render and resolves the row or null.
+FIND_SIDEBAR_ROW_JS = """
+const pane = arguments[0], xp = arguments[1], name = arguments[2], y = arguments[3];
+const timeoutMs = arguments[4];
+const done = arguments[arguments.length - 1];
+
+function findRow() {
+    const rows = document.evaluate(
+        xp.row, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    for (let i = 0; i < rows.snapshotLength; i++) {
+        const row = rows.snapshotItem(i);
+        const title = document.evaluate(
+            xp.title, row, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+        ).singleNodeValue;
+        if (pane.contains(row) && title && title.getAttribute("title") === name) {
+            return row;
+        }
+    }
+    return null;
+}
+
+let row = findRow();
+if (row) {
+    done(row);
+    return;
+}
+pane.scrollTop = Math.max(0, y - pane.clientHeight / 2);
+row = findRow();
+if (row) {
+    done(row);
+    return;
+}
+let finished = false, timer = null;
+const observer = new MutationObserver(() => {
+    const found = findRow();
+    if (found) {
+        finish(found);
+    }
+});
+function finish(value) {
+    if (finished) {
+        return;
+    }
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(value);
+}
+observer.observe(pane, {childList: true, subtree: true, attributes: true});
+timer = setTimeout(() => finish(null), timeoutMs);
+"""
+
 def _has_element(parent, xpath):
     """
     Returns wether or not the HTML element is present 
@@ -53,6 +680,7 @@ def _has_element(parent, xpath):
         parent.find_element(By.XPATH, xpath)
         return True
     except:
+        scrape_metrics.current.failed_lookup(xpath)
         return False
 
 def is_private_chat(chat_name_div):
@@ -66,30 +694,25 @@ def is_private_chat(chat_name_div):
         bool: True if the chat is a private chat, False otherwise.
     """
     
-    veiwable_msg_span = chat_name_div.find_element(By.XPATH, './/div[@class="_ak8k"]')
-    profile_photo = chat_name_div.find_element(By.XPATH, './/div[@class="_ak8n"]')
+    veiwable_msg_span = chat_name_div.find_element(By.XPATH, sel.CHAT_PREVIEW_XPATH)
+    profile_photo = chat_name_div.find_element(By.XPATH, sel.PROFILE_PHOTO_XPATH)
 
 
-    if _has_element(veiwable_msg_span, './/span[@dir="auto"]'):
-        text = veiwable_msg_span.find_element(By.XPATH, './/span[@dir="auto"]').text.strip()
+    if _has_element(veiwable_msg_span, sel.PREVIEW_TEXT_XPATH):
+        text = veiwable_msg_span.find_element(By.XPATH, sel.PREVIEW_TEXT_XPATH).text.strip()
         if not text or (len(str(text)) == 0):
             return True
-        if _has_element(veiwable_msg_span, './/span[@class="x1rg5ohu _ao3e"]'):
+        if _has_element(veiwable_msg_span, sel.PREVIEW_AUTHOR_XPATH):
             # this is the element <You> or <+27 724 ...> before the message
             return False
         return True
     
-    if _has_element(profile_photo, './/span[@data-icon="default-group"]'):
+    if _has_element(profile_photo, sel.DEFAULT_GROUP_ICON_XPATH):
         return False
 
-    if _has_element(veiwable_msg_span, './/span[contains(@title, "Group")]'):
-        return False
-
-    if _has_element(veiwable_msg_span, './/span[contains(@title, "group")]'):
-        return False
-    
-    if _has_element(veiwable_msg_span, './/span[contains(@title, " changed to +")]'):
-        return False
+    for xpath in sel.GROUP_PREVIEW_XPATHS:
+        if _has_element(veiwable_msg_span, xpath):
+            return False
 
     return True
 
@@ -117,15 +740,238 @@ def find_scroll_speed(last_max, current_min, current_speed):
 
 
 
-def find_contact_names(driver):
+def find_load_timeout(load_latency):
+    """
+    Returns how long to wait for older messages after jumping to the top of a chat, so
+    fast chats are not held up by a fixed wait and slow ones are not cut short.
+
+    Args:
+        load_latency (float or None): The average time loads of older messages have
+                                      taken so far in seconds, None before the first.
+
+    Returns:
+        float: The timeout in seconds.
+    """
+    if load_latency is None:
+        return page_waits.SCROLL_STEP_TIMEOUT
+
+    return min(max(load_latency * SCROLL_TIMEOUT_FACTOR, SCROLL_MIN_TIMEOUT),
+               SCROLL_MAX_TIMEOUT)
+
+
+def _row_text(chat_name_div, xpath):
+    elements = chat_name_div.find_elements(By.XPATH, xpath)
+    return elements[0].text if elements else None
+
+
+def read_visible_chats_dom(driver, side_panel, directory=None):
+    """
+    Reads the sidebar rows currently rendered, using Selenium element lookups.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling the browser.
+        side_panel (WebElement): The "pane-side" element holding the chat list.
+        directory (ContactDirectory): If given, rows without new activity keep the
+                                      classification remembered in it instead of being
+                                      probed with is_private_chat.
+
+    Returns:
+        list: One (translateY in px, chat name, is private) tuple per row, in document order.
+              The chat name is None for group chats, unless a directory is given.
+    """
+    rows = []
+
+    chat_name_divs = driver.find_elements(By.XPATH, sel.SIDEBAR_ROW_XPATH)
+
+    for chat_name_div in chat_name_divs:
+        try:
+            style = chat_name_div.get_attribute("style")
+            string_match = re.search(r'translateY\((\d+)px\)', style)
+            if string_match:
+                px_height = int(string_match.group(1))
+            else:
+                continue
+
+            if directory is not None:
+                name_span = chat_name_div.find_element(By.XPATH, sel.CHAT_TITLE_XPATH)
+                chat_name = name_span.get_attribute("title")
+                private = directory.observe(
+                    chat_name, _row_text(chat_name_div, sel.PREVIEW_TIME_XPATH),
+                    _row_text(chat_name_div, sel.CHAT_PREVIEW_XPATH), px_height,
+                    lambda: is_private_chat(chat_name_div)
+                )
+                rows.append((px_height, chat_name, private))
+                continue
+
+            if not is_private_chat(chat_name_div):
+                rows.append((px_height, None, False))
+                continue
+
+            # Get the private chat name
+            name_span = chat_name_div.find_element(By.XPATH, sel.CHAT_TITLE_XPATH)
+            rows.append((px_height, name_span.get_attribute("title"), True))
+
+        except StaleElementReferenceException:
+            continue
+
+    return rows
+
+
+def read_visible_chats_html(driver, side_panel, directory=None):
+    """
+    Reads the sidebar rows currently rendered by parsing the outerHTML of the side panel
+    in-process, which costs a single WebDriver round trip.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling the browser.
+        side_panel (WebElement): The "pane-side" element holding the chat list.
+        directory (ContactDirectory): If given, every row is recorded in it.
+
+    Returns:
+        list: One (translateY in px, chat name, is private) tuple per row, in document order.
+    """
+    return html_snapshot_parser.parse_sidebar_html(
+        side_panel.get_attribute("outerHTML"), directory
+    )
+
+
+@dataclass
+class ChatHandle:
+    """
+    Where a private chat was found in the sidebar, so it can be opened again without
+    typing its name into the search box.
+
+    Attributes:
+        name (str): The chat's full title, including characters outside the BMP.
+        position (int): The translateY of its row in px when the sidebar was scanned.
+    """
+    name: str
+    position: int
+
+
+SIDEBAR_READERS = {
+    "dom": read_visible_chats_dom,
+    "html": read_visible_chats_html,
+}
+
+SIDEBAR_EXTRACTION_MODES = sorted([*SIDEBAR_READERS, "script"])
+
+
+def _add_settled_chats(set_of_names, directory, complete):
+    """
+    Ends a sidebar scan in the contact directory and adds the private chats it did not
+    read, because the scan stopped at rows without new activity.
+
+    Args:
+        set_of_names (dict): {name: ChatHandle} of the private chats read.
+        directory (ContactDirectory): The contact directory, or None.
+        complete (bool): True if the whole sidebar was read.
+
+    Returns:
+        dict: set_of_names, with the chats taken from the directory.
+    """
+    if directory is None:
+        return set_of_names
+
+    settled_chats = directory.end_scan(complete)
+    for name, position in settled_chats:
+        set_of_names.setdefault(name, ChatHandle(name, position))
+    if not complete:
+        print(f"No new activity further down the sidebar: took {len(settled_chats)} "
+              "private chats from the contact directory.")
+
+    return set_of_names
+
+
+def scan_sidebar_by_geometry(driver, side_panel, number_of_chats, directory=None):
+    """
+    Walks the sidebar exactly once, reading each position with a single in-page script.
+
+    Each tick returns every rendered row's translateY, title and private/group decision.
+    The next scroll position is the row right after the lowest row seen so far, so every
+    chat is read once with no overlap, and the scan stops as soon as aria-rowcount rows
+    have been seen or the panel cannot scroll further. No back-up pass is needed. With a
+    contact directory, the scan also stops once the rows read have settled.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling the browser.
+        side_panel (WebElement): The "pane-side" element holding the chat list.
+        number_of_chats (int or None): The chat list's aria-rowcount.
+        directory (ContactDirectory): The contact directory, or None.
+
+    Returns:
+        dict: {name: ChatHandle} for all private chats.
+    """
+    chats_by_position = {}
+    row_height = None
+    target = None
+    timeout_ms = int(page_waits.bounded(page_waits.SIDEBAR_RENDER_TIMEOUT) * 1000)
+    complete = True
+
+    while True:
+        tick = driver.execute_async_script(
+            SIDEBAR_TICK_JS, side_panel, SIDEBAR_SCRIPT_SELECTORS, target, timeout_ms
+        )
+
+        positions = sorted({row["y"] for row in tick["rows"]})
+        for row in tick["rows"]:
+            private = row["private"]
+            if directory is not None and row["title"]:
+                private = directory.observe(
+                    row["title"], row["time"], row["preview"], row["y"], lambda: private
+                )
+            chats_by_position[row["y"]] = (row["title"], private)
+
+        if row_height is None and len(positions) > 1:
+            row_height = min(b - a for a, b in zip(positions, positions[1:]) if b > a)
+
+        if number_of_chats is not None and len(chats_by_position) >= number_of_chats:
+            break
+
+        if directory is not None and directory.settled(
+            [title for _, (title, _) in sorted(chats_by_position.items())]
+        ):
+            complete = False
+            break
+
+        max_scroll = tick["scrollHeight"] - tick["clientHeight"]
+        if tick["scrollTop"] >= max_scroll:
+            break
+
+        lowest_seen = max(chats_by_position) if chats_by_position else 0
+        target = min(lowest_seen + (row_height or SIDEBAR_ROW_HEIGHT), max_scroll)
+        if target <= tick["scrollTop"]:
+            target = min(tick["scrollTop"] + tick["clientHeight"], max_scroll)
+
+    print(f"Read {len(chats_by_position)} chats from the sidebar.")
+
+    set_of_names = {
+        title: ChatHandle(title, position)
+        for position, (title, private) in sorted(chats_by_position.items())
+        if private and title
+    }
+    return _add_settled_chats(set_of_names, directory, complete)
+
+
+def find_contact_names(driver, sidebar_extraction="dom", directory=None):
     """
     Scans the WhatsApp chat list and returns a set of contact names for private (non-group) chats.
 
     Args:
         driver (WebDriver): The Selenium WebDriver instance controlling the browser.
+        sidebar_extraction (str): "dom" to read each row with Selenium lookups, "html"
+                                  to parse the side panel's HTML in-process, or "script"
+                                  to read all rendered rows with one in-page script per
+                                  tick and scroll by the known row geometry.
+        directory (ContactDirectory): If given, rows without new activity since the
+                                      previous run keep their remembered classification,
+                                      and the scan stops once it reaches a run of them
+                                      and takes the chats further down from the directory.
 
     Returns:
-        set: A set containing the names of all contacts with whom the user has private chats.
+        dict: {name: ChatHandle} for every contact with whom the user has a private chat.
+              Iterating it gives the names, so it can be used wherever a set of names
+              is expected.
     """
 
     side_panel = driver.find_element(By.ID, "pane-side")
@@ -133,55 +979,49 @@ def find_contact_names(driver):
     count = 0
 
     #Identify how many chats the user has
-    chat_list_div = driver.find_element(By.XPATH, '//div[@aria-label="Chat list" and @role="grid"]')
+    chat_list_div = driver.find_element(By.XPATH, sel.CHAT_LIST_XPATH)
     number_of_chats = chat_list_div.get_attribute("aria-rowcount")
     print(f"\nYou have {number_of_chats} total chats!")
 
-    set_of_names = set()
+    if sidebar_extraction == "script":
+        return scan_sidebar_by_geometry(
+            driver, side_panel, int(number_of_chats) if number_of_chats else None, directory
+        )
+
+    read_visible_chats = SIDEBAR_READERS[sidebar_extraction]
+
+    set_of_names = {}
+    titles_by_position = {}
     max_height_of_scroll = 0
     current_speed = 150
     scroll_back_up = False
+    complete = True
 
     while True:
-        first_div = True
         prev_max_height = max_height_of_scroll
         current_min_height = 0
         current_height = driver.execute_script("return arguments[0].scrollTop", side_panel)
 
         #Find the list of chats visible 
-        chat_name_divs = driver.find_elements(
-            By.XPATH, '//div[contains(@class, "x10l6tqk xh8yej3 x1g42fcv")]'
-        )
-
-        for chat_name_div in chat_name_divs:
-            try:
-                style = chat_name_div.get_attribute("style")
-                string_match = re.search(r'translateY\((\d+)px\)', style)
-                if string_match:
-                    px_height = int(string_match.group(1))
-                else:
-                    continue
+        visible_chats = read_visible_chats(driver, side_panel, directory)
 
-                if px_height > max_height_of_scroll:
-                    max_height_of_scroll = px_height
+        if visible_chats:
+            current_min_height = visible_chats[0][0]
 
-                if first_div:
-                    current_min_height = px_height
-                    first_div = False
-
-                if not is_private_chat(chat_name_div):
-                    continue
+        for px_height, chat_name, private in visible_chats:
+            if px_height > max_height_of_scroll:
+                max_height_of_scroll = px_height
 
-                # Get the private chat name
-                name_span = chat_name_div.find_element(By.XPATH, './/span[@title]')
-                chat_name = name_span.get_attribute("title")
+            #search if the chat name is in the chat of names
+            if private and chat_name not in set_of_names:
+                set_of_names[chat_name] = ChatHandle(chat_name, px_height)
+            titles_by_position[px_height] = chat_name
 
-                #search if the chat name is in the chat of names
-                if chat_name not in set_of_names:
-                    set_of_names.add(chat_name)
-            
-            except StaleElementReferenceException:
-                continue
+        if directory is not None and not scroll_back_up and directory.settled(
+            [title for _, title in sorted(titles_by_position.items())]
+        ):
+            complete = False
+            break
 
         if current_height == last_height:
             count += 1
@@ -207,9 +1047,12 @@ def find_contact_names(driver):
             #if scrolling to top of chat from bottom -> must be negative
             driver.execute_script(f"arguments[0].scrollTop -= {current_speed}", side_panel)
 
-        time.sleep(0.5)
+        # Wait for the virtualised list to re-render the rows at the new position
+        page_waits.wait_for_mutation(
+            driver, side_panel, page_waits.SIDEBAR_RENDER_TIMEOUT, attributes=True
+        )
     
-    return set_of_names
+    return _add_settled_chats(set_of_names, directory, complete)
 
 
 def ensure_BMP_characters(element):
@@ -259,45 +1102,73 @@ def search_for_contact(contact, driver):
         driver (webdriver.Chrome): The Selenium WebDriver instance controlling the browser.
     """
 
-    search_box = driver.find_element(
-        By.XPATH,'//div[@contenteditable="true" and @role="textbox" and @data-tab="3"]'
-    )
+    search_box = driver.find_element(By.XPATH, sel.SEARCH_BOX_XPATH)
+    search_name = strip_non_bmp(contact)
 
     search_box.click()
     search_box.send_keys(Keys.CONTROL + 'a')
     search_box.send_keys(Keys.BACKSPACE)
-    time.sleep(2)
-    search_box.send_keys(strip_non_bmp(contact))
-    time.sleep(2)
+    page_waits.wait_for_element_text(driver, search_box, "")
+    search_box.send_keys(search_name)
+    page_waits.wait_for_element_text(driver, search_box, search_name)
     search_box.send_keys(Keys.ENTER)
 
-    try:
-        results_div = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, './/div[@aria-label="Search results."]'))
-        )
-    except TimeoutException:
-        print(f"[WARN] Search results for '{contact}' did not appear.")
+    # Wait until a result with the exact (BMP) name is rendered rather than for any result
+    chat = page_waits.wait_for_script_result(
+        driver, FIND_SEARCH_RESULT_JS, SEARCH_RESULT_SELECTORS, search_name,
+        timeout=page_waits.SEARCH_TIMEOUT
+    )
+
+    if chat is None:
+        print(f"[WARN] Could not find contact '{contact}' in search results.")
         return
 
-    chats_in_results = results_div.find_elements(
-        By.XPATH, './/div[@class="x10l6tqk xh8yej3 x1g42fcv" and @role="listitem"]'
-    )
+    chat.click()
 
-    found = False
-    for chat in chats_in_results:
-        if not _has_element(chat, './/span[@dir="auto" and @title]'):
-            continue
-        
-        chat_name_span = chat.find_element(By.XPATH, './/span[@dir="auto" and @title]')
-        chat_name = ensure_BMP_characters(chat_name_span)
 
-        if chat_name == strip_non_bmp(contact):
-            chat.click()
-            found = True
-            break
+def clear_search(driver):
+    """
+    Empties the search box if it holds a query, so the sidebar shows the chat list again.
 
-    if not found:
-        print(f"[WARN] Could not find contact '{contact}' in search results.")
+    Args:
+        driver (webdriver.Chrome): The Selenium WebDriver instance controlling the browser.
+    """
+    search_box = driver.find_element(By.XPATH, sel.SEARCH_BOX_XPATH)
+    if not search_box.text.strip():
+        return
+
+    search_box.click()
+    search_box.send_keys(Keys.CONTROL + 'a')
+    search_box.send_keys(Keys.BACKSPACE)
+    page_waits.wait_for_element_text(driver, search_box, "")
+
+
+def open_chat_from_sidebar(driver, handle):
+    """
+    Opens a chat by clicking its row in the sidebar, found by its exact title near the
+    position it had when the sidebar was scanned. Nothing is typed, and names that only
+    differ in emojis cannot be confused.
+
+    Args:
+        driver (webdriver.Chrome): The Selenium WebDriver instance controlling the browser.
+        handle (ChatHandle): The chat, as returned by find_contact_names.
+
+    Returns:
+        bool: True if the chat header now shows exactly this chat, False if the row was
+              not found or another chat opened, in which case the caller should search.
+    """
+    clear_search(driver)
+    side_panel = driver.find_element(By.ID, "pane-side")
+
+    row = driver.execute_async_script(
+        FIND_SIDEBAR_ROW_JS, side_panel, SIDEBAR_SCRIPT_SELECTORS, handle.name,
+        handle.position, int(page_waits.bounded(page_waits.SIDEBAR_ROW_TIMEOUT) * 1000)
+    )
+    if row is None:
+        return False
+
+    row.click()
+    return page_waits.wait_for_chat_open(driver, handle.name, exact=True)
 
 
 def return_index(np_array, value):
@@ -338,14 +1209,15 @@ def identify_and_resolve_stopping_reason(driver):
     Returns:
         str or None: A keyword representing the action taken or to take.
                      - "syncing" if messages are still syncing
+                     - "sync_paused" if syncing was paused and has been resumed
+                     - "load_older" if the button to get older messages was clicked
                      - "break" if top of chat is reached
                      - None if no known condition is found
     """
 
     #possible message options
-    informative_msg_options = np.array(["Syncing older messages. Click to see progress.", 
-                               "Click here to get older messages from your phone.",
-                               "Use WhatsApp on your phone to see older messages."])
+    informative_msg_options = np.array([SYNCING_BANNER, LOAD_OLDER_BANNER,
+                                        END_OF_HISTORY_BANNER])
 
     # Re-find the chat container to avoid stale references
     chat = driver.find_element(
@@ -354,11 +1226,9 @@ def identify_and_resolve_stopping_reason(driver):
     )
 
     # Check for the top-of-chat message container
-    if _has_element(chat, './/div[@class="x78zum5 x6s0dn4 x1r0jzty x17zd0t2"]'):
+    if _has_element(chat, sel.CHAT_BANNER_XPATH):
 
-        informative_msg = chat.find_element(
-            By.XPATH, './/div[@class="x78zum5 x6s0dn4 x1r0jzty x17zd0t2"]'
-        ).text
+        informative_msg = chat.find_element(By.XPATH, sel.CHAT_BANNER_XPATH).text
 
         msg_index = return_index(informative_msg_options, informative_msg)
 
@@ -375,16 +1245,20 @@ def identify_and_resolve_stopping_reason(driver):
                 'x1lq5wgf xgqcy7u x30kzoy x9jhf4c"]'
             )
             button.click()
-            time.sleep(5)
+            with scrape_metrics.current.phase("load_older_wait"):
+                page_waits.wait_for_mutation(driver, chat, page_waits.BUTTON_CLICK_TIMEOUT)
+            return "load_older"
 
         elif msg_index == 2:
             return "break"
         
-        elif _has_element(chat, './/span[@data-icon="alert-sync-paused"]'):
+        elif _has_element(chat, sel.SYNC_PAUSED_XPATH):
             print("Paused due to sync alert. Attempting to click the button.")
             button = chat.find_element(By.XPATH, './/button[contains(@class, "x14m1o6m")]')
             button.click()
-            time.sleep(5)
+            with scrape_metrics.current.phase("sync_wait"):
+                page_waits.wait_for_mutation(driver, chat, page_waits.BUTTON_CLICK_TIMEOUT)
+            return "sync_paused"
 
         else:
             return None
@@ -393,7 +1267,7 @@ def identify_and_resolve_stopping_reason(driver):
 
 
 
-def scroll_to_top_of_private_chat(driver):
+def scroll_to_top_of_private_chat(driver, stop_condition=None, on_step=None, defer_sync=False):
     """
     Scrolls to the top of a private chat in WhatsApp Web.
 
@@ -402,240 +1276,1653 @@ def scroll_to_top_of_private_chat(driver):
     it's necessary to scroll to the very top of the chat before attempting to 
     extract messages.
 
-    This function handles scrolling incrementally and attempts to resolve interruptions 
-    such as:
+    Rather than climbing a fixed number of pixels at a time, this function jumps
+    straight to the top and waits for WhatsApp to render the next batch of older
+    messages, with a timeout that follows how long loads have been taking (see
+    find_load_timeout). The end is recognised from the end-of-history banner, or else
+    once several waits in a row load nothing. It also resolves interruptions such as:
         - Message syncing in progress.
         - "Click to load more" buttons.
         - Sync pause alerts.
-        - End of chat reached.
 
     Args:
         driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        stop_condition (callable): Optional function taking the driver that is checked
+                                   before every scroll step; scrolling stops early once
+                                   it returns True.
+        on_step (callable): Optional function taking the driver that is called at every
+                            scroll position, before the stopping checks, e.g. to harvest
+                            the rows rendered so far.
+        defer_sync (bool): Give up as soon as the chat is syncing (or syncing was paused)
+                           instead of waiting for the sync to finish, so the caller can
+                           come back to the chat later.
+
+    Returns:
+        str or None: "syncing" if scrolling was given up because of defer_sync, else None.
     """
 
-    chat_block = driver.find_element(
-        By.XPATH, '//div[@class="x10l6tqk x13vifvy x17qophe xyw6214 x9f619 x78zum5 xdt5ytf'
-        ' xh8yej3 x5yr21d x6ikm8r x1rife3k xjbqb8w x1ewm37j" and @tabindex="0"]'
-    )
-    current_height = 0
-    count = 0
-    prev_height = 626
+    chat_block = driver.find_element(By.XPATH, sel.CHAT_CONTAINER_XPATH)
+    message_list = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+    stopping_banners = [SYNCING_BANNER, LOAD_OLDER_BANNER, END_OF_HISTORY_BANNER]
+    load_latency = None
+    stable_readings = 0
+    banner_actions = 0
 
     while True:
-        current_height = driver.execute_script("return arguments[0].scrollTop", chat_block)
+        if on_step is not None:
+            on_step(driver)
 
-        if current_height == prev_height:
-            count += 1
-        else:
-            count = 0
-        
-        prev_height = current_height
- 
-        if count == 1:
+        if stop_condition is not None and stop_condition(driver):
+            break
+
+        step = page_waits.jump_to_top_and_wait(
+            driver, chat_block, message_list, stopping_banners,
+            find_load_timeout(load_latency)
+        )
+
+        if step["status"] == "grew":
+            stable_readings = 0
+            banner_actions = 0
+            # Moving average, so one slow batch does not stretch every later wait
+            if load_latency is None:
+                load_latency = step["seconds"]
+            else:
+                load_latency = 0.7 * load_latency + 0.3 * step["seconds"]
+            continue
+
+        if step["banner"] == END_OF_HISTORY_BANNER:
+            break
+
+        action_to_take = None
+        if step["status"] == "banner":
             action_to_take = identify_and_resolve_stopping_reason(driver)
             if action_to_take == "break":
                 break
 
-            if action_to_take == "syncing":
-                time.sleep(10)
-
-                while True:
-                    if identify_and_resolve_stopping_reason(driver) != "syncing":
-                        count = 0
-                        break
-                    time.sleep(1)
+        if action_to_take is None:
+            stable_readings += 1
+            if stable_readings >= SCROLL_STABLE_READINGS:
+                # Assume we've reached the top of the chat if it stops changing
+                break
+            continue
 
-        if count == 8:
-            # Assume we've reached the top of the chat if it stops changing
+        banner_actions += 1
+        if banner_actions > MAX_BANNER_ACTIONS:
+            print(f"[WARN] The banner at the top of the chat is still shown after "
+                  f"{MAX_BANNER_ACTIONS} attempts without older messages loading; "
+                  "stopping here.")
             break
 
-        driver.execute_script("arguments[0].scrollTop -= 700", chat_block)
-        time.sleep(2)
+        if defer_sync and action_to_take in ("syncing", "sync_paused"):
+            return "syncing"
+
+        if action_to_take == "syncing":
+            # Re-check whenever the chat changes rather than on a fixed timer
+            while True:
+                with scrape_metrics.current.phase("sync_wait"):
+                    page_waits.wait_for_mutation(
+                        driver, chat_block, page_waits.SYNC_POLL_TIMEOUT
+                    )
+                if identify_and_resolve_stopping_reason(driver) != "syncing":
+                    break
 
 
-def QR_code(driver):
+def has_existing_session(driver, timeout=LOGIN_CHECK_TIMEOUT):
     """
-    This function  waits for the user to scan the QR code using their phone, 
-    and confirms that the login was successful by waiting until the chat list becomes available.
+    Opens WhatsApp Web and finds out whether the browser profile is already logged in.
+    Returns as soon as either the chat list or the QR code is shown.
 
     Args:
         driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        timeout (float): The longest to wait for WhatsApp Web to load, in seconds.
+
+    Returns:
+        bool: True if the chat list is shown, False if a QR code must be scanned.
     """
-    driver.get("https://web.whatsapp.com")
+    driver.get(WHATSAPP_URL)
 
     try:
-        # Wait until the chat list appears, indicating login is complete
-        WebDriverWait(driver, 120).until(
-            EC.presence_of_element_located(
-                (By.XPATH, '//div[@aria-label="Chat list" and @role="grid"]')))
+        WebDriverWait(driver, timeout).until(EC.any_of(
+            EC.presence_of_element_located((By.XPATH, sel.CHAT_LIST_XPATH)),
+            EC.presence_of_element_located((By.XPATH, sel.QR_CODE_XPATH)),
+        ))
+    except TimeoutException:
+        return False
 
-        print("Log in succesful!")
-    
-    except:
-        print("Log in failed!")
+    return _has_element(driver, sel.CHAT_LIST_XPATH)
 
-def collect_messages(all_contact_names, driver):
-    """
-    Collects and structures message data from private WhatsApp chats.
 
-    For each private contact, this function:
-        1. Opens the chat by searching for the contact name.
-        2. Scrolls to the top of the chat to load all visible messages.
-        3. Iterates through each message and extracts relevant data including:
-            - Original message details
-            - Reply information (if the message is a reply)
-            - Media indicators (image, sticker, video)
-            - Timestamps and sender names
+def session_lost(driver):
+    """
+    Returns whether or not the browser stopped showing WhatsApp Web's chat list, e.g.
+    because its linked device was logged out or its session was taken over by another
+    browser of the same device.
 
     Args:
-        all_contact_names (set): A set of contact names to collect messages from.
-        driver (webdriver.Chrome): The Selenium WebDriver instance controlling Chrome.
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
 
     Returns:
-        list: A list of lists. Each sublist contains all parsed messages for a contact.
-              Each message is represented as:
-              [reply_sender, reply_message, reply_media, 
-               message_information, messages_text, image, sticker, video]
+        bool: True if the chat list is gone.
     """
-    messages_df = []
+    try:
+        return not _has_element(driver, sel.CHAT_LIST_XPATH)
+    except WebDriverException:
+        return True
 
-    for contact in all_contact_names:
-        search_for_contact(contact, driver)
 
-        time.sleep(10)
-        scroll_to_top_of_private_chat(driver)
+def reopen_whatsapp_tab(driver):
+    """
+    Replaces the WhatsApp Web tab with a fresh one, which releases everything the old
+    page accumulated. The old tab is closed before the new one loads WhatsApp Web, so
+    WhatsApp does not ask which tab to use.
 
-        print(f"Beginning to read messages from chat with {contact}!")
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
 
-        rows_of_messages = driver.find_element(
-            By.XPATH, '//div[@class="x3psx0u xwib8y2 xkhd6sd xrmvbpv"]'
-        )
+    Raises:
+        RuntimeError: If the new tab is not logged in.
+    """
+    old_tab = driver.current_window_handle
+    driver.switch_to.new_window("tab")
+    new_tab = driver.current_window_handle
+    driver.switch_to.window(old_tab)
+    driver.close()
+    driver.switch_to.window(new_tab)
 
-        all_messages_in_chat = rows_of_messages.find_elements(
-            By.XPATH, './/div[@tabindex="-1" and @role="row"]'
-        )
+    if not has_existing_session(driver):
+        raise RuntimeError("WhatsApp Web is no longer logged in after reopening it.")
 
-        current_contact_messages = []
-
-        for message_div in all_messages_in_chat:
-            reply_sender = None
-            reply_message = None
-            reply_media = False
-            message_information_div = None
-            message_information = None
-            image = False
-            sticker = False
-            video = False
-            messages_text = None
-            
-            # Handle replies
-            if _has_element(message_div, './/div[@class="_ahy0"]'):
-                reply_div = message_div.find_element(By.XPATH, './/div[@class="_ahy0"]')
-
-                reply_sender = reply_div.find_element(
-                    By.XPATH, './/span[@dir="auto" and contains(@class, "_ao3e")]'
-                ).text
-
-                if _has_element(reply_div, './/span[@dir="auto" and @class="quoted-mention _ao3e"]'):
-                    reply_message = reply_div.find_element(
-                        By.XPATH, './/span[@dir="auto" and @class="quoted-mention _ao3e"]'
-                    ).text
-                
-                if _has_element(reply_div, './/span[@data-icon="status-image"]'):
-                    reply_media = True
-                elif _has_element(reply_div, './/span[@data-icon="status-video"]'):
-                    reply_media = True
-
-            # Handle messages with text
-            if _has_element(message_div, './/div[@class="copyable-text"]'):
-                message_information_div = message_div.find_element(
-                    By.XPATH, './/div[@class="copyable-text"]'
-                )
-                message_information = message_information_div.get_attribute("data-pre-plain-text")
 
+def QR_code(driver, screenshot_path=None):
+    """
+    This function  waits for the user to scan the QR code using their phone, 
+    and confirms that the login was successful by waiting until the chat list becomes available.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        screenshot_path (str): If given (e.g. when running headless), the page is saved to
+                               this image every few seconds, so the QR code can be scanned
+                               from it while it refreshes.
 
-                try:
-                    text_span = message_div.find_element(By.XPATH, 
-                                    './/span[@class="_ao3e selectable-text copyable-text"]/span')
+    Returns:
+        bool: True if the login was successful, False otherwise.
+    """
+    if not driver.current_url.startswith(WHATSAPP_URL):
+        driver.get(WHATSAPP_URL)
 
-                    messages_text = text_span.text
-                except:
-                    messages_text = None
+    deadline = time.time() + QR_CODE_TIMEOUT
+    wait_time = QR_CODE_TIMEOUT if screenshot_path is None else QR_SCREENSHOT_INTERVAL
 
+    while True:
+        if screenshot_path is not None:
+            driver.save_screenshot(screenshot_path)
 
-            else:
-                # Handle media with no text
-                if _has_element(message_div, './/div[@class="_amk6 _amlo"]'):
-                    message_information_div = message_div.find_element(
-                        By.XPATH, './/div[@class="_amk6 _amlo"]'
-                    )
-                    name_of_sender_span = message_information_div.find_element(By.XPATH, './span')
-                    name_of_sender = name_of_sender_span.get_attribute("aria-label")
-
-                    if _has_element(message_information_div, './/span[@class="x1rg5ohu x16dsc37" and @dir="auto"]'):
-                        time_of_message_div = message_information_div.find_element(
-                            By.XPATH, './/span[@class="x1rg5ohu x16dsc37" '
-                            'and @dir="auto"]'
-                        )
-                        time_of_message = time_of_message_div.text
-                    else:
-                        time_of_message = "Unknown time"
-
-                    message_information = f"[{time_of_message}, None] {name_of_sender}:"
-
-            # Determine media types
-            if _has_element(message_div, './/span[@data-icon="media-download"]'):
-                if _has_element(message_div, './/div[@aria-label="Open picture"]'):
-                    image = True
-                else:
-                    sticker = True
+        try:
+            # Wait until the chat list appears, indicating login is complete
+            WebDriverWait(driver, wait_time).until(
+                EC.presence_of_element_located((By.XPATH, sel.CHAT_LIST_XPATH)))
 
-            # Photo
-            elif _has_element(message_div, './/div[@aria-label="Open picture"]'):
-                image = True
+            print("Log in succesful!")
+            return True
 
+        except TimeoutException:
+            if screenshot_path is None or time.time() >= deadline:
+                print("Log in failed!")
+                return False
 
-            # Sticker
-            elif _has_element(message_div, './/div[contains(@label, "Sticker")]'):
-                sticker = True
+def parse_message_row(message_div):
+    """
+    Extracts the fields of a single message row using Selenium element lookups.
 
-            # Video
-            elif _has_element(message_div, './/span[@data-icon="msg-video"]'):
-                video = True
-            
-            all_info_of_message = [reply_sender, reply_message, 
-                                   reply_media, message_information, 
-                                   messages_text, image, sticker, video]
+    Args:
+        message_div (WebElement): The element with role="row" that holds one message.
 
-            current_contact_messages.append(all_info_of_message)
-        
-        messages_df.append(current_contact_messages)
+    Returns:
+        list: [reply_sender, reply_message, reply_media,
+               message_information, messages_text, image, sticker, video]
+    """
+    reply_sender = None
+    reply_message = None
+    reply_media = False
+    message_information_div = None
+    message_information = None
+    image = False
+    sticker = False
+    video = False
+    messages_text = None
+
+    # Handle replies
+    if _has_element(message_div, sel.REPLY_DIV_XPATH):
+        reply_div = message_div.find_element(By.XPATH, sel.REPLY_DIV_XPATH)
+
+        reply_sender = reply_div.find_element(By.XPATH, sel.REPLY_SENDER_XPATH).text
+
+        if _has_element(reply_div, sel.REPLY_TEXT_XPATH):
+            reply_message = reply_div.find_element(By.XPATH, sel.REPLY_TEXT_XPATH).text
+
+        if _has_element(reply_div, sel.REPLY_IMAGE_XPATH):
+            reply_media = True
+        elif _has_element(reply_div, sel.REPLY_VIDEO_XPATH):
+            reply_media = True
+
+    # Handle messages with text
+    if _has_element(message_div, sel.COPYABLE_TEXT_XPATH):
+        message_information_div = message_div.find_element(By.XPATH, sel.COPYABLE_TEXT_XPATH)
+        message_information = message_information_div.get_attribute("data-pre-plain-text")
+
+        try:
+            text_span = message_div.find_element(By.XPATH, sel.MESSAGE_TEXT_XPATH)
+            messages_text = text_span.text
+        except:
+            messages_text = None
 
-    return messages_df
+    else:
+        # Handle media with no text
+        if _has_element(message_div, sel.MEDIA_INFO_XPATH):
+            message_information_div = message_div.find_element(By.XPATH, sel.MEDIA_INFO_XPATH)
+            name_of_sender_span = message_information_div.find_element(
+                By.XPATH, sel.MEDIA_SENDER_XPATH
+            )
+            name_of_sender = name_of_sender_span.get_attribute("aria-label")
 
+            if _has_element(message_information_div, sel.MEDIA_TIME_XPATH):
+                time_of_message_div = message_information_div.find_element(
+                    By.XPATH, sel.MEDIA_TIME_XPATH
+                )
+                time_of_message = time_of_message_div.text
+            else:
+                time_of_message = "Unknown time"
 
+            message_information = f"[{time_of_message}, None] {name_of_sender}:"
 
-def main():
-    print(STARTING_MESSAGE)
-    input("\nPress enter when you are ready!")
+    # Determine media types
+    if _has_element(message_div, sel.MEDIA_DOWNLOAD_XPATH):
+        if _has_element(message_div, sel.OPEN_PICTURE_XPATH):
+            image = True
+        else:
+            sticker = True
 
-    # Initiate driver
-    options = Options()
-    options.add_argument("--start-maximized")
-    service = Service()
-    driver = webdriver.Chrome(options, service)
+    # Photo
+    elif _has_element(message_div, sel.OPEN_PICTURE_XPATH):
+        image = True
 
-    QR_code(driver)
+    # Sticker
+    elif _has_element(message_div, sel.STICKER_XPATH):
+        sticker = True
 
-    # Find all the private chats
-    all_contact_names = find_contact_names(driver)
+    # Video
+    elif _has_element(message_div, sel.VIDEO_XPATH):
+        video = True
 
-    #Collect messages from each chat
-    messages = collect_messages(all_contact_names, driver)
+    return [reply_sender, reply_message,
+            reply_media, message_information,
+            messages_text, image, sticker, video]
 
-    # Save the messages
-    with open("whatsapp_messages.json", "w", encoding="utf-8") as f:
-        json.dump(messages, f, indent=2, ensure_ascii=False)
+
+def extract_messages_dom(driver, first_row=0, last_row=None):
+    """
+    Parses every rendered message row of the open chat with one Selenium lookup per field.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        first_row (int): The first row to parse.
+        last_row (int): The row after the last one to parse; None for the last row.
+
+    Returns:
+        list: The parsed messages, one 8-field list per row.
+    """
+    rows_of_messages = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+    all_messages_in_chat = rows_of_messages.find_elements(By.XPATH, sel.MESSAGE_ROW_XPATH)
+
+    return [parse_message_row(message_div)
+            for message_div in all_messages_in_chat[first_row:last_row]]
+
+
+def extract_messages_script(driver, batch_size=SCRIPT_BATCH_SIZE, first_row=0, last_row=None):
+    """
+    Parses every rendered message row of the open chat inside the browser.
+
+    The field logic of parse_message_row is run by EXTRACT_MESSAGES_JS, so a whole
+    batch of rows costs a single WebDriver round trip instead of 15-25 per message.
+    The output is identical to extract_messages_dom.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        batch_size (int): The number of rows parsed per execute_script call.
+        first_row (int): The first row to parse.
+        last_row (int): The row after the last one to parse; None for the last row.
+
+    Returns:
+        list: The parsed messages, one 8-field list per row.
+    """
+    rows_of_messages = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+    messages = []
+    start = first_row
+
+    while True:
+        limit = batch_size if last_row is None else min(batch_size, last_row - start)
+        if limit <= 0:
+            break
+
+        result = driver.execute_script(
+            EXTRACT_MESSAGES_JS, rows_of_messages, MESSAGE_SCRIPT_SELECTORS, start, limit
+        )
+        messages.extend(result["records"])
+        start += limit
+
+        if start >= result["total"]:
+            break
+
+    return messages
+
+
+def get_message_list_html(driver):
+    """
+    Returns the outerHTML of the open chat's message list in a single WebDriver round trip.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+
+    Returns:
+        str: The HTML of the message list.
+    """
+    rows_of_messages = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+    return rows_of_messages.get_attribute("outerHTML")
+
+
+def extract_messages_html(driver, first_row=0, last_row=None):
+    """
+    Parses every rendered message row of the open chat by fetching the message list's
+    HTML once and parsing it in-process with lxml (see html_snapshot_parser.py).
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        first_row (int): The first row to keep.
+        last_row (int): The row after the last one to keep; None for the last row.
+
+    Returns:
+        list: The parsed messages, one 8-field list per row.
+    """
+    messages = html_snapshot_parser.parse_messages_html(get_message_list_html(driver))
+    return messages[first_row:last_row]
+
+
+def save_chat_snapshot(driver, contact, snapshot_dir):
+    """
+    Saves the HTML of the open chat's message list so it can be re-parsed offline
+    with html_snapshot_parser.py.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        contact (str): The name of the open chat, used in the file name.
+        snapshot_dir (str): The directory the snapshot is written to.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    # Names differing only in emoji or punctuation would otherwise share one file
+    file_name = re.sub(r'[^\w\- ]', '_', contact).strip() or "chat"
+    name_hash = hashlib.sha1(contact.encode("utf-8")).hexdigest()[:8]
+
+    path = os.path.join(snapshot_dir, f"{file_name}-{name_hash}.html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(get_message_list_html(driver))
+
+
+def read_message_ids(driver):
+    """
+    Returns the data-id of every rendered message row of the open chat in one round trip.
+    The ids line up with the messages returned by the extractors.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+
+    Returns:
+        list: The data-id of each row, None for rows without one.
+    """
+    rows_of_messages = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+    return driver.execute_script(
+        MESSAGE_IDS_JS, rows_of_messages, sel.MESSAGE_ROW_XPATH, sel.MESSAGE_ID_XPATH
+    )
+
+
+def high_water_mark_visible(driver, mark):
+    """
+    Returns whether or not the message a high-water mark points at is rendered in the
+    open chat.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        mark (dict): The high-water mark from the previous run (see incremental_state.py).
+
+    Returns:
+        bool: True if the marked message is in the DOM.
+    """
+    rows_of_messages = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+    found = driver.execute_script(FIND_MARK_JS, rows_of_messages, mark, MESSAGE_SCRIPT_SELECTORS)
+
+    if found is True:
+        return True
+
+    return any(
+        incremental_state.text_hash(text) == mark.get("text_hash") for text in found
+    )
+
+
+def window_reached(driver, options):
+    """
+    Returns whether or not the open chat has loaded every row a bounded scrape needs:
+    a row older than options.since, or options.max_messages rows before options.until.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        options (ScrapeOptions): The bounds.
+
+    Returns:
+        bool: True if scrolling further cannot add a row to the window.
+    """
+    rows_of_messages = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+    bounds = driver.execute_script(
+        CHAT_BOUNDS_JS, rows_of_messages, MESSAGE_SCRIPT_SELECTORS, options.until
+    )
+
+    if options.since is not None and bounds["oldest"] is not None \
+            and bounds["oldest"] < options.since:
+        return True
+
+    return options.max_messages is not None and bounds["before"] >= options.max_messages
+
+
+def find_window(timestamps, options):
+    """
+    Returns which rows of a chat a bounded scrape keeps: those shown from options.since
+    and before options.until, and of those the last options.max_messages.
+
+    Args:
+        timestamps (list): The time of every row, oldest first (see ROW_TIME_PARSER_JS).
+                           Rows without a date, None, are dated like the row before them.
+        options (ScrapeOptions): The bounds.
+
+    Returns:
+        tuple: (first row, row after the last one) of the window.
+    """
+    first, last = 0, len(timestamps)
+
+    if options.since is not None or options.until is not None:
+        inside = []
+        last_time = None
+        for index, timestamp in enumerate(timestamps):
+            if timestamp is not None:
+                last_time = timestamp
+            if last_time is not None \
+                    and (options.since is None or last_time >= options.since) \
+                    and (options.until is None or last_time < options.until):
+                inside.append(index)
+        # Dates only grow down the chat, so the rows inside are contiguous
+        first, last = (inside[0], inside[-1] + 1) if inside else (0, 0)
+
+    if options.max_messages is not None:
+        first = max(first, last - options.max_messages)
+
+    return first, last
+
+
+def read_row_times(driver):
+    """
+    Returns the time of every rendered message row of the open chat in one round trip.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+
+    Returns:
+        list: Seconds since the epoch (read as UTC), None for rows without a date.
+    """
+    rows_of_messages = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+    return driver.execute_script(ROW_TIMES_JS, rows_of_messages, MESSAGE_SCRIPT_SELECTORS)
+
+
+def window_messages(message_ids, messages, options):
+    """
+    Keeps the messages of a bounded scrape that were extracted before the bounds could
+    be applied to the rows: harvested while scrolling or read from local storage.
+
+    Args:
+        message_ids (list or None): The data-id of each message.
+        messages (list): The 8-field messages, oldest first.
+        options (ScrapeOptions): The bounds.
+
+    Returns:
+        tuple: (message_ids, messages) inside the window.
+    """
+    if not options.bounded:
+        return message_ids, messages
+
+    timestamps = [record.timestamp for record in message_records.from_lists(messages)]
+    first, last = find_window(timestamps, options)
+    if message_ids is not None:
+        message_ids = message_ids[first:last]
+    return message_ids, messages[first:last]
+
+
+def read_chat_from_indexeddb(driver, contact):
+    """
+    Reads a private chat straight from WhatsApp Web's local IndexedDB copy, without
+    opening or scrolling it. The messages are mapped onto the same 8 fields as the DOM
+    extractors, and their ids are the data-ids of the rows they would be rendered as.
+
+    Args:
+        driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+        contact (str): The name of the chat as shown in the sidebar.
+
+    Returns:
+        tuple or None: (list of message ids, list of 8-field messages, whether they go back
+                       to the start of the chat), oldest first, or None if the chat's
+                       history is not stored locally.
+    """
+    try:
+        stored = driver.execute_async_script(
+            INDEXEDDB_CHAT_JS, contact, INDEXEDDB_NAME, INDEXEDDB_MESSAGE_TYPES,
+            INDEXEDDB_HISTORY_START_TYPE
+        )
+    except WebDriverException as e:
+        print(f"[WARN] Could not read the local history of '{contact}': {e.msg}")
+        return None
+
+    if stored is not None and "error" in stored:
+        print(f"[WARN] Could not read the local history of '{contact}': {stored['error']}")
+        return None
+
+    if stored is None:
+        return None
+
+    return stored["ids"], stored["messages"], stored["complete"]
+
+
+def stored_history_suffices(message_ids, messages, mark, options):
+    """
+    Returns whether the recent part of a chat kept in local storage holds every message
+    the scrape keeps: the previous run's high-water mark, or the start of a bounded
+    scrape's window, is among them.
+
+    Args:
+        message_ids (list): The data-id of each stored message.
+        messages (list): The stored 8-field messages, oldest first.
+        mark (dict or None): The high-water mark of an incremental run.
+        options (ScrapeOptions): The bounds.
+
+    Returns:
+        bool: True if the chat need not be scrolled for older messages.
+    """
+    if mark is not None and \
+            incremental_state.find_mark_index(mark, message_ids, messages) != -1:
+        return True
+
+    if options.bounded:
+        timestamps = [record.timestamp for record in message_records.from_lists(messages)]
+        # A message older than the window is stored, so the whole window is
+        return find_window(timestamps, options)[0] > 0
+
+    return False
+
+
+EXTRACTORS = {
+    "dom": extract_messages_dom,
+    "script": extract_messages_script,
+    "html": extract_messages_html,
+}
+
+# "indexeddb" reads chats from WhatsApp Web's local storage and falls back to scrolling
+# and the "script" extractor for chats whose history is not stored
+INDEXEDDB_FALLBACK_EXTRACTION = "script"
+EXTRACTION_MODES = sorted([*EXTRACTORS, "indexeddb"])
+
+
+class MessageHarvester:
+    """
+    Extracts message rows while the chat is being scrolled instead of after it.
+
+    Every call to harvest() parses only the rows rendered since the previous call and
+    de-duplicates them by their data-id, so the work per scroll step stays flat however
+    long the chat is. With prune=True the harvested rows below the visible area are
+    emptied, which keeps the DOM, and with it browser memory and query cost, bounded.
+    """
+
+    def __init__(self, prune=False, mark=None):
+        """
+        Args:
+            prune (bool): Whether to empty harvested rows once they are scrolled out of view.
+            mark (dict): Optional high-water mark; reached_mark is set once it is harvested.
+        """
+        self.prune = prune
+        self.mark = mark
+        self.reached_mark = False
+        self._seen_ids = set()
+        # Batches rendered above everything harvested so far, each older than the last
+        self._older_batches = []
+        # Rows rendered below harvested rows, e.g. messages arriving while scrolling
+        self._newer_records = []
+
+    def harvest(self, driver):
+        """
+        Parses the rows rendered since the last call.
+
+        Args:
+            driver (WebDriver): The Selenium WebDriver instance controlling Chrome.
+
+        Returns:
+            int: The number of new messages.
+        """
+        with scrape_metrics.current.phase("harvest"):
+            rows_of_messages = driver.find_element(By.XPATH, sel.MESSAGE_LIST_XPATH)
+            chat_block = driver.find_element(By.XPATH, sel.CHAT_CONTAINER_XPATH)
+            records = driver.execute_script(
+                HARVEST_MESSAGES_JS, rows_of_messages, MESSAGE_SCRIPT_SELECTORS, chat_block,
+                self.prune
+            )
+
+        older = []
+        new_messages = 0
+        for record in records:
+            message_id = record["id"]
+            if message_id is not None:
+                if message_id in self._seen_ids:
+                    continue
+                self._seen_ids.add(message_id)
+
+            if self.mark is not None and incremental_state.matches_mark(
+                self.mark, message_id, record["fields"][3], record["fields"][4]
+            ):
+                self.reached_mark = True
+
+            if record["below"]:
+                self._newer_records.append(record)
+            else:
+                older.append(record)
+            new_messages += 1
+
+        if older:
+            self._older_batches.append(older)
+
+        return new_messages
+
+    def results(self):
+        """
+        Returns everything harvested, oldest message first.
+
+        Returns:
+            tuple: (list of data-ids, list of 8-field messages)
+        """
+        records = [
+            record for batch in reversed(self._older_batches) for record in batch
+        ] + self._newer_records
+        return [record["id"] for record in records], [record["fields"] for record in records]
+
+
+@dataclass
+class ScrapeOptions:
+    """
+    How each chat is scraped by iter_chat_messages.
+
+    Attributes:
+        extraction (str): "dom" to parse rows with Selenium lookups, "script" to parse
+                          them in a single in-page script per batch of rows, "html"
+                          to parse the message list's HTML in-process, or "indexeddb"
+                          to read the chat from WhatsApp Web's local storage.
+        snapshot_dir (str): If given, the HTML of each chat is saved in this directory.
+        harvest (bool): Extract rows at every scroll step instead of once at the top
+                        (always uses the in-page parser).
+        prune_dom (bool): When harvesting, empty rows once they are harvested and out of view.
+        sync_retries (int): How often a chat that is still syncing is parked and retried
+                            later before it is scraped waiting for the sync; 0 always waits.
+        media (MediaPipeline): If given, the media of every chat read from the page are
+                               saved through it.
+        max_messages (int): Only keep the newest this many messages of every chat, and
+                            stop scrolling once they are loaded.
+        since (int): Only keep messages shown at or after this time (seconds since the
+                     epoch, read as UTC), and stop scrolling at the first older one.
+        until (int): Only keep messages shown before this time.
+        keep_ids (bool): Give every MessageRecord the data-id of its row, e.g. to key the
+                         messages of a persistent archive.
+    """
+    extraction: str = "dom"
+    snapshot_dir: str = None
+    harvest: bool = False
+    prune_dom: bool = False
+    sync_retries: int = DEFAULT_SYNC_RETRIES
+    media: media_pipeline.MediaPipeline = None
+    max_messages: int = None
+    since: int = None
+    until: int = None
+    keep_ids: bool = False
+
+    @property
+    def bounded(self):
+        return (self.max_messages is not None or self.since is not None
+                or self.until is not None)
+
+    @classmethod
+    def from_args(cls, args, media=None):
+        return cls(
+            extraction=args.extraction,
+            snapshot_dir=args.save_snapshots,
+            harvest=args.harvest_while_scrolling,
+            prune_dom=args.prune_dom,
+            sync_retries=args.sync_retries,
+            media=media,
+            max_messages=args.max_messages_per_chat,
+            since=args.since,
+            until=args.until,
+            keep_ids=args.output_format == "sqlite",
+        )
+
+
+def _scrape_chat_page(contact, driver, options, mark, handle, defer_sync, need_ids):
+    """
+    Opens a chat, scrolls it to the top (or to the high-water mark, or until a bounded
+    scrape's window is loaded) and extracts its rendered rows. See scrape_chat.
+
+    Returns:
+        tuple or None: (list of data-ids or None, list of 8-field messages, message list
+                       row of the first message), or None if the chat was given up
+                       because of defer_sync.
+    """
+    extraction = options.extraction
+    if extraction == "indexeddb":
+        extraction = INDEXEDDB_FALLBACK_EXTRACTION
+    extract_messages = EXTRACTORS[extraction]
+    metrics = scrape_metrics.current
+
+    opened = False
+    if handle is not None:
+        with metrics.phase("navigate"):
+            opened = open_chat_from_sidebar(driver, handle)
+
+    if not opened:
+        with metrics.phase("search"):
+            search_for_contact(contact, driver)
+        with metrics.phase("open_chat"):
+            page_waits.wait_for_chat_open(driver, contact)
+
+    harvester = None
+    stop_conditions = []
+
+    if options.harvest:
+        harvester = MessageHarvester(prune=options.prune_dom, mark=mark)
+        if mark is not None:
+            stop_conditions.append(lambda driver, harvester=harvester: harvester.reached_mark)
+    elif mark is not None:
+        stop_conditions.append(lambda driver, mark=mark: high_water_mark_visible(driver, mark))
+
+    if options.bounded:
+        stop_conditions.append(lambda driver: window_reached(driver, options))
+
+    stop_condition = None
+    if stop_conditions:
+        stop_condition = lambda driver: any(condition(driver) for condition in stop_conditions)
+
+    if harvester is not None:
+        print(f"Reading messages from chat with {contact} while scrolling!")
+
+    with metrics.phase("scroll"):
+        reason = scroll_to_top_of_private_chat(
+            driver, stop_condition=stop_condition,
+            on_step=harvester.harvest if harvester is not None else None,
+            defer_sync=defer_sync
+        )
+
+    if reason == "syncing":
+        return None
+
+    if options.snapshot_dir is not None:
+        with metrics.phase("snapshot"):
+            save_chat_snapshot(driver, contact, options.snapshot_dir)
+
+    if harvester is not None:
+        return (*window_messages(*harvester.results(), options), 0)
+
+    print(f"Beginning to read messages from chat with {contact}!")
+    with metrics.phase("extract"):
+        first_row, last_row = 0, None
+        if options.bounded:
+            first_row, last_row = find_window(read_row_times(driver), options)
+        messages = extract_messages(driver, first_row=first_row, last_row=last_row)
+        message_ids = read_message_ids(driver)[first_row:last_row] if need_ids else None
+    return message_ids, messages, first_row
+
+
+def scrape_chat(contact, driver, options=None, state=None, handle=None, defer_sync=False):
+    """
+    Opens one private chat and returns its parsed messages.
+
+    The chat is opened from its sidebar row when a handle is given, or else (and if
+    that fails) by searching for the contact name, and scrolled to the top to load
+    all visible messages (or, in incremental mode, until the last message archived by
+    the previous run). Every message row is then parsed into:
+        - Original message details
+        - Reply information (if the message is a reply)
+        - Media indicators (image, sticker, video)
+        - Timestamps and sender names
+    When harvesting, rows are parsed at every scroll step instead. With the "indexeddb"
+    extraction the messages are read from WhatsApp Web's local storage instead, and the
+    chat is only opened and scrolled if its history is not stored there. With a media
+    pipeline, the media of the rows are then fetched while the chat is still open. A
+    bounded scrape (options.max_messages, options.since, options.until) stops scrolling
+    as soon as its window is loaded and only extracts the rows inside it.
+
+    Args:
+        contact (str): The name of the chat.
+        driver (webdriver.Chrome): The Selenium WebDriver instance controlling Chrome.
+        options (ScrapeOptions): How the chat is scraped; the defaults if None.
+        state (IncrementalState): If given, only messages newer than the contact's
+                                  high-water mark are returned, and the new mark is
+                                  staged. The caller commits and saves it once the
+                                  messages are written.
+        handle (ChatHandle): Where find_contact_names saw the chat in the sidebar.
+        defer_sync (bool): Give up on the chat if WhatsApp is still syncing it, instead
+                           of waiting for the sync.
+
+    Returns:
+        list or None: The parsed messages as MessageRecords, oldest first, or None if
+              the chat was given up because of defer_sync. Their to_list() gives the
+              original format, and their media the saved media file, if any:
+              [reply_sender, reply_message, reply_media, 
+               message_information, messages_text, image, sticker, video]
+    """
+    options = options or ScrapeOptions()
+    metrics = scrape_metrics.current
+
+    with metrics.chat(contact) as chat_metrics:
+        mark = state.get(contact) if state is not None else None
+        scraped = None
+        from_storage = False
+
+        if options.extraction == "indexeddb":
+            with metrics.phase("indexeddb"):
+                stored = read_chat_from_indexeddb(driver, contact)
+            if stored is None:
+                print(f"No local history for {contact}, scrolling through the chat instead.")
+            elif not stored[2] and not stored_history_suffices(*stored[:2], mark, options):
+                print(f"Only the last {len(stored[1])} messages of {contact} are stored "
+                      "locally, scrolling through the chat instead.")
+            else:
+                print(f"Read {len(stored[1])} messages of {contact} from local storage!")
+                scraped = (*window_messages(*stored[:2], options), 0)
+                from_storage = True
+
+        if scraped is None:
+            scraped = _scrape_chat_page(
+                contact, driver, options, mark, handle, defer_sync,
+                need_ids=(state is not None or options.media is not None
+                          or options.keep_ids)
+            )
+            if scraped is None:
+                chat_metrics["deferred"] = True
+                return None
+
+        message_ids, messages, first_row = scraped
+
+        if state is not None:
+            if mark is not None:
+                mark_index = incremental_state.find_mark_index(mark, message_ids, messages)
+                # A bounded scrape may stop before the mark: then every message is new
+                if mark_index == -1 and not options.bounded:
+                    print(f"[WARN] Last archived message for '{contact}' not found, "
+                          "keeping every loaded message.")
+                first_row += mark_index + 1
+                message_ids = message_ids[mark_index + 1:]
+                messages = messages[mark_index + 1:]
+
+            state.update(contact, incremental_state.make_mark(message_ids, messages))
+            print(f"{len(messages)} new messages since the last run.")
+
+        media = None
+        if options.media is not None and not from_storage and not options.harvest:
+            try:
+                with metrics.phase("media"):
+                    media = options.media.fetch_chat(
+                        driver, contact, messages, message_ids, first_row
+                    )
+            except WebDriverException as e:
+                print(f"[WARN] Could not fetch the media of '{contact}': {e}")
+
+        chat_metrics["messages"] = len(messages)
+
+    records = message_records.from_lists(messages)
+    if media is not None:
+        for record, path in zip(records, media):
+            record.media = path
+    if options.keep_ids and message_ids is not None:
+        for record, message_id in zip(records, message_ids):
+            record.message_id = message_id
+    return records
+
+
+class ChatScheduler:
+    """
+    Hands out the chats to scrape. A chat that WhatsApp is still syncing is parked with
+    defer() instead of being waited for, and handed out again once its backoff has
+    expired, while the phone keeps syncing in the background. Until then the other chats
+    are scraped, so a run takes about as long as its longest sync rather than the sum of
+    all syncs. Safe to share between the worker threads of a parallel run.
+    """
+
+    def __init__(self, all_contact_names, sync_retries=DEFAULT_SYNC_RETRIES):
+        handles = all_contact_names if isinstance(all_contact_names, dict) else {}
+        self.sync_retries = sync_retries
+        self._pending = deque((contact, handles.get(contact)) for contact in all_contact_names)
+        self._deferred = []
+        self._attempts = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        """
+        Returns the next chat to scrape: a parked chat whose backoff has expired, or else
+        a chat not tried yet. If only parked chats are left, blocks until the first one
+        is due. The wait sleeps through time.sleep in short steps rather than waiting on
+        a lock, so it also ends under the virtual clock of a replay (webdriver_trace.py),
+        which only moves when slept on.
+
+        Returns:
+            tuple or None: (contact, ChatHandle or None, whether the chat may be deferred
+                           again), or None once every chat has been handed out.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self._deferred and self._deferred[0][0] <= now:
+                    _, _, contact, handle, attempts = heapq.heappop(self._deferred)
+                elif self._pending:
+                    contact, handle = self._pending.popleft()
+                    attempts = 0
+                elif self._deferred:
+                    # Re-checked every step: another worker may park a chat due sooner
+                    wait = min(self._deferred[0][0] - now, SYNC_RETRY_POLL_INTERVAL)
+                    contact = None
+                else:
+                    return None
+
+                if contact is not None:
+                    self._attempts[contact] = attempts
+                    return contact, handle, attempts < self.sync_retries
+
+            time.sleep(wait)
+
+    def defer(self, contact, handle):
+        """
+        Parks a chat that is still syncing until its backoff expires.
+
+        Args:
+            contact (str): The name of the chat.
+            handle (ChatHandle or None): Its sidebar handle.
+        """
+        with self._lock:
+            attempts = self._attempts.get(contact, 0)
+            delay = min(SYNC_RETRY_DELAY * 2 ** attempts, SYNC_RETRY_MAX_DELAY)
+            self._sequence += 1
+            heapq.heappush(
+                self._deferred,
+                (time.monotonic() + delay, self._sequence, contact, handle, attempts + 1)
+            )
+
+        print(f"'{contact}' is still syncing, coming back to it in {delay}s.")
+
+    def requeue(self, contact, handle):
+        """
+        Hands a chat out again straight away, e.g. to another worker after the one it
+        was given to lost its session.
+
+        Args:
+            contact (str): The name of the chat.
+            handle (ChatHandle or None): Its sidebar handle.
+        """
+        with self._lock:
+            self._pending.appendleft((contact, handle))
+
+
+def iter_chat_messages(all_contact_names, driver, options=None, state=None, memory=None):
+    """
+    Scrapes the private chats (see scrape_chat) and yields each chat's parsed messages as
+    soon as the chat is done, so callers can write them out without holding every chat
+    in memory. Chats that are still syncing are revisited later (see ChatScheduler).
+
+    Args:
+        all_contact_names (dict or set): The contacts to collect messages from, as
+                                         returned by find_contact_names ({name:
+                                         ChatHandle}) or as plain names.
+        driver (webdriver.Chrome): The Selenium WebDriver instance controlling Chrome.
+        options (ScrapeOptions): How each chat is scraped; the defaults if None.
+        state (IncrementalState): If given, only messages newer than each contact's
+                                  high-water mark are yielded, and the new marks are
+                                  staged. The caller commits and saves them.
+        memory (MemoryManager): If given, samples the browser's memory after every chat
+                                and recycles it when needed (see browser_memory.py).
+
+    Yields:
+        tuple: (contact name, list of MessageRecords), see scrape_chat.
+    """
+    options = options or ScrapeOptions()
+    scheduler = ChatScheduler(all_contact_names, options.sync_retries)
+
+    while (chat := scheduler.next()) is not None:
+        contact, handle, defer_sync = chat
+        messages = scrape_chat(contact, driver, options, state, handle, defer_sync)
+        if memory is not None:
+            try:
+                driver = memory.after_chat(driver)
+            except RuntimeError as e:
+                # Without a browser no more chats can be scraped; the finished ones are kept
+                print(f"[WARN] Stopping early: {e}")
+                if messages is not None:
+                    yield contact, messages
+                return
+        if messages is None:
+            scheduler.defer(contact, handle)
+            continue
+        yield contact, messages
+
+
+def _chat_worker(worker_id, driver, scheduler, results, options, state, memory=None):
+    """
+    Scrapes the chats handed out by the scheduler with one browser until none are left.
+
+    Args:
+        worker_id (int): The number of the worker, used in its progress messages.
+        driver (webdriver.Chrome): The worker's own WebDriver instance.
+        scheduler (ChatScheduler): The shared scheduler of the chats still to scrape.
+        results (queue.Queue): Receives a (contact, messages, error) tuple per contact.
+        options (ScrapeOptions): How each chat is scraped.
+        state (IncrementalState): The shared incremental state, or None.
+        memory (MemoryManager): The worker's memory manager, or None.
+    """
+    while (chat := scheduler.next()) is not None:
+        contact, handle, defer_sync = chat
+
+        started = time.time()
+        try:
+            messages = scrape_chat(contact, driver, options, state, handle, defer_sync)
+        except Exception as e:
+            error = e
+            messages = None
+        else:
+            error = None
+
+        # A logged-out or taken-over browser fails or finds nothing in every chat
+        if (error is not None or messages == []) and session_lost(driver):
+            print(f"[ERROR] Worker {worker_id} stops: its browser is no longer logged in "
+                  "to WhatsApp Web (logged out, or its session was taken over by another "
+                  "browser of the same linked device). Log its profile in again.")
+            scheduler.requeue(contact, handle)
+            return
+
+        if error is not None:
+            results.put((contact, None, error))
+            continue
+
+        if memory is not None:
+            try:
+                driver = memory.after_chat(driver)
+            except RuntimeError as e:
+                # Without a browser this worker cannot take more chats; the others go on
+                print(f"[WARN] Worker {worker_id} stops: {e}")
+                if messages is not None:
+                    results.put((contact, messages, None))
+                    return
+                scheduler.defer(contact, handle)
+                return
+
+        if messages is None:
+            scheduler.defer(contact, handle)
+            continue
+
+        print(f"[worker {worker_id}] {contact}: {len(messages)} messages "
+              f"in {time.time() - started:.1f}s")
+        results.put((contact, messages, None))
+
+
+def iter_chat_messages_parallel(all_contact_names, drivers, options=None, state=None,
+                                memory_managers=None):
+    """
+    Scrapes the private chats with several browsers at once and yields each chat's
+    messages as soon as any worker finishes it.
+
+    Most of the time spent on a chat is waiting for WhatsApp Web to render or sync, so
+    every driver gets its own worker thread, and the workers take contacts from a shared
+    ChatScheduler. The results are yielded on the calling thread, so writers and the incremental
+    state are used exactly as with iter_chat_messages.
+
+    Args:
+        all_contact_names (dict or set): The contacts to collect messages from, see
+                                         iter_chat_messages.
+        drivers (list): One logged-in WebDriver instance per worker.
+        options (ScrapeOptions): How each chat is scraped; the defaults if None.
+        state (IncrementalState): If given, only messages newer than each contact's
+                                  high-water mark are yielded.
+        memory_managers (list): Optionally one MemoryManager per driver.
+
+    Yields:
+        tuple: (contact name, list of messages), in the order the chats finish.
+    """
+    options = options or ScrapeOptions()
+    scheduler = ChatScheduler(all_contact_names, options.sync_retries)
+    memory_managers = memory_managers or [None] * len(drivers)
+
+    results = queue.Queue()
+    workers = [
+        threading.Thread(
+            target=_chat_worker,
+            args=(worker_id, driver, scheduler, results, options, state, memory),
+            daemon=True
+        )
+        for worker_id, (driver, memory) in enumerate(zip(drivers, memory_managers), start=1)
+    ]
+    for worker in workers:
+        worker.start()
+
+    for done in range(1, len(all_contact_names) + 1):
+        while True:
+            try:
+                contact, messages, error = results.get(timeout=1)
+                break
+            except queue.Empty:
+                # Workers stop early if their browser cannot be restarted
+                if not any(worker.is_alive() for worker in workers) and results.empty():
+                    print(f"[WARN] Every browser stopped, {len(all_contact_names) - done + 1} "
+                          "chats were not scraped.")
+                    return
+
+        if error is not None:
+            print(f"[WARN] Could not scrape the chat with '{contact}': {error}")
+            continue
+
+        print(f"Finished {done}/{len(all_contact_names)} chats.")
+        yield contact, messages
+
+
+def create_driver(user_data_dir=None, parallel=False, headless=False, window_size=None):
+    """
+    Starts Chrome.
+
+    Args:
+        user_data_dir (str): Optional Chrome profile directory, so the WhatsApp Web session
+                             is kept between runs.
+        parallel (bool): Whether several browsers will work at once. Chrome then must not
+                         throttle windows that are in the background or covered.
+        headless (bool): Whether to run Chrome without a window.
+        window_size (str): "WIDTH,HEIGHT" of the window; defaults to maximized, or to
+                           DEFAULT_WINDOW_SIZE when headless.
+
+    Returns:
+        webdriver.Chrome: The new WebDriver instance.
+    """
+    options = Options()
+
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument(f"--window-size={window_size or DEFAULT_WINDOW_SIZE}")
+    elif window_size is not None:
+        options.add_argument(f"--window-size={window_size}")
+    else:
+        options.add_argument("--start-maximized")
+
+    if user_data_dir is not None:
+        options.add_argument(f"--user-data-dir={os.path.abspath(user_data_dir)}")
+
+    if parallel:
+        options.add_argument("--disable-background-timer-throttling")
+        options.add_argument("--disable-backgrounding-occluded-windows")
+        options.add_argument("--disable-renderer-backgrounding")
+
+    service = Service()
+    driver = webdriver.Chrome(options, service)
+
+    if headless:
+        # WhatsApp Web refuses browsers that identify as HeadlessChrome
+        user_agent = driver.execute_script("return navigator.userAgent")
+        driver.execute_cdp_cmd(
+            "Network.setUserAgentOverride", {"userAgent": user_agent.replace("Headless", "")}
+        )
+
+    return driver
+
+
+def start_session(args, user_data_dir=None, parallel=False, name="Chrome", worker_id=1):
+    """
+    Starts a browser and makes sure it is logged in to WhatsApp Web.
+
+    A profile that is already logged in is used straight away. Otherwise the user is
+    prompted to scan the QR code, unless the run is unattended, in which case the
+    browser is closed.
+
+    Args:
+        args (argparse.Namespace): The parsed command line options.
+        user_data_dir (str): The Chrome profile directory to use, or None.
+        parallel (bool): Whether several browsers will work at once.
+        name (str): How the browser is referred to in messages.
+        worker_id (int): The number of the browser, used to name its --record-trace file.
+
+    Returns:
+        webdriver.Chrome or None: The logged-in WebDriver instance, or None on failure.
+    """
+    driver = create_driver(
+        user_data_dir, parallel=parallel, headless=args.headless, window_size=args.window_size
+    )
+    if args.record_trace is not None:
+        webdriver_trace.record_driver(
+            driver, webdriver_trace.trace_path_for_worker(args.record_trace, worker_id)
+        )
+    scrape_metrics.instrument_driver(driver)
+    page_waits.configure_waits(driver, args.max_wait)
+
+    if has_existing_session(driver):
+        print(f"{name} is already logged in, skipping the QR code.")
+        return driver
+
+    if args.unattended:
+        print(f"[ERROR] {name} is not logged in to WhatsApp Web. Run once without "
+              "--unattended to scan the QR code into the profile.")
+        driver.quit()
+        return None
+
+    print(STARTING_MESSAGE)
+    input(f"\nPress enter when you are ready to scan the QR code for {name}!")
+
+    screenshot_path = None
+    if args.headless:
+        screenshot_path = os.path.abspath("whatsapp_qr_code.png")
+        print(f"Scan the QR code saved to {screenshot_path}")
+
+    if QR_code(driver, screenshot_path=screenshot_path):
+        return driver
+
+    driver.quit()
+    return None
+
+
+def restart_session(driver, args, user_data_dir=None, parallel=False, name="Chrome",
+                    worker_id=1):
+    """
+    Quits a browser and starts a new one on the same Chrome profile, which is still
+    logged in, to give back all the memory the old one held.
+
+    Args:
+        driver (WebDriver): The browser to quit.
+        args, user_data_dir, parallel, name, worker_id: See start_session.
+
+    Returns:
+        webdriver.Chrome or None: The new logged-in WebDriver instance, or None on failure.
+    """
+    driver.quit()
+    return start_session(args, user_data_dir, parallel=parallel, name=name, worker_id=worker_id)
+
+
+def memory_manager(args, user_data_dir=None, parallel=False, name="Chrome", worker_id=1):
+    """
+    Returns the MemoryManager of one browser, set up from the command line options.
+
+    Args:
+        args (argparse.Namespace): The parsed command line options.
+        user_data_dir, parallel, name, worker_id: How the browser was started, see
+                                                  start_session.
+
+    Returns:
+        browser_memory.MemoryManager: The browser's memory manager.
+    """
+    return browser_memory.MemoryManager(
+        browser_memory.MemoryPolicy.from_args(args),
+        reopen_whatsapp_tab,
+        restart_driver=lambda driver: restart_session(
+            driver, args, user_data_dir, parallel=parallel, name=name, worker_id=worker_id
+        ),
+        name=name,
+    )
+
+
+def worker_profile_dirs(user_data_dir, workers):
+    """
+    Returns the Chrome profile of every worker. Chrome cannot open one profile twice, and
+    WhatsApp Web keeps one session per linked device, so every extra browser runs in its
+    own profile that is logged in once as a device of its own: start_session asks for its
+    QR code the first time. A copy of the main profile would be the same device, and the
+    browsers would keep taking the session over from each other.
+
+    Args:
+        user_data_dir (str): The main Chrome profile directory.
+        workers (int): The total number of workers, including the main browser.
+
+    Returns:
+        list: The profile directory of every worker except the main browser.
+    """
+    return [
+        f"{user_data_dir.rstrip(os.sep)}-worker{worker_id}"
+        for worker_id in range(2, workers + 1)
+    ]
+
+
+def collect_messages(all_contact_names, driver, options=None):
+    """
+    Collects and structures message data from private WhatsApp chats.
+    See iter_chat_messages for the steps taken for each chat.
+
+    Args:
+        all_contact_names (dict or set): The contacts to collect messages from, see
+                                         iter_chat_messages.
+        driver (webdriver.Chrome): The Selenium WebDriver instance controlling Chrome.
+        options (ScrapeOptions): How each chat is scraped; the defaults if None.
+
+    Returns:
+        list: A list of lists. Each sublist contains all parsed messages for a contact.
+              Each message is represented as:
+              [reply_sender, reply_message, reply_media, 
+               message_information, messages_text, image, sticker, video]
+    """
+    return [
+        [message.to_list() for message in messages]
+        for _, messages in iter_chat_messages(all_contact_names, driver, options)
+    ]
+
+
+def parse_arguments():
+    """
+    Parses the command line options of the scraper.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description="Scrape private chats from WhatsApp Web.")
+    parser.add_argument(
+        "--extraction", choices=EXTRACTION_MODES, default="dom",
+        help="How message rows are parsed: 'dom' issues Selenium lookups per field, "
+             "'script' parses batches of rows in a single in-page script, 'html' parses "
+             "the chat's HTML in-process with lxml, 'indexeddb' reads chats from WhatsApp "
+             "Web's local storage without scrolling and falls back to 'script' for chats "
+             "that are not stored."
+    )
+    parser.add_argument(
+        "--sidebar-extraction", choices=SIDEBAR_EXTRACTION_MODES, default="dom",
+        help="How sidebar rows are read: 'dom' issues Selenium lookups per row, "
+             "'html' parses the side panel's HTML in-process with lxml, 'script' reads "
+             "all rendered rows in one in-page script per tick and covers the sidebar once."
+    )
+    parser.add_argument(
+        "--output-format", choices=sorted(WRITERS), default="json",
+        help="'json' writes one nested list when the run ends; 'jsonl' streams one record "
+             "per message and flushes to disk after every chat; 'records' streams like "
+             "'jsonl' with the timestamp and sender already parsed; 'sqlite' upserts into a "
+             "persistent archive that keeps growing across runs (see message_store.py)."
+    )
+    parser.add_argument(
+        "--output", default=None,
+        help="The output file (default: whatsapp_messages.json, .jsonl, .records.jsonl or "
+             ".sqlite). "
+             "Names ending in .gz or .zst are compressed."
+    )
+    parser.add_argument(
+        "--columnar-output", metavar="PATH", default=None,
+        help="Also export every chat to a columnar file with one row group per chat: "
+             "Parquet, or Arrow IPC if PATH ends in .arrow or .feather. Requires pyarrow."
+    )
+    parser.add_argument(
+        "--incremental", metavar="STATE_FILE", nargs="?", const="scrape_state.json",
+        default=None,
+        help="Only scrape messages newer than the previous run. The last archived message "
+             "of each chat is kept in STATE_FILE (default: scrape_state.json) and scrolling "
+             "stops as soon as it is visible."
+    )
+    parser.add_argument(
+        "--contact-directory", metavar="PATH", nargs="?",
+        const=contact_directory.DEFAULT_DIRECTORY_PATH, default=None,
+        help="Remember every sidebar chat's classification, last activity and position in "
+             f"PATH (default: {contact_directory.DEFAULT_DIRECTORY_PATH}), so later runs only "
+             "classify new or changed rows and stop reading the sidebar at a run of "
+             "unchanged ones."
+    )
+    parser.add_argument(
+        "--skip-unchanged", action="store_true",
+        help="With --contact-directory, only scrape chats whose sidebar row shows activity "
+             "since they were last scraped. Needs an output that keeps earlier runs: "
+             "--incremental or --output-format sqlite."
+    )
+    parser.add_argument(
+        "--max-messages-per-chat", type=int, default=None, metavar="N",
+        help="Only scrape the newest N messages of every chat; scrolling stops as soon as "
+             "they are loaded."
+    )
+    parser.add_argument(
+        "--since", type=message_store.parse_date, default=None, metavar="YYYY-MM-DD",
+        help="Only scrape messages sent on or after this day; scrolling stops at the first "
+             "older message."
+    )
+    parser.add_argument(
+        "--until", type=message_store.parse_date, default=None, metavar="YYYY-MM-DD",
+        help="Only scrape messages sent before this day."
+    )
+    parser.add_argument(
+        "--max-wait", type=float, default=page_waits.DEFAULT_WAIT_CEILING, metavar="SECONDS",
+        help="The longest any single wait for WhatsApp Web to load or sync may block "
+             f"(default: {page_waits.DEFAULT_WAIT_CEILING})."
+    )
+    parser.add_argument(
+        "--sync-retries", type=int, default=DEFAULT_SYNC_RETRIES, metavar="N",
+        help="How often a chat that WhatsApp is still syncing is set aside and retried later "
+             f"(after {SYNC_RETRY_DELAY}s, doubling up to {SYNC_RETRY_MAX_DELAY}s) while other "
+             "chats are scraped, before waiting for its sync. 0 always waits "
+             f"(default: {DEFAULT_SYNC_RETRIES})."
+    )
+    parser.add_argument(
+        "--harvest-while-scrolling", action="store_true",
+        help="Extract the newly rendered rows at every scroll step instead of once the top "
+             "of the chat is reached."
+    )
+    parser.add_argument(
+        "--prune-dom", action="store_true",
+        help="With --harvest-while-scrolling, empty harvested rows once they are out of view "
+             "so browser memory stays flat on long chats."
+    )
+    parser.add_argument(
+        "--user-data-dir", metavar="DIR", default=None,
+        help="Chrome profile directory to run WhatsApp Web in, so the session is kept "
+             "between runs."
+    )
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="Run Chrome without a window. Best combined with a logged-in --user-data-dir."
+    )
+    parser.add_argument(
+        "--window-size", metavar="WIDTH,HEIGHT", default=None,
+        help=f"Fixed browser window size (default: maximized, or {DEFAULT_WINDOW_SIZE} "
+             "when headless)."
+    )
+    parser.add_argument(
+        "--unattended", action="store_true",
+        help="Never prompt: exit with an error instead of asking for a QR code scan. "
+             "For scheduled runs on a logged-in --user-data-dir."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Number of browsers scraping chats at the same time. Requires --user-data-dir; "
+             "worker N uses the profile DIR-workerN, logged in once as its own linked device."
+    )
+    parser.add_argument(
+        "--max-browser-memory", type=float, default=None, metavar="MB",
+        help="Recycle a browser between chats once its Chrome processes use more than MB "
+             "of resident memory (default: never, e.g. 3072 on long runs)."
+    )
+    parser.add_argument(
+        "--max-js-heap", type=float, default=None, metavar="MB",
+        help="Also recycle a browser once WhatsApp Web's JS heap exceeds MB."
+    )
+    parser.add_argument(
+        "--recycle-every", type=int, default=None, metavar="N",
+        help="Recycle every browser after N chats, whatever its memory use."
+    )
+    parser.add_argument(
+        "--recycle", choices=browser_memory.RECYCLE_ACTIONS, default="tab",
+        help="How a browser is recycled: 'tab' reopens WhatsApp Web in a fresh tab, "
+             "'driver' restarts Chrome on its --user-data-dir profile (default: tab)."
+    )
+    parser.add_argument(
+        "--save-media", metavar="DIR", default=None,
+        help="Save the images, stickers and videos loaded in every chat to DIR, named by "
+             "their SHA-256 so forwarded media are stored once, with a manifest mapping "
+             "messages to files."
+    )
+    parser.add_argument(
+        "--media-workers", type=int, default=media_pipeline.DEFAULT_MEDIA_WORKERS,
+        metavar="N",
+        help="Threads writing media files while the next chats are scraped "
+             f"(default: {media_pipeline.DEFAULT_MEDIA_WORKERS})."
+    )
+    parser.add_argument(
+        "--metrics-report", metavar="PATH", default=None,
+        help="Write per-phase and per-chat timings, WebDriver command counts, failed "
+             "lookups by XPath and throughput to PATH as JSON."
+    )
+    parser.add_argument(
+        "--prometheus-textfile", metavar="PATH", default=None,
+        help="Also write the run totals to PATH in the Prometheus text format."
+    )
+    parser.add_argument(
+        "--save-snapshots", metavar="DIR", default=None,
+        help="Save the HTML of every chat in DIR so it can be re-parsed offline "
+             "with html_snapshot_parser.py."
+    )
+    parser.add_argument(
+        "--record-trace", metavar="PATH", default=None,
+        help="Record every WebDriver command with its response and timing to PATH, so the "
+             "run can be replayed without a browser by webdriver_trace.py."
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1 and args.user_data_dir is None:
+        parser.error("--workers needs --user-data-dir so each browser can get its own profile.")
+
+    if args.max_messages_per_chat is not None and args.max_messages_per_chat < 1:
+        parser.error("--max-messages-per-chat must be at least 1.")
+
+    if args.since is not None and args.until is not None and args.since >= args.until:
+        parser.error("--since must be before --until.")
+
+    if args.save_media is not None and args.harvest_while_scrolling:
+        parser.error("--save-media reads the media of the rendered rows once a chat is "
+                     "loaded and cannot be combined with --harvest-while-scrolling.")
+
+    if args.skip_unchanged and args.contact_directory is None:
+        parser.error("--skip-unchanged needs --contact-directory.")
+
+    if args.skip_unchanged and args.incremental is None and args.output_format != "sqlite":
+        parser.error("--skip-unchanged would leave the skipped chats out of the output; "
+                     "use it with --incremental or --output-format sqlite.")
+
+    if args.recycle == "driver" and args.user_data_dir is None:
+        parser.error("--recycle driver needs --user-data-dir to keep the session logged in.")
+
+    if args.recycle == "driver" and args.record_trace is not None:
+        parser.error("--recycle driver cannot be recorded: every restart is a new session.")
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    worker_profiles = []
+    if args.workers > 1:
+        worker_profiles = worker_profile_dirs(args.user_data_dir, args.workers)
+
+    metrics = scrape_metrics.current
+
+    # Initiate driver
+    with metrics.phase("login"):
+        driver = start_session(args, args.user_data_dir, parallel=args.workers > 1)
+    if driver is None:
+        sys.exit(1)
+
+    directory = None
+    if args.contact_directory is not None:
+        directory = contact_directory.ContactDirectory(args.contact_directory)
+
+    # Find all the private chats
+    with metrics.phase("sidebar"):
+        all_contact_names = find_contact_names(
+            driver, sidebar_extraction=args.sidebar_extraction, directory=directory
+        )
+
+    if directory is not None:
+        directory.save()
+
+    if args.skip_unchanged:
+        changed_names = {
+            name: handle for name, handle in all_contact_names.items()
+            if directory.has_new_activity(name)
+        }
+        print(f"Skipping {len(all_contact_names) - len(changed_names)} chats without new "
+              "activity since they were last scraped.")
+        all_contact_names = changed_names
+
+    drivers = [driver]
+    memory_managers = [memory_manager(args, args.user_data_dir, parallel=args.workers > 1)]
+    for worker_id, profile_dir in enumerate(worker_profiles, start=2):
+        name = f"Chrome of worker {worker_id}"
+        with metrics.phase("login"):
+            worker_driver = start_session(
+                args, profile_dir, parallel=True, name=name, worker_id=worker_id
+            )
+        if worker_driver is not None:
+            drivers.append(worker_driver)
+            memory_managers.append(
+                memory_manager(args, profile_dir, parallel=True, name=name, worker_id=worker_id)
+            )
+
+    state = None
+    if args.incremental is not None:
+        state = incremental_state.IncrementalState(args.incremental)
+
+    media = None
+    if args.save_media is not None:
+        media = media_pipeline.MediaPipeline(args.save_media, args.media_workers)
+
+    #Collect messages from each chat and save them as each chat is finished
+    scrape_options = ScrapeOptions.from_args(args, media)
+    if len(drivers) > 1:
+        chats = iter_chat_messages_parallel(
+            all_contact_names, drivers, scrape_options, state, memory_managers
+        )
+    else:
+        chats = iter_chat_messages(
+            all_contact_names, driver, scrape_options, state, memory_managers[0]
+        )
+
+    try:
+        with open_writer(args.output, args.output_format, args.columnar_output) as writer:
+            for contact, messages in chats:
+                with metrics.phase("write"):
+                    writer.write_chat(contact, messages)
+
+                # Only move the high-water mark once the chat is safely on disk
+                if state is not None:
+                    state.commit(contact)
+                    if writer.streaming:
+                        state.save()
+                if directory is not None:
+                    directory.commit(contact)
+                    if writer.streaming:
+                        directory.save()
+
+        if state is not None:
+            state.save()
+        if directory is not None:
+            directory.save()
+
+    finally:
+        # Files already fetched are still written when the run fails
+        if media is not None:
+            media.close()
+
+        # Also written when the run fails, to show where a slow or broken run spent its time
+        metrics.print_summary()
+        if args.metrics_report is not None:
+            metrics.write_json(args.metrics_report)
+        if args.prometheus_textfile is not None:
+            metrics.write_prometheus(args.prometheus_textfile)
 
 
 if __name__=='__main__':
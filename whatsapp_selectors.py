@@ -0,0 +1,85 @@
+"""
+whatsapp_selectors.py
+
+Description: XPath selectors for the parts of the WhatsApp Web page the scraper reads.
+They live in one place so that the Selenium code path and the in-page extraction
+script evaluate exactly the same expressions.
+"""
+
+# Container holding every rendered message row of the open chat
+MESSAGE_LIST_XPATH = '//div[@class="x3psx0u xwib8y2 xkhd6sd xrmvbpv"]'
+
+# A single message row, relative to the message list
+MESSAGE_ROW_XPATH = './/div[@tabindex="-1" and @role="row"]'
+
+# Reply (quoted message) block and its parts
+REPLY_DIV_XPATH = './/div[@class="_ahy0"]'
+REPLY_SENDER_XPATH = './/span[@dir="auto" and contains(@class, "_ao3e")]'
+REPLY_TEXT_XPATH = './/span[@dir="auto" and @class="quoted-mention _ao3e"]'
+REPLY_IMAGE_XPATH = './/span[@data-icon="status-image"]'
+REPLY_VIDEO_XPATH = './/span[@data-icon="status-video"]'
+
+# Messages with text carry their metadata in data-pre-plain-text
+COPYABLE_TEXT_XPATH = './/div[@class="copyable-text"]'
+MESSAGE_TEXT_XPATH = './/span[@class="_ao3e selectable-text copyable-text"]/span'
+
+# Media messages without text
+MEDIA_INFO_XPATH = './/div[@class="_amk6 _amlo"]'
+MEDIA_SENDER_XPATH = './span'
+MEDIA_TIME_XPATH = './/span[@class="x1rg5ohu x16dsc37" and @dir="auto"]'
+
+# Media type indicators
+MEDIA_DOWNLOAD_XPATH = './/span[@data-icon="media-download"]'
+OPEN_PICTURE_XPATH = './/div[@aria-label="Open picture"]'
+STICKER_XPATH = './/div[contains(@label, "Sticker")]'
+VIDEO_XPATH = './/span[@data-icon="msg-video"]'
+
+# Media of a message row loaded by WhatsApp Web: the image, the sticker, or the video
+# (or its preview image until it is played)
+MEDIA_BLOB_XPATH = './/img[starts-with(@src, "blob:")] | .//video[starts-with(@src, "blob:")]'
+
+# Sidebar chat list
+CHAT_LIST_XPATH = '//div[@aria-label="Chat list" and @role="grid"]'
+SIDEBAR_ROW_XPATH = '//div[contains(@class, "x10l6tqk xh8yej3 x1g42fcv")]'
+CHAT_TITLE_XPATH = './/span[@title]'
+
+# Time (or day) of the last message shown in a sidebar row
+PREVIEW_TIME_XPATH = './/div[@class="_ak8i"]'
+
+# Parts of a sidebar row used to tell private chats from groups
+CHAT_PREVIEW_XPATH = './/div[@class="_ak8k"]'
+PROFILE_PHOTO_XPATH = './/div[@class="_ak8n"]'
+PREVIEW_TEXT_XPATH = './/span[@dir="auto"]'
+PREVIEW_AUTHOR_XPATH = './/span[@class="x1rg5ohu _ao3e"]'
+DEFAULT_GROUP_ICON_XPATH = './/span[@data-icon="default-group"]'
+GROUP_PREVIEW_XPATHS = (
+    './/span[contains(@title, "Group")]',
+    './/span[contains(@title, "group")]',
+    './/span[contains(@title, " changed to +")]',
+)
+
+# Element of a message row carrying WhatsApp's message id
+MESSAGE_ID_XPATH = './/*[@data-id]'
+
+# Title of the open chat's header
+CHAT_HEADER_TITLE_XPATH = '//div[@id="main"]//header//span[@dir="auto"]'
+
+# Search box and its results
+SEARCH_BOX_XPATH = '//div[@contenteditable="true" and @role="textbox" and @data-tab="3"]'
+SEARCH_RESULTS_XPATH = './/div[@aria-label="Search results."]'
+SEARCH_RESULT_ROW_XPATH = './/div[@class="x10l6tqk xh8yej3 x1g42fcv" and @role="listitem"]'
+SEARCH_RESULT_TITLE_XPATH = './/span[@dir="auto" and @title]'
+
+# Scrollable container of the open chat
+CHAT_CONTAINER_XPATH = (
+    '//div[@class="x10l6tqk x13vifvy x17qophe xyw6214 x9f619 x78zum5 xdt5ytf'
+    ' xh8yej3 x5yr21d x6ikm8r x1rife3k xjbqb8w x1ewm37j" and @tabindex="0"]'
+)
+
+# Banner at the top of the open chat (syncing, "Click here ...", end of history), and
+# the icon it shows while syncing is paused
+CHAT_BANNER_XPATH = './/div[@class="x78zum5 x6s0dn4 x1r0jzty x17zd0t2"]'
+SYNC_PAUSED_XPATH = './/span[@data-icon="alert-sync-paused"]'
+
+# QR code shown while the browser is not logged in
+QR_CODE_XPATH = '//canvas[contains(@aria-label, "QR code")] | //div[@data-ref]'